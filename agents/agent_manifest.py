@@ -0,0 +1,92 @@
+import os
+import ast
+import time
+import logging
+import importlib
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+AGENT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+# Agents that don't assess an attribute: they run around the attribute agents, when enabled
+REPORT_AGENTS = {"Master Reporting", "Website Comparison", "Final Summary"}
+CONCAT_AGENT = "Nexla Concatenation"
+# Agents that only do something with a validated API key
+API_ONLY_AGENTS = REPORT_AGENTS
+
+# Import time of each agent module loaded through load_agents, in seconds (first import only)
+IMPORT_TIMES: Dict[str, float] = {}
+
+
+@dataclass(frozen=True)
+class AgentSpec:
+    module: str          # e.g. "agents.brand_agent"
+    attribute_name: str  # the name its Agent passes to BaseAgent.__init__
+
+    @property
+    def kind(self) -> str:
+        if self.attribute_name in REPORT_AGENTS:
+            return "report"
+        return "concat" if self.attribute_name == CONCAT_AGENT else "assess"
+
+
+def _attribute_name(path: str) -> Optional[str]:
+    """Reads `super().__init__("<name>", ...)` from the module's Agent class without importing it."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == "Agent":
+            for call in ast.walk(node):
+                if (isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute) and call.func.attr == "__init__"
+                        and call.args and isinstance(call.args[0], ast.Constant)):
+                    return str(call.args[0].value)
+    return None
+
+
+@lru_cache(maxsize=4)
+def _scan(folder: str, stamp: Tuple[Tuple[str, float], ...]) -> Tuple[AgentSpec, ...]:
+    package = os.path.basename(folder)
+    specs = []
+    for filename, _ in stamp:
+        name = _attribute_name(os.path.join(folder, filename))
+        if name is None:
+            logging.error(f"No Agent class with an attribute name found in {filename}; skipped.")
+            continue
+        specs.append(AgentSpec(module=f"{package}.{filename[:-3]}", attribute_name=name))
+    return tuple(specs)
+
+
+def agent_manifest(folder: str = AGENT_FOLDER) -> List[AgentSpec]:
+    """
+    Every `*_agent.py` in `folder` with the name of its Agent, read from the source.
+
+    Nothing is imported: modules (and the libraries they use) load only when an agent is
+    instantiated. The scan is cached until a file is added, removed or edited.
+    """
+    stamp = tuple(sorted(
+        (f, os.path.getmtime(os.path.join(folder, f))) for f in os.listdir(folder)
+        if f.endswith('_agent.py') and f != 'base_agent.py'
+    ))
+    return list(_scan(folder, stamp))
+
+
+def wanted_agents(specs: Sequence[AgentSpec], *, api_key_validated: bool, is_nexla: bool) -> List[AgentSpec]:
+    """The agents a run with these settings uses; the rest are never imported."""
+    return [s for s in specs
+            if (api_key_validated or s.attribute_name not in API_ONLY_AGENTS)
+            and (is_nexla or s.kind != "concat")]
+
+
+def load_agents(specs: Sequence[AgentSpec]) -> Tuple[List, Dict[str, str]]:
+    """Imports and instantiates `specs`; returns (agents, {module: error}) for the ones that failed."""
+    agents, errors = [], {}
+    for spec in specs:
+        try:
+            started = time.perf_counter()
+            module = importlib.import_module(spec.module)
+            IMPORT_TIMES.setdefault(spec.module, time.perf_counter() - started)
+            agents.append(module.Agent())
+        except Exception as e:
+            logging.error(f"Error loading agent from {spec.module}: {e}")
+            errors[spec.module] = str(e)
+    return agents, errors
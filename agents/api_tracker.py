@@ -1,3 +1,4 @@
+import io
 import pandas as pd
 import logging
 from dataclasses import dataclass, asdict
@@ -29,6 +30,21 @@ class UsageRecord:
     completion_tokens: int
     total_tokens: int
     est_cost_usd: float
+    agent: str = ""
+    batch_id: str = ""
+    latency_s: float = 0.0
+    retries: int = 0
+    items: int = 0
+    cache_status: str = "api"  # "api", "cache" (local response cache) or "coalesced"
+
+@dataclass
+class TierRecord:
+    ts: str
+    agent: str
+    tier: int
+    model: str
+    attempted: int
+    settled: int
 
 def _as_int(x: Any, default: int = 0) -> int:
     try:
@@ -49,12 +65,26 @@ def _extract_usage_from_response(response: Any) -> Optional[Dict[str, Any]]:
             return asdict(usage)
     return None
 
+def estimate_usage_cost(model: str, usage: Dict[str, Any], price_table: Optional[Dict[str, Dict[str, float]]] = None) -> float:
+    """USD cost of one response's usage dict at the tracker's prices."""
+    ptd = usage.get("prompt_tokens_details", {}) or {}
+    cached = _as_int(ptd.get("cached_tokens", 0))
+    return ApiUsageTracker(price_table)._estimate_cost_usd(
+        model=model,
+        billable_prompt_tokens=max(_as_int(usage.get("prompt_tokens", 0)) - cached, 0),
+        cached_prompt_tokens=cached,
+        completion_tokens=_as_int(usage.get("completion_tokens", 0)),
+    )
+
 class ApiUsageTracker:
     def __init__(self, price_table: Optional[Dict[str, Dict[str, float]]] = None):
         self.price_table = price_table or PRICES_USD_PER_MTOK
         self._rows: List[UsageRecord] = []
+        self._tiers: List[TierRecord] = []
 
-    def log_call(self, *, endpoint: str, model: str, response: Any = None, usage: Any = None, ts: Optional[datetime] = None):
+    def log_call(self, *, endpoint: str, model: str, response: Any = None, usage: Any = None, ts: Optional[datetime] = None,
+                 agent: str = "", batch_id: str = "", latency_s: float = 0.0, retries: int = 0, items: int = 0,
+                 cache_status: str = "api"):
         usage_dict = usage or _extract_usage_from_response(response)
         if not usage_dict:
             return
@@ -67,7 +97,8 @@ class ApiUsageTracker:
         cached_prompt_tokens = _as_int(ptd.get("cached_tokens", 0))
         billable_prompt_tokens = max(prompt_tokens - cached_prompt_tokens, 0)
 
-        est_cost = self._estimate_cost_usd(
+        # Replayed/shared responses were paid for by the call that fetched them
+        est_cost = 0.0 if cache_status != "api" else self._estimate_cost_usd(
             model=model,
             billable_prompt_tokens=billable_prompt_tokens,
             cached_prompt_tokens=cached_prompt_tokens,
@@ -78,15 +109,43 @@ class ApiUsageTracker:
             ts=(ts or datetime.utcnow()).isoformat(), endpoint=endpoint, model=model,
             prompt_tokens=prompt_tokens, cached_prompt_tokens=cached_prompt_tokens,
             billable_prompt_tokens=billable_prompt_tokens, completion_tokens=completion_tokens,
-            total_tokens=total_tokens, est_cost_usd=est_cost,
+            total_tokens=total_tokens, est_cost_usd=est_cost, agent=agent,
+            batch_id=batch_id, latency_s=round(float(latency_s), 4), retries=_as_int(retries), items=_as_int(items),
+            cache_status=cache_status,
         )
         self._rows.append(rec)
 
+    def log_tier(self, *, agent: str, tier: int, model: str, attempted: int, settled: int):
+        """Records how many items one cascade tier settled before the rest escalated."""
+        self._tiers.append(TierRecord(
+            ts=datetime.utcnow().isoformat(), agent=agent, tier=tier, model=model,
+            attempted=attempted, settled=settled,
+        ))
+
+    def tier_summary(self) -> pd.DataFrame:
+        """Per-agent, per-tier hit rates for the model cascade."""
+        cols = ["Agent", "Tier", "Model", "Items", "Settled", "Escalated", "Hit Rate"]
+        if not self._tiers:
+            return pd.DataFrame(columns=cols)
+
+        df = pd.DataFrame([asdict(r) for r in self._tiers])
+        grouped = df.groupby(["agent", "tier", "model"], as_index=False)[["attempted", "settled"]].sum()
+        grouped["Escalated"] = grouped["attempted"] - grouped["settled"]
+        grouped["Hit Rate"] = (grouped["settled"] / grouped["attempted"].where(grouped["attempted"] > 0)).fillna(0.0).map('{:.1%}'.format)
+        return grouped.rename(columns={
+            "agent": "Agent", "tier": "Tier", "model": "Model", "attempted": "Items", "settled": "Settled",
+        })[cols]
+
+    def _billed_frame(self) -> pd.DataFrame:
+        """Rows that actually went to the API (what billing and provider-cache stats are based on)."""
+        df = pd.DataFrame([asdict(r) for r in self._rows])
+        return df[df["cache_status"] == "api"].copy() if not df.empty else df
+
     def summary(self) -> pd.DataFrame:
-        if not self._rows:
+        df = self._billed_frame()
+        if df.empty:
             return pd.DataFrame(columns=["Model", "Endpoint(s)", "Calls", "Prompt Tokens", "Completion Tokens", "Total Tokens", "Estimated Cost (USD)"])
 
-        df = pd.DataFrame([asdict(r) for r in self._rows])
         grouped = df.groupby("model").agg(
             Calls=("model", "count"),
             Prompt_Tokens=("prompt_tokens", "sum"),
@@ -112,12 +171,149 @@ class ApiUsageTracker:
         summary["Estimated Cost (USD)"] = summary["Estimated Cost (USD)"].map('{:,.6f}'.format)
         return summary
 
+    def cache_summary(self) -> pd.DataFrame:
+        """Per-agent prompt-cache hit ratio: share of prompt tokens served from the provider cache."""
+        cols = ["Agent", "Calls", "Prompt Tokens", "Cached Prompt Tokens", "Cache Hit Ratio", "Cache Savings (USD)"]
+        df = self._billed_frame()
+        if df.empty:
+            return pd.DataFrame(columns=cols)
+
+        df["agent"] = df["agent"].replace("", "Other")
+        # What the cached tokens would have cost at the full input price
+        discount = {m: self._cached_discount_per_token(m) for m in df["model"].unique()}
+        df["cache_savings"] = df["cached_prompt_tokens"] * df["model"].map(discount)
+        grouped = df.groupby("agent").agg(
+            Calls=("agent", "count"),
+            Prompt_Tokens=("prompt_tokens", "sum"),
+            Cached_Prompt_Tokens=("cached_prompt_tokens", "sum"),
+            Cache_Savings=("cache_savings", "sum"),
+        ).reset_index()
+        grouped["Cache Hit Ratio"] = (
+            grouped["Cached_Prompt_Tokens"] / grouped["Prompt_Tokens"].where(grouped["Prompt_Tokens"] > 0)
+        ).fillna(0.0).map('{:.1%}'.format)
+        grouped["Cache_Savings"] = grouped["Cache_Savings"].map('{:,.6f}'.format)
+        return grouped.rename(columns={
+            "agent": "Agent", "Prompt_Tokens": "Prompt Tokens",
+            "Cached_Prompt_Tokens": "Cached Prompt Tokens", "Cache_Savings": "Cache Savings (USD)",
+        })[cols]
+
+    def performance_summary(self) -> pd.DataFrame:
+        """
+        Per-agent cost, latency and throughput. Throughput is measured over the agent's
+        wall-clock window (first call start to last call end), so parallel calls count once.
+        """
+        cols = ["Agent", "Calls", "Batches", "Items", "Retries", "Local Hits", "Total Tokens", "Cost (USD)",
+                "p50 Latency (s)", "p95 Latency (s)", "Items/sec", "Tokens/sec"]
+        if not self._rows:
+            return pd.DataFrame(columns=cols)
+
+        df = self._records_frame()
+        rows = []
+        for agent, g in df.groupby("agent", sort=True):
+            window = (g["ended"].max() - g["started"].min()).total_seconds()
+            window = window if window > 0 else g["latency_s"].sum()
+            rows.append({
+                "Agent": agent,
+                "Calls": len(g),
+                "Batches": g.loc[g["batch_id"] != "", "batch_id"].nunique(),
+                "Items": int(g["items"].sum()),
+                "Retries": int((g["retries"] > 0).sum()),
+                "Local Hits": f"{(g['cache_status'] != 'api').mean():.1%}",
+                "Total Tokens": int(g["total_tokens"].sum()),
+                "Cost (USD)": f"{g['est_cost_usd'].sum():,.6f}",
+                "p50 Latency (s)": round(float(g["latency_s"].quantile(0.5)), 2),
+                "p95 Latency (s)": round(float(g["latency_s"].quantile(0.95)), 2),
+                "Items/sec": round(g["items"].sum() / window, 2) if window > 0 else 0.0,
+                "Tokens/sec": round(g["total_tokens"].sum() / window, 1) if window > 0 else 0.0,
+            })
+        return pd.DataFrame(rows, columns=cols)
+
+    def _records_frame(self) -> pd.DataFrame:
+        df = pd.DataFrame([asdict(r) for r in self._rows])
+        df["agent"] = df["agent"].replace("", "Other")
+        # `ts` is logged when the response arrives
+        df["ended"] = pd.to_datetime(df["ts"])
+        df["started"] = df["ended"] - pd.to_timedelta(df["latency_s"], unit="s")
+        return df
+
+    def run_stats(self) -> Dict[str, Any]:
+        """Per-agent API totals and cascade escalation rates, as stored in the run history."""
+        agents: Dict[str, Dict[str, float]] = {}
+        if self._rows:
+            df = self._records_frame()
+            df = df[df["cache_status"] == "api"]
+            for agent, g in df.groupby("agent"):
+                agents[agent] = {
+                    "calls": int(len(g)),
+                    "prompt_tokens": int(g["prompt_tokens"].sum()),
+                    "completion_tokens": int(g["completion_tokens"].sum()),
+                    "llm_wall_s": round((g["ended"].max() - g["started"].min()).total_seconds(), 3),
+                }
+        escalation: Dict[str, float] = {}
+        first_tiers = [r for r in self._tiers if r.tier == 0 and r.attempted]
+        for agent in {r.agent for r in first_tiers}:
+            rows = [r for r in first_tiers if r.agent == agent]
+            escalation[agent] = round(1 - sum(r.settled for r in rows) / sum(r.attempted for r in rows), 4)
+        return {"agents": agents, "escalation": escalation}
+
+    def export_csv(self) -> str:
+        """Every call record as CSV (one row per LLM call)."""
+        cols = list(UsageRecord.__dataclass_fields__)
+        return pd.DataFrame([asdict(r) for r in self._rows], columns=cols).to_csv(index=False)
+
+    def export_openmetrics(self, prefix: str = "mx_llm") -> str:
+        """Per-agent counters and a latency summary in OpenMetrics text format."""
+        out = io.StringIO()
+        if not self._rows:
+            out.write("# EOF\n")
+            return out.getvalue()
+
+        df = self._records_frame()
+
+        def label(**labels) -> str:
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in labels.values())
+            return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+        counters = [
+            ("calls", "LLM calls", None),
+            ("items", "Items sent to the LLM", "items"),
+            ("retries", "Calls that re-sent re-queued items", None),
+            ("prompt_tokens", "Prompt tokens", "prompt_tokens"),
+            ("cached_prompt_tokens", "Prompt tokens served from the provider cache", "cached_prompt_tokens"),
+            ("completion_tokens", "Completion tokens", "completion_tokens"),
+            ("cost_usd", "Estimated cost in USD", "est_cost_usd"),
+        ]
+        grouped = df.groupby(["agent", "model", "cache_status"])
+        for name, help_text, col in counters:
+            out.write(f"# TYPE {prefix}_{name} counter\n# HELP {prefix}_{name} {help_text}.\n")
+            for (agent, model, status), g in grouped:
+                if name == "calls":
+                    value = len(g)
+                elif name == "retries":
+                    value = int((g["retries"] > 0).sum())
+                else:
+                    value = g[col].sum()
+                out.write(f"{prefix}_{name}_total{label(agent=agent, model=model, cache_status=status)} {value:g}\n")
+
+        out.write(f"# TYPE {prefix}_latency_seconds summary\n# HELP {prefix}_latency_seconds LLM call latency.\n")
+        for agent, g in df.groupby("agent"):
+            for q in (0.5, 0.95):
+                out.write(f'{prefix}_latency_seconds{label(agent=agent, quantile=q)} {g["latency_s"].quantile(q):g}\n')
+            out.write(f'{prefix}_latency_seconds_sum{label(agent=agent)} {g["latency_s"].sum():g}\n')
+            out.write(f'{prefix}_latency_seconds_count{label(agent=agent)} {len(g)}\n')
+        out.write("# EOF\n")
+        return out.getvalue()
+
     def _get_prices(self, model: str) -> Dict[str, float]:
         if model not in self.price_table:
             logging.warning(f"Model '{model}' not in price table. Using 'default' prices.")
             return self.price_table["default"]
         return self.price_table[model]
 
+    def _cached_discount_per_token(self, model: str) -> float:
+        prices = self._get_prices(model)
+        return (prices["input"] - prices.get("cached_input", prices["input"])) / 1_000_000
+
     def _estimate_cost_usd(self, *, model: str, billable_prompt_tokens: int, cached_prompt_tokens: int, completion_tokens: int) -> float:
         prices = self._get_prices(model)
         i_cost = (billable_prompt_tokens / 1_000_000) * prices["input"]
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import pickle
+import inspect
+import logging
+from io import BytesIO
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+import pandas as pd
+import streamlit as st
+
+from .api_tracker import ApiUsageTracker
+from .display_render import BOOLEAN_FLAGS, readable_column_order
+from .llm_budget import RunBudget
+from .llm_client import budget_scope
+from .run_planner import record_run
+from .run_profiler import RunProfiler
+
+# Agents that run around the attribute agents rather than in the attribute loop
+NON_ATTRIBUTE_AGENTS = {"Master Reporting", "Website Comparison", "Final Summary", "Nexla Concatenation"}
+# Settings a run reads (the Streamlit session or a queued job's settings provide them)
+RUN_SETTINGS = [
+    "vertical", "is_nexla", "style_guide", "agent_model", "use_model_cascade", "website_url",
+    "api_key_validated", "budget_usd", "budget_tokens", "budget_minutes", "profile_mode", "trace_memory",
+]
+
+# progress(step, total_steps, message)
+ProgressCallback = Callable[[int, int, str], None]
+
+
+def read_merchant_file(file_content: bytes, file_name: str) -> Optional[pd.DataFrame]:
+    """
+    Loads a dataframe from file content and standardizes column names
+    to ensure consistency for all downstream agents.
+    """
+    try:
+        dtype_spec = {'BUSINESS_ID': str, 'MSID': str, 'UPC': str}
+
+        if file_name.lower().endswith('.csv'):
+            df = pd.read_csv(BytesIO(file_content), low_memory=False, dtype=dtype_spec)
+        elif file_name.lower().endswith(('.xls', '.xlsx')):
+            df = pd.read_excel(BytesIO(file_content), dtype=dtype_spec)
+        else:
+            logging.error("Unsupported file type provided.")
+            return None
+
+        # --- Column Standardization Logic ---
+        column_mapping = {
+            'merchant supplied id (msid)': 'MSID',
+            'item name': 'CONSUMER_FACING_ITEM_NAME',
+            'brand': 'BRAND_NAME',
+            'photo url': 'IMAGE_URL',
+            'size': 'SIZE',
+            'unit of measure': 'UNIT_OF_MEASUREMENT',
+            'uom': 'UNIT_OF_MEASUREMENT',
+            'l1 category': 'L1_CATEGORY', 'l2 category': 'L2_CATEGORY',
+            'l3 category': 'L3_CATEGORY', 'l4 category': 'L4_CATEGORY',
+            'product group': 'PRODUCT_GROUP',
+            'variant': 'VARIANT',
+            'details': 'DESCRIPTION',
+            'short_description': 'DESCRIPTION',
+            'weighted item': 'IS_WEIGHTED_ITEM',
+            'average weight': 'AVERAGE_WEIGHT_PER_EACH',
+            'snap': 'SNAP_ELIGIBLE',
+            'plu': 'PLU'
+        }
+        canonical_map = {k: v for k, v in column_mapping.items()}
+        for target_name in column_mapping.values():
+            canonical_map[target_name.lower()] = target_name
+
+        df.rename(columns=lambda c: canonical_map.get(c.strip().lower(), c), inplace=True)
+        logging.info(f"Standardized columns. New columns: {df.columns.tolist()}")
+        return df
+
+    except Exception as e:
+        logging.error(f"Error reading and standardizing file: {e}")
+        return None
+
+
+def configure_agent(agent, settings: Mapping[str, Any]) -> None:
+    mapping = {
+        'taxonomy_df': 'taxonomy_df', 'vertical': 'vertical',
+        'is_nexla_mx': 'is_nexla', 'style_guide': 'style_guide',
+        'use_model_cascade': 'use_model_cascade',
+    }
+    for agent_attr, session_key in mapping.items():
+        if hasattr(agent, agent_attr):
+            setattr(agent, agent_attr, settings.get(session_key))
+    if hasattr(agent, 'model'):
+        setattr(agent, 'model', settings.get('agent_model'))
+
+
+@dataclass
+class PipelineResult:
+    df: pd.DataFrame
+    summary_df: pd.DataFrame
+    full_report: Optional[Dict[str, Any]] = None
+    website_comparison_report: Optional[Any] = None
+    final_summary: Optional[Dict[str, Any]] = None
+    taxonomy_mapping_df: Optional[pd.DataFrame] = None
+    budget_status: Optional[Dict[str, Any]] = None
+    manifest: Optional[Dict[str, Any]] = None
+
+
+def run_pipeline(
+    agents: List,
+    df: pd.DataFrame,
+    settings: Mapping[str, Any],
+    progress: Optional[ProgressCallback] = None,
+    profiler: Optional[RunProfiler] = None,
+) -> PipelineResult:
+    """
+    Runs the agents over `df` and builds the summary and reports, without any UI.
+
+    `settings` holds RUN_SETTINGS plus `api_key` and `taxonomy_df`; `progress` is told
+    about each step. The Streamlit page and the background worker both call this.
+    """
+    profiler = profiler or RunProfiler()
+    progress = progress or (lambda step, total, message: logging.info(f"Step {step}/{total}: {message}"))
+    api_key = settings.get("api_key")
+    api_key_validated = settings.get("api_key_validated")
+    is_nexla = settings.get("is_nexla")
+    reporting_agent = next((a for a in agents if a.attribute_name == "Master Reporting"), None)
+    website_agent = next((a for a in agents if a.attribute_name == "Website Comparison"), None)
+    final_summary_agent = next((a for a in agents if a.attribute_name == "Final Summary"), None)
+    concat_agent = next((a for a in agents if a.attribute_name == "Nexla Concatenation"), None)
+
+    assessment_agents = [a for a in agents if getattr(a, "attribute_name", "").strip() not in NON_ATTRIBUTE_AGENTS]
+    assessment_agents.sort(key=lambda a: 0 if getattr(a, "attribute_name", "").strip().lower().startswith("category") else 1)
+
+    total_steps = len(assessment_agents)
+    if is_nexla and concat_agent:
+        total_steps += 1
+    if reporting_agent and api_key_validated:
+        total_steps += 1
+    if website_agent and api_key_validated:
+        total_steps += 1
+    total_steps += 3
+
+    step = 0
+    result = PipelineResult(df=df, summary_df=pd.DataFrame())
+
+    # --- Centralized Data Cleaning Step for Calculations ---
+    step += 1
+    progress(step, total_steps, "Standardizing data types for calculation...")
+
+    for flag_col in BOOLEAN_FLAGS:
+        if flag_col in df.columns:
+            df[flag_col] = pd.to_numeric(df[flag_col], errors='coerce')
+
+    logging.info("Data types standardized for all agents.")
+
+    if is_nexla and concat_agent:
+        step += 1
+        progress(step, total_steps, "Running Nexla Concatenation...")
+        with profiler.step(concat_agent.attribute_name, kind="assess", rows=len(df)):
+            df = concat_agent.assess(df)
+
+    for agent in assessment_agents:
+        step += 1
+        progress(step, total_steps, f"Running {agent.attribute_name} Agent...")
+        configure_agent(agent, settings)
+
+        agent_params = inspect.signature(agent.assess).parameters
+        with profiler.step(agent.attribute_name, kind="assess", rows=len(df)):
+            if 'api_key' in agent_params:
+                df = agent.assess(df, api_key=api_key)
+            else:
+                df = agent.assess(df)
+
+    step += 1
+    progress(step, total_steps, "Generating summaries...")
+
+    summary_data = []
+    for agent in assessment_agents:
+        with profiler.step(agent.attribute_name, kind="summary", rows=len(df)):
+            summary_data.append(agent.get_summary(df))
+    summary_df = pd.DataFrame(summary_data)
+    total_skus = len(df)
+
+    summary_df['issue_count'] = pd.to_numeric(summary_df['issue_count'], errors='coerce').fillna(0)
+    summary_df['Issue Rate'] = summary_df.apply(
+        lambda row: f"{(row['issue_count'] / total_skus * 100):.2f}%" if total_skus > 0 else "0.00%", axis=1)
+
+    summary_df.rename(columns={'name': 'Attribute', 'issue_count': 'Issues Found'}, inplace=True)
+
+    display_cols = ['Attribute', 'Issues Found', 'Issue Rate']
+    for col in ['coverage_count', 'duplicate_count']:
+        if col in summary_df.columns:
+            display_cols.append(col)
+
+    result.summary_df = summary_df[display_cols]
+
+    if reporting_agent and api_key_validated:
+        step += 1
+        progress(step, total_steps, "Generating Attribute-by-Attribute Report...")
+        report_step = step
+        with profiler.step(reporting_agent.attribute_name, kind="report", rows=len(df)):
+            result.full_report = reporting_agent.assess(
+                df, vertical=settings.get("vertical"), api_key=api_key,
+                progress_callback=lambda done, total, name: progress(
+                    report_step, total_steps, f"Attribute report {done}/{total} ready ({name})..."
+                ),
+            )
+
+    if website_agent and api_key_validated:
+        step += 1
+        progress(step, total_steps, "Generating Website Comparison Report...")
+        with profiler.step(website_agent.attribute_name, kind="report", rows=len(df)):
+            result.website_comparison_report = website_agent.assess(df, api_key=api_key, website_url=settings.get("website_url"))
+
+    if final_summary_agent and api_key_validated:
+        with profiler.step(final_summary_agent.attribute_name, kind="report"):
+            result.final_summary = final_summary_agent.assess(result.full_report, api_key=api_key)
+
+        step += 1
+        progress(step, total_steps, "Preparing final report for display...")
+
+    result.df = df
+    # The Category agent leaves its mapping in the session (a plain dict outside `streamlit run`)
+    result.taxonomy_mapping_df = st.session_state.pop("taxonomy_mapping_df", None)
+    return result
+
+
+def run_assessment(
+    agents: List,
+    df: pd.DataFrame,
+    settings: Mapping[str, Any],
+    tracker: ApiUsageTracker,
+    progress: Optional[ProgressCallback] = None,
+    profiler: Optional[RunProfiler] = None,
+) -> PipelineResult:
+    """run_pipeline under the settings' run budget; records throughput history for the estimator."""
+    profiler = profiler or RunProfiler()
+    budget = RunBudget(
+        max_usd=settings.get("budget_usd") or 0.0, max_tokens=settings.get("budget_tokens") or 0,
+        max_seconds=(settings.get("budget_minutes") or 0.0) * 60,
+    )
+    run_started = time.perf_counter()
+    with budget_scope(budget if budget.enabled else None):
+        result = run_pipeline(agents, df, settings, progress=progress, profiler=profiler)
+    result.budget_status = budget.status() if budget.enabled else None
+    # Throughput history for the cost & time estimator
+    record_run(tracker, rows=len(df), wall_s=time.perf_counter() - run_started)
+    return result
+
+
+# --- Saved results (background jobs) ---
+RESULT_FRAMES = ("assessed", "taxonomy_mapping", "summary")
+REPORT_FILE = "report.json"
+TRACKER_FILE = "api_tracker.pkl"
+
+
+def save_result(result: PipelineResult, tracker: ApiUsageTracker, folder: str, is_nexla: bool) -> None:
+    """Writes a finished run to `folder` so the app can reopen it later (see load_result)."""
+    os.makedirs(folder, exist_ok=True)
+    frames = {
+        "assessed": result.df[readable_column_order(result.df.columns, is_nexla)],
+        "taxonomy_mapping": result.taxonomy_mapping_df,
+        "summary": result.summary_df,
+    }
+    for name, frame in frames.items():
+        if frame is not None:
+            frame.to_pickle(os.path.join(folder, f"{name}.pkl"))
+    report = {
+        "full_report": result.full_report, "website_comparison_report": result.website_comparison_report,
+        "final_summary": result.final_summary, "budget_status": result.budget_status, "manifest": result.manifest,
+    }
+    with open(os.path.join(folder, REPORT_FILE), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+    with open(os.path.join(folder, TRACKER_FILE), "wb") as f:
+        pickle.dump(tracker, f)
+
+
+def result_frame_paths(folder: str) -> Dict[str, str]:
+    """{frame name: pickle path} for the frames a saved run has."""
+    paths = {name: os.path.join(folder, f"{name}.pkl") for name in RESULT_FRAMES}
+    return {name: path for name, path in paths.items() if os.path.exists(path)}
+
+
+def load_result(folder: str) -> Tuple[Dict[str, Any], ApiUsageTracker]:
+    """The report parts and usage tracker of a run saved by save_result; frames are read by the caller."""
+    with open(os.path.join(folder, REPORT_FILE), encoding="utf-8") as f:
+        report = json.load(f)
+    with open(os.path.join(folder, TRACKER_FILE), "rb") as f:
+        tracker = pickle.load(f)
+    return report, tracker
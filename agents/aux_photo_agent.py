@@ -2,10 +2,8 @@ from .base_agent import BaseAgent
 import pandas as pd
 import logging
 import json
-import requests
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import random
-from tqdm import tqdm
 import re
 import ast
 from typing import List
@@ -80,6 +78,9 @@ class Agent(BaseAgent):
         
         # Only proceed if we have URLs to check
         if live_check_urls:
+            # Deferred: only the live check needs them
+            import requests
+            from tqdm import tqdm
             sample_size = min(500, len(live_check_urls))
             sample_urls = random.sample(live_check_urls, sample_size)
             logging.info(f"Performing live check on a sample of {len(sample_urls)} auxiliary images...")
@@ -1,9 +1,28 @@
 import pandas as pd
-from openai import OpenAI
 import logging
 import json 
 import re
+import time
+import threading
 import streamlit as st
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .llm_budget import BudgetExceeded
+from .llm_client import (
+    DeferredRequest, active_budget, call_annotations, chat_completion, current_annotations, is_dry_run, last_call_source,
+)
+from .llm_batching import is_retriable_error, run_validated_batches
+from .llm_parsing import ResponseSchema
+
+
+def _no_answer(result: Any) -> bool:
+    """True when a call_ai-style result carries no answer a larger model could improve on."""
+    if not isinstance(result, dict) or "error" not in result:
+        return False
+    if result.get("deferred") or result.get("budget_exhausted"):
+        return True
+    return not result.get("raw_content") and not is_retriable_error(result)
+
 
 class BaseAgent:
     """A blueprint for all our assessment agents."""
@@ -11,6 +30,13 @@ class BaseAgent:
         self.attribute_name = attribute_name
         self.issue_column = issue_column_name or f'{attribute_name.replace(" ", "")}Issues?'
         self.json_mode_models = ["gpt-5","gpt-5-chat-latest", "gpt-5-mini", "gpt-5-nano","gpt5-thinking", "gpt-4o"]
+        # Per-request token budgets used by the adaptive batcher (agents/llm_batching.py)
+        self.max_prompt_tokens = 12000
+        self.max_completion_tokens = 4000
+        # Model cascade: cheaper tiers answer first, self.model only sees what they couldn't settle
+        self.use_model_cascade = True
+        self.cascade_models: List[str] = ["gpt-5-mini"]
+        self.escalation_confidence = 0.7
 
     def assess(self, df: pd.DataFrame) -> pd.DataFrame:
         """Each agent must have an 'assess' method."""
@@ -40,33 +66,141 @@ class BaseAgent:
             
         return {"name": self.attribute_name, "issue_count": issue_count, "issue_percent": issue_percent}
 
-    def call_ai(self, prompt: str, api_key: str, model: str) -> dict:
-        """Shared helper to call OpenAI API with enhanced logging."""
+    def run_model_cascade(
+        self,
+        batches: List[List[Any]],
+        call_fn: Callable[[List[Any], str], Any],
+        schema: ResponseSchema,
+        item_id: Callable[[Any], str],
+        *,
+        confidence_field: Optional[str] = None,
+        **batch_kwargs,
+    ) -> Tuple[Dict[str, dict], Dict[str, str]]:
+        """
+        Runs batches through the model tiers, cheapest first.
+
+        An item is settled by a tier when its answer passes `schema` and, if `confidence_field`
+        is given, reports at least `self.escalation_confidence` (a missing value counts as
+        confident). Only answers that came back unsure or failed the schema move to the next
+        tier; calls that got no answer (deferred to a batch job, over budget, or broken in a
+        way a retry can't fix) are final and returned as failures. The last tier (self.model)
+        is final. `call_fn(batch, model)` returns a call_ai-style result. Returns
+        (results, failures) like run_validated_batches.
+        """
+        cascade = self.cascade_models if self.use_model_cascade else []
+        tiers = [m for m in dict.fromkeys(cascade) if m != self.model] + [self.model]
+        key = lambda it: schema.normalize_id(item_id(it))
+
+        results: Dict[str, dict] = {}
+        failures: Dict[str, str] = {}
+        pending = {key(it) for batch in batches for it in batch}
+        # item key -> its last call got no answer at all (escalating can't help)
+        unanswered: Dict[str, bool] = {}
+        lock = threading.Lock()
+
+        def tier_call(batch, model):
+            try:
+                result = call_fn(batch, model)
+            except Exception:
+                no_answer = True
+                raise
+            else:
+                no_answer = _no_answer(result)
+            finally:
+                with lock:
+                    for it in batch:
+                        unanswered[key(it)] = no_answer
+            return result
+
+        for tier, model in enumerate(tiers):
+            final = tier == len(tiers) - 1
+            tier_batches = [b for b in ([it for it in batch if key(it) in pending] for batch in batches) if b]
+            if not tier_batches:
+                break
+            valid, failed = run_validated_batches(
+                tier_batches, lambda batch, m=model: tier_call(batch, m), schema, item_id, **batch_kwargs
+            )
+            settled = {
+                k: v for k, v in valid.items()
+                if final or confidence_field is None or self._is_confident(v.get(confidence_field))
+            }
+            stuck = failed if final else {k: e for k, e in failed.items() if unanswered.get(k, True)}
+            results.update(settled)
+            failures.update(stuck)
+            attempted = len(pending) - len(stuck)
+            pending -= settled.keys() | stuck.keys()
+            logging.info(f"'{self.attribute_name}' cascade tier {tier} ({model}): settled {len(settled)}/{attempted} answered items"
+                         + (f", {len(stuck)} unanswered." if stuck else "."))
+            if attempted and 'api_tracker' in st.session_state and not is_dry_run():
+                st.session_state.api_tracker.log_tier(
+                    agent=self.attribute_name, tier=tier, model=model, attempted=attempted, settled=len(settled)
+                )
+        return results, failures
+
+    def _is_confident(self, value: Any) -> bool:
+        if value is None:
+            return True
+        try:
+            return float(value) >= self.escalation_confidence
+        except (TypeError, ValueError):
+            return False
+
+    def _log_usage(self, model: str, response: Any, latency_s: float, items: int = 1):
+        """Records one completion in the session's tracker with this agent's attribution."""
+        if 'api_tracker' not in st.session_state:
+            return
+        fields = {"items": items, **current_annotations(), "agent": self.attribute_name}
+        st.session_state.api_tracker.log_call(
+            endpoint="chat.completions",
+            model=model,
+            response=response,
+            latency_s=latency_s,
+            cache_status=last_call_source(),
+            **fields,
+        )
+
+    def _note_budget_fallback(self, items: int, detail: str = "rule-based result only"):
+        """Records that `items` were answered without AI because the run budget ran out."""
+        budget = active_budget()
+        if budget is not None and items:
+            budget.record_fallback(self.attribute_name, items, detail)
+
+    def call_ai(self, prompt: str, api_key: str, model: str, system: Optional[str] = None) -> dict:
+        """
+        Shared helper to call OpenAI API with enhanced logging.
+
+        `system` carries the instructions that are identical across calls; `prompt` carries the
+        per-call data. Keeping the stable part first lets the provider's prefix cache hit.
+        """
         try:
             # --- IMPROVEMENT: Enhanced Logging ---
             logging.info(f"Calling AI model '{model}' for '{self.attribute_name}' agent...")
             # Log a snippet of the prompt for debugging, without revealing sensitive data if any.
             logging.debug(f"Prompt snippet: {prompt[:200]}...")
 
-            client = OpenAI(api_key=api_key)
+            messages = [{"role": "system", "content": system}] if system else []
+            messages.append({"role": "user", "content": prompt})
             params = {
                 "model": model,
-                "messages": [{"role": "user", "content": prompt}]
+                "messages": messages
             }
             if model in self.json_mode_models:
                 params["response_format"] = {"type": "json_object"}
             
-            response = client.chat.completions.create(**params)
+            # Shared client + process-wide concurrency limit (agents/llm_client.py)
+            started = time.perf_counter()
+            with call_annotations(agent=self.attribute_name):
+                response = chat_completion(api_key, params)
 
             # --- ADDED: Log the API call usage to the tracker ---
-            if 'api_tracker' in st.session_state:
-                st.session_state.api_tracker.log_call(
-                    endpoint="chat.completions",
-                    model=model,
-                    response=response
-                )
+            self._log_usage(model, response, time.perf_counter() - started)
 
             content = response.choices[0].message.content
+
+            # A truncated completion can't be valid JSON; report it so batches can be split
+            if getattr(response.choices[0], "finish_reason", None) == "length":
+                logging.warning(f"AI response for '{self.attribute_name}' was truncated (finish_reason=length).")
+                return {"error": "Response truncated (finish_reason=length).", "raw_content": content}
             
             logging.info(f"Successfully received AI response for '{self.attribute_name}'.")
 
@@ -77,9 +211,21 @@ class BaseAgent:
                     return json.loads(match.group(1))
                 else:
                     logging.warning("Could not parse JSON from older model response.")
-                    return {"error": "Failed to parse JSON response."}
-            
-            return json.loads(content)
+                    return {"error": "Failed to parse JSON response.", "raw_content": content}
+
+            try:
+                return json.loads(content)
+            except json.JSONDecodeError as e:
+                # Keep the raw text so callers can salvage the well-formed part
+                logging.warning(f"AI response for '{self.attribute_name}' is not valid JSON: {e}")
+                return {"error": f"Failed to parse JSON response: {e}", "raw_content": content}
+        except DeferredRequest as e:
+            # Batch mode: the answer arrives with the batch job and is replayed from the cache
+            logging.info(f"'{self.attribute_name}': {e}")
+            return {"error": str(e), "deferred": True}
+        except BudgetExceeded as e:
+            logging.warning(f"'{self.attribute_name}': {e}")
+            return {"error": str(e), "budget_exhausted": True}
         except Exception as e:
             logging.error(f"AI call failed for '{self.attribute_name}': {e}", exc_info=True)
             return {"error": str(e)}
@@ -1,14 +1,17 @@
 from .base_agent import BaseAgent
+from .llm_budget import BudgetExceeded, is_budget_error
+from .llm_client import DeferredRequest, call_annotations, chat_completion
+from .llm_batching import estimate_tokens, pack_batches, run_validated_batches
+from .llm_parsing import ResponseSchema
+from .distilled_classifier import confident_predictions, load_classifier, record_verdicts
 import pandas as pd
 import re
-from openai import OpenAI
 import os
 import json
 import random
-from tqdm import tqdm
+import time
 import streamlit as st
 from io import BytesIO
-import docx
 import numpy as np
 import logging
 
@@ -18,6 +21,21 @@ class Agent(BaseAgent):
         self.taxonomy_df = None
         self.vertical = "CnG"
         self.model = "gpt-4o"
+        # Expected response size per category path in the taxonomy mapping
+        self.completion_tokens_per_item = 200
+        self.max_categories_per_batch = 20
+        self.response_schema = ResponseSchema(
+            container="list",
+            list_key="assessment",
+            id_field="Mx_Category",
+            required={"Mx_Category": str, "Recommended_Taxonomy": str},
+            normalize_id=lambda v: str(v).strip().lower(),
+        )
+        # Local classifier distilled from past AI mappings (train_distilled_models.py)
+        self.use_distilled_model = True
+        self.record_ai_verdicts = True
+        self.distilled_min_confidence = 0.95
+        self.distilled_min_agreement = 0.95
 
     def assess(self, df: pd.DataFrame, api_key: str = None) -> pd.DataFrame:
         """
@@ -39,14 +57,14 @@ class Agent(BaseAgent):
             try:
                 # Bug Fix: Pass api_key to the helper method
                 mapping_df = self.run_detailed_taxonomy_mapping(df, api_key)
-                # Save the result to session state for download
-                st.session_state.taxonomy_mapping_csv = mapping_df.to_csv(index=False).encode('utf-8')
+                # Save the result to session state; the app turns it into a download on demand
+                st.session_state.taxonomy_mapping_df = mapping_df
                 logging.info("Detailed taxonomy mapping complete and saved to session state.")
             except Exception as e:
                 logging.error(f"Error during detailed taxonomy mapping: {e}", exc_info=True)
-                st.session_state.taxonomy_mapping_csv = None
+                st.session_state.taxonomy_mapping_df = None
         else:
-            st.session_state.taxonomy_mapping_csv = None
+            st.session_state.taxonomy_mapping_df = None
 
 
         return df
@@ -155,7 +173,6 @@ class Agent(BaseAgent):
         """
         New, intensive AI assessment to map merchant taxonomy to DoorDash standards.
         """
-        client = OpenAI(api_key=api_key)
         vertical_taxonomy_rows, l1_col, l2_col = self.get_vertical_taxonomy()
 
         if vertical_taxonomy_rows.empty:
@@ -167,41 +184,112 @@ class Agent(BaseAgent):
         catalog_df["Category_Path"] = catalog_df[[f'L{i}_CATEGORY' for i in range(1, 5) if f'L{i}_CATEGORY' in catalog_df.columns]].fillna("").agg(" > ".join, axis=1).str.strip(" >")
 
         def sample_skus_by_taxonomy(df, samples_per_taxonomy=1):
+            # Shuffle then take the first rows per path (groupby.apply drops the key column on pandas 3)
             return (
-                df.groupby("Category_Path", group_keys=False)
-                  .apply(lambda x: x.sample(min(len(x), samples_per_taxonomy)))
+                df.sample(frac=1.0, random_state=42)
+                  .groupby("Category_Path", sort=False).head(samples_per_taxonomy)
+                  .sort_values("Category_Path", kind="stable")
                   .reset_index(drop=True)
             )
 
         sampled_catalog_df = sample_skus_by_taxonomy(catalog_df)
         
-        # Process in batches
-        BATCH_SIZE = 20
-        unique_categories = sampled_catalog_df["Category_Path"].unique()
-        batches = [unique_categories[i:i + BATCH_SIZE] for i in range(0, len(unique_categories), BATCH_SIZE)]
-        final_assessment = []
-
-        for i, batch_categories in enumerate(batches):
-            batch_df = sampled_catalog_df[sampled_catalog_df["Category_Path"].isin(batch_categories)]
-            
-            # Bug Fix: Ensure the data sent to the AI includes the item name.
-            # This is the key change to get the AI to output the item name.
-            cols_to_send = [
-                'MSID', 'CONSUMER_FACING_ITEM_NAME', 'IMAGE_URL',
-                'L1_CATEGORY', 'L2_CATEGORY', 'L3_CATEGORY', 'L4_CATEGORY'
+        # Bug Fix: Ensure the data sent to the AI includes the item name.
+        # This is the key change to get the AI to output the item name.
+        cols_to_send = [
+            'MSID', 'CONSUMER_FACING_ITEM_NAME', 'IMAGE_URL',
+            'L1_CATEGORY', 'L2_CATEGORY', 'L3_CATEGORY', 'L4_CATEGORY'
+        ]
+        # Filter to only include the columns that exist in the DataFrame.
+        existing_cols = [col for col in cols_to_send if col in sampled_catalog_df.columns] + ["Category_Path"]
+
+        # One item per category path, carrying that path's sample rows
+        category_items = [
+            {"category": path, "rows": group[existing_cols].to_dict('records')}
+            for path, group in sampled_catalog_df.groupby("Category_Path", sort=False)
+        ]
+
+        allowed_pairs_json = self._allowed_pairs_json(vertical_taxonomy_rows, l1_col, l2_col)
+        local_assessment = []
+        if self.use_distilled_model:
+            allowed = {pair['L1_L2'] for pair in json.loads(allowed_pairs_json)}
+            category_items, local_assessment = self._map_locally(category_items, allowed)
+
+        batches = pack_batches(
+            category_items,
+            prompt_overhead_tokens=estimate_tokens(
+                self._build_mapping_system_prompt(allowed_pairs_json) + self._build_mapping_user_prompt([]), self.model
+            ),
+            max_prompt_tokens=self.max_prompt_tokens,
+            max_completion_tokens=self.max_completion_tokens,
+            completion_tokens_per_item=self.completion_tokens_per_item,
+            max_items=self.max_categories_per_batch,
+            model=self.model,
+            item_tokens=lambda item: estimate_tokens(item["rows"], self.model),
+        )
+
+        def map_batch(batch):
+            sample_rows = [row for item in batch for row in item["rows"]]
+            logging.info(f"Processing taxonomy mapping batch of {len(batch)} categories...")
+            return self._run_ai_assessment_for_mapping(sample_rows, allowed_pairs_json, api_key)
+
+        # Well-formed category verdicts are kept even from broken responses; only the rest are re-queued
+        mapped, failed = run_validated_batches(batches, map_batch, self.response_schema, lambda item: item["category"])
+        if failed:
+            logging.error(f"Taxonomy mapping failed for {len(failed)} categories: {next(iter(failed.values()))}")
+        key = lambda item: self.response_schema.normalize_id(item["category"])
+        if self.record_ai_verdicts:
+            answered = [item for item in category_items if key(item) in mapped]
+            record_verdicts(
+                "category",
+                [self._distill_text(item) for item in answered],
+                [mapped[key(item)]["Recommended_Taxonomy"] for item in answered],
+            )
+        final_assessment = list(mapped.values()) + local_assessment
+
+        # Categories the budget left unmapped stay in the file, marked as skipped
+        skipped = [item for item in category_items if is_budget_error(failed.get(key(item), ""))]
+        if skipped:
+            final_assessment += [
+                {
+                    "Mx_Category": item["category"],
+                    "Issue": "Not mapped (AI budget exhausted)",
+                    "Recommended_Taxonomy": "",
+                    "Example_SKUs": [row.get('CONSUMER_FACING_ITEM_NAME', '') for row in item["rows"]][:3],
+                    "Considered_Info": failed[key(item)],
+                }
+                for item in skipped
             ]
-            
-            # Filter the batch_df to only include the columns that exist in the DataFrame.
-            existing_cols = [col for col in cols_to_send if col in batch_df.columns]
-            sample_rows = batch_df[existing_cols].to_dict('records')
-            
-            logging.info(f"Processing batch {i+1}/{len(batches)} for taxonomy mapping...")
-            
-            assessment_result = self._run_ai_assessment_for_mapping(client, sample_rows, vertical_taxonomy_rows, l1_col, l2_col, api_key)
-            final_assessment.extend(assessment_result)
+            self._note_budget_fallback(len(skipped), "categories left unmapped")
 
         return pd.DataFrame(final_assessment)
 
+    def _distill_text(self, item: dict) -> str:
+        """The classifier's view of a category: its path plus the sampled item names."""
+        names = "; ".join(str(row.get('CONSUMER_FACING_ITEM_NAME', '')) for row in item["rows"])
+        return f"{item['category']} | {names}"
+
+    def _map_locally(self, category_items: list, allowed: set):
+        """Maps the categories the distilled classifier is sure about; returns (remaining, assessments)."""
+        clf = load_classifier("category")
+        texts = [self._distill_text(item) for item in category_items]
+        confident = confident_predictions(clf, texts, self.distilled_min_confidence, self.distilled_min_agreement)
+        # Only trust labels that are valid pairs for this vertical
+        confident = {i: pred for i, pred in confident.items() if pred[0] in allowed}
+        local = [
+            {
+                "Mx_Category": category_items[i]["category"],
+                "Issue": "Mapped by local model",
+                "Recommended_Taxonomy": label,
+                "Example_SKUs": [row.get('CONSUMER_FACING_ITEM_NAME', '') for row in category_items[i]["rows"]][:3],
+                "Considered_Info": f"Distilled from past AI mappings (confidence {conf:.2f}).",
+            }
+            for i, (label, conf) in confident.items()
+        ]
+        if local:
+            logging.info(f"Distilled classifier mapped {len(local)}/{len(category_items)} categories locally.")
+        return [item for i, item in enumerate(category_items) if i not in confident], local
+
     def get_vertical_taxonomy(self):
         """
         Gets the relevant L1/L2 columns from the main taxonomy file.
@@ -253,68 +341,85 @@ class Agent(BaseAgent):
         return self.taxonomy_df[self.taxonomy_df[l1_col_original].notna()], l1_col_original, l2_col_original
 
 
-    def _run_ai_assessment_for_mapping(self, client, sample_rows, vertical_taxonomy_rows, l1_col, l2_col, api_key):
-        """Constructs the prompt and calls the AI for taxonomy mapping."""
-        allowed_pairs_json = json.dumps(
-            [{'L1_L2': row[l1_col] + ' > ' + row[l2_col]} for _, row in vertical_taxonomy_rows.drop_duplicates([l1_col, l2_col]).iterrows()],
+    def _allowed_pairs_json(self, vertical_taxonomy_rows, l1_col, l2_col) -> str:
+        """Serializes the allowed L1 > L2 pairs for the vertical once per run."""
+        pairs = vertical_taxonomy_rows.drop_duplicates([l1_col, l2_col])
+        return json.dumps(
+            [{'L1_L2': l1 + ' > ' + l2} for l1, l2 in zip(pairs[l1_col], pairs[l2_col])],
             indent=2
         )
 
-        system_prompt = (
+    def _build_mapping_system_prompt(self, allowed_pairs_json: str) -> str:
+        """Instructions + allowed pairs: identical for every batch of a run, so they lead the request."""
+        return (
             f"You are assessing a merchant's taxonomy against DoorDash's standard for the '{self.vertical}' vertical.\n\n"
             "Your Goals:\n"
-            "1. Identify categories that are too broad or mismatched.\n"
+            "1. For every Category_Path in the sample, decide whether it is too broad or mismatched.\n"
             "2. Recommend the most precise L1 > L2 taxonomy from the allowed list below.\n"
             "3. Use both item name and image URL to confirm your recommendations.\n\n"
             "Restrictions:\n"
             f"- Only suggest L1 > L2 pairs from the allowed list.\n"
             f"- Allowed DoorDash L1 > L2 taxonomy pairs:\n{allowed_pairs_json}\n\n"
-            "Merchant Sample Data:\n"
-            f"{json.dumps(sample_rows, indent=2)}\n\n"
+            "- Return exactly one entry per distinct Category_Path, including categories that are fine.\n"
+            "- Set Mx_Category to the row's Category_Path exactly as given.\n"
+            "- If a category is already precise and correctly matched, set Issue to \"OK\" and Recommended_Taxonomy to the allowed pair it matches.\n\n"
             "You MUST respond with only a single, valid JSON object that adheres to the following schema. Do not include any other text, explanations, or markdown formatting.\n"
             "Response Schema:\n"
             "{{ \"assessment\": [ {{ \"Mx_Category\": \"...\", \"Issue\": \"Specific but could be matched to a more appropriate category\", \"Recommended_Taxonomy\": \"<L1_NAME> > <L2_NAME>\", \"Example_SKUs\": [\"name1\"], \"Considered_Info\": \"Explain how name/image guided your suggestion\" }} ] }}\n"
         )
+
+    def _build_mapping_user_prompt(self, sample_rows) -> str:
+        return f"Merchant Sample Data:\n{json.dumps(sample_rows, indent=2)}\n"
+
+    def _run_ai_assessment_for_mapping(self, sample_rows, allowed_pairs_json, api_key):
+        """
+        Constructs the prompt and calls the AI for taxonomy mapping.
+        Returns {"assessment": [...]}, or {"error": ..., "raw_content": ...} if the response can't be parsed.
+        """
+        system_prompt = self._build_mapping_system_prompt(allowed_pairs_json)
         
         # New logic to handle both old and new API parameters
         params = {
             "model": self.model,
-            "messages": [{"role": "system", "content": system_prompt}],
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": self._build_mapping_user_prompt(sample_rows)},
+            ],
             "response_format": {"type": "json_object"},
         }
         
         if self.model.startswith('gpt-5'):
             params['temperature'] = 1.0
-            params['max_completion_tokens'] = 4000
+            params['max_completion_tokens'] = self.max_completion_tokens
         else:
             params['temperature'] = 0.1
-            params['max_tokens'] = 4000
+            params['max_tokens'] = self.max_completion_tokens
             
         try:
-            response = client.chat.completions.create(**params)
+            started = time.perf_counter()
+            with call_annotations(agent=self.attribute_name):
+                response = chat_completion(api_key, params)
+        except DeferredRequest as e:
+            return {"error": str(e), "deferred": True}
+        except BudgetExceeded as e:
+            logging.warning(f"Taxonomy mapping: {e}")
+            return {"error": str(e), "budget_exhausted": True}
         except Exception as e:
             logging.error(f"AI call failed due to parameter error: {e}")
             raise e
 
+        self._log_usage(self.model, response, time.perf_counter() - started)
+
         content = response.choices[0].message.content
+        if response.choices[0].finish_reason == "length":
+            logging.warning("Taxonomy mapping response was truncated (finish_reason=length).")
+            return {"error": "Response truncated (finish_reason=length).", "raw_content": content}
         if not content:
             logging.warning("AI returned an empty response. Cannot perform taxonomy assessment.")
-            return []
+            return {"error": "Empty AI response."}
 
         try:
-            return json.loads(content)["assessment"]
-        except (json.JSONDecodeError, KeyError):
-            logging.warning("Direct JSON parsing failed. Attempting regex fallback.")
-            try:
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                if json_match:
-                    logging.info("Regex found a JSON-like object. Attempting to parse.")
-                    return json.loads(json_match.group())["assessment"]
-                else:
-                    logging.error("Regex could not find a JSON object in the response.")
-                    logging.error(f"Problematic AI response content: {content}")
-                    return []
-            except (json.JSONDecodeError, KeyError) as e:
-                logging.error(f"Fallback JSON parsing also failed. Error: {e}")
-                logging.error(f"Problematic AI response content: {content}")
-                return []
+            return {"assessment": json.loads(content)["assessment"]}
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            logging.warning(f"Direct JSON parsing failed ({e}); returning raw content for salvage.")
+            return {"error": f"Failed to parse JSON response: {e}", "raw_content": content}
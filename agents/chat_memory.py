@@ -0,0 +1,64 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+from .llm_batching import estimate_tokens
+
+# Prompt tokens the conversation history may take (digest + verbatim turns)
+HISTORY_TOKEN_BUDGET = 3000
+# Most recent messages always sent verbatim (3 question/answer turns)
+KEEP_RECENT_MESSAGES = 6
+DIGEST_MODEL = "gpt-5-mini"
+DIGEST_MAX_WORDS = 250
+
+
+def _tokens(messages: List[Dict[str, Any]], model: str) -> int:
+    return sum(estimate_tokens(str(m.get("content") or ""), model) + 4 for m in messages)
+
+
+@dataclass
+class ChatMemory:
+    """
+    Keeps a chat's history within a token budget.
+
+    The last KEEP_RECENT_MESSAGES are sent verbatim; once the unsummarized history passes
+    HISTORY_TOKEN_BUDGET, the older turns are folded into a rolling digest by a small model.
+    The full transcript stays in st.session_state.messages for display.
+    """
+    digest: str = ""
+    digested: int = 0  # messages[:digested] are covered by the digest
+
+    def turns_to_fold(self, messages: List[Dict[str, Any]], model: str) -> List[Dict[str, Any]]:
+        """Older messages that should go into the digest before the next request (may be empty)."""
+        pending = messages[self.digested:]
+        if _tokens(pending, model) + estimate_tokens(self.digest, model) <= HISTORY_TOKEN_BUDGET:
+            return []
+        keep = KEEP_RECENT_MESSAGES if len(pending) > KEEP_RECENT_MESSAGES else 2
+        return pending[:-keep]
+
+    def digest_request(self, folded: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Chat completion params that merge `folded` into the current digest."""
+        transcript = "\n".join(f"{m['role']}: {m.get('content') or ''}" for m in folded)
+        return {
+            "model": DIGEST_MODEL,
+            "messages": [
+                {"role": "system", "content": (
+                    "You maintain a running summary of a conversation about a catalog data assessment. "
+                    f"Merge the new turns into the summary in at most {DIGEST_MAX_WORDS} words. Keep the user's goals, "
+                    "the facts, numbers, SKUs and conclusions already given, and open questions; drop pleasantries."
+                )},
+                {"role": "user", "content": f"Current summary:\n{self.digest or '(none)'}\n\nNew turns:\n{transcript}"},
+            ],
+        }
+
+    def fold(self, folded: List[Dict[str, Any]], new_digest: str) -> None:
+        self.digest = new_digest.strip()
+        self.digested += len(folded)
+
+    def history(self, messages: List[Dict[str, Any]], model: str) -> List[Dict[str, Any]]:
+        """Digest plus the verbatim recent turns, trimmed to the budget if folding fell behind."""
+        recent = [{"role": m["role"], "content": m["content"]} for m in messages[self.digested:]]
+        budget = HISTORY_TOKEN_BUDGET - estimate_tokens(self.digest, model)
+        while len(recent) > 1 and _tokens(recent, model) > budget:
+            recent = recent[1:]
+        prefix = [{"role": "system", "content": f"Summary of the earlier conversation:\n{self.digest}"}] if self.digest else []
+        return prefix + recent
@@ -0,0 +1,125 @@
+import math
+import time
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import yaml
+
+from .row_search import STOPWORDS, tokenize
+
+# Words users say for an attribute -> the criteria sections that cover it
+CRITERIA_ALIASES: Dict[str, List[str]] = {
+    "photo": ["image_url"], "picture": ["image_url"], "image": ["image_url"], "url": ["image_url"],
+    "avif": ["image_url", "aux_photos"], "auxiliary": ["aux_photos"], "aux": ["aux_photos"],
+    "barcode": ["upc"], "gtin": ["upc"], "ean": ["upc"],
+    "brand": ["brand_name"], "unbranded": ["brand_name"], "private": ["brand_name"],
+    "title": ["item_name"], "naming": ["item_name"], "nexla": ["item_name"],
+    "uom": ["unit_of_measure"], "unit": ["unit_of_measure"], "measure": ["unit_of_measure"],
+    "category": ["taxonomy"], "categories": ["taxonomy"], "taxonomy": ["taxonomy"],
+    "alcohol": ["restricted_items"], "age": ["restricted_items"], "cbd": ["restricted_items"],
+    "thc": ["restricted_items"], "tobacco": ["items_doordash_cant_sell"], "vape": ["items_doordash_cant_sell"],
+    "excluded": ["items_doordash_cant_sell"], "exclusion": ["items_doordash_cant_sell"],
+    "prohibited": ["items_doordash_cant_sell"],
+    "group": ["product_group"], "flavor": ["variant"], "color": ["variant"], "scent": ["variant"],
+    "description": ["details"], "html": ["details"],
+    "weight": ["weighted_items", "average_weight"], "weighted": ["weighted_items"],
+    "produce": ["plu"], "ebt": ["snap"],
+}
+# The chat's row-search stopwords, minus words that name criteria ("item name", "product group")
+CRITERIA_STOPWORDS = STOPWORDS - {'item', 'items', 'product', 'products', 'sku'}
+# BM25 parameters; section titles count extra so a passage is found by what it is about
+BM25_K1 = 1.5
+BM25_B = 0.75
+TITLE_WEIGHT = 2
+
+
+@dataclass
+class CriteriaPassage:
+    section: str   # YAML key, e.g. "image_url"
+    title: str     # e.g. "Image Url"
+    part: str      # "overview" or "instructions"
+    text: str
+
+    def render(self) -> str:
+        return f"--- {self.title} ({self.part}) ---\n{self.text}"
+
+
+@dataclass
+class CriteriaIndex:
+    """
+    BM25 index over the paragraphs of the assessment criteria document.
+
+    Built once per document (the chat page shares it across sessions). Each overview and
+    instructions block is split into paragraphs that carry their section's title words, and
+    a question is expanded with the titles of the sections it names directly or through an alias.
+    """
+    passages: List[CriteriaPassage] = field(default_factory=list)
+    postings: Dict[str, Dict[int, int]] = field(default_factory=dict)  # token -> passage -> term frequency
+    lengths: List[int] = field(default_factory=list)
+    aliases: Dict[str, List[str]] = field(default_factory=dict)
+    _title_tokens: Dict[str, List[str]] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, yaml_content: str) -> "CriteriaIndex":
+        """Parses the criteria YAML; raises yaml.YAMLError on a malformed document."""
+        started = time.perf_counter()
+        index = cls()
+        data = yaml.safe_load(yaml_content) or {}
+        for key, value in data.items():
+            if not isinstance(value, dict):
+                continue
+            title = key.replace('_', ' ').title()
+            index._title_tokens[key] = tokenize(title, CRITERIA_STOPWORDS)
+            for part in ('overview', 'instructions'):
+                for paragraph in str(value.get(part) or '').split('\n\n'):
+                    if paragraph.strip():
+                        index._add(CriteriaPassage(key, title, part, paragraph.strip()))
+        for word, keys in CRITERIA_ALIASES.items():
+            for token in tokenize(word, CRITERIA_STOPWORDS):
+                index.aliases[token] = [k for k in keys if k in index._title_tokens]
+        logging.info(f"Criteria index built: {len(index.passages)} passages in {time.perf_counter() - started:.3f}s.")
+        return index
+
+    def _add(self, passage: CriteriaPassage) -> None:
+        position = len(self.passages)
+        terms = Counter(tokenize(passage.text, CRITERIA_STOPWORDS, unique=False))
+        terms.update({t: TITLE_WEIGHT for t in self._title_tokens[passage.section]})
+        for token, tf in terms.items():
+            self.postings.setdefault(token, {})[position] = tf
+        self.passages.append(passage)
+        self.lengths.append(sum(terms.values()))
+
+    # --- Queries ---
+
+    def named_sections(self, question: str) -> List[str]:
+        """Sections the question names: by their full title ("item name") or an alias ("photo")."""
+        tokens = set(tokenize(question, CRITERIA_STOPWORDS))
+        named = [key for key, title in self._title_tokens.items() if title and tokens.issuperset(title)]
+        named += [key for token in tokens for key in self.aliases.get(token, [])]
+        return list(dict.fromkeys(named))
+
+    def search(self, question: str, k: int = 3) -> List[CriteriaPassage]:
+        """
+        The `k` best passages for `question` (none when no word of it is indexed).
+
+        Passages of the sections the question names rank first; BM25 orders them and the rest.
+        """
+        if not self.passages:
+            return []
+        n = len(self.passages)
+        avg_length = sum(self.lengths) / n
+        named = self.named_sections(question)
+        tokens = tokenize(question, CRITERIA_STOPWORDS) + [t for key in named for t in self._title_tokens[key]]
+        scores: Dict[int, float] = {}
+        for token in dict.fromkeys(tokens):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, tf in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[position] / avg_length)
+                scores[position] = scores.get(position, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = sorted(scores, key=lambda p: (self.passages[p].section not in named, -scores[p], p))[:k]
+        return [self.passages[p] for p in best]
@@ -0,0 +1,125 @@
+import logging
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Numeric 1/0 flags standardized by the pipeline; shown as True/False
+BOOLEAN_FLAGS = ['IS_WEIGHTED_ITEM', 'IS_ALCOHOL', 'IS_CBD', 'SNAP_ELIGIBLE']
+
+# Whole cells that are a stringified missing value (never substrings: "Banana" stays "Banana")
+_MISSING_STRINGS = ['nan', 'NaN', 'NAN', 'None', '<NA>', 'NaT']
+# Floats above this can't be told apart from their neighbours; they keep Python's repr
+_MAX_EXACT_FLOAT_INT = 2 ** 53
+
+
+def readable_column_order(columns: Iterable[str], is_nexla: bool) -> List[str]:
+    """Columns grouped as reviewers read them: each attribute next to its issue column, then the rest."""
+    item_group = ['CONSUMER_FACING_ITEM_NAME']
+    if is_nexla:
+        item_group.append('SUGGESTED_CONCATENATED_NAME')
+    item_group.extend(['Item Name Rule Issues', 'Item Name Assessment', 'Item Name Style Score', 'Item Name Template'])
+    groups = [
+        ['BUSINESS_ID','VERTICAL', 'businessName', 'BIZID_MSID'], ['MSID', 'MSIDIssues?'], ['UPC', 'UPCIssues?'],
+        ['BRAND_NAME', 'BrandIssues?'], item_group, ['IMAGE_URL', 'ImageIssues?'],
+        ['SIZE', 'SizeIssues?'], ['UNIT_OF_MEASUREMENT', 'UNIT_OF_MEASUREMENTIssues?'],
+        ['L1_CATEGORY', 'L2_CATEGORY', 'L3_CATEGORY', 'L4_CATEGORY', 'Taxonomy Path', 'CategoryIssues?'],
+        ['IS_WEIGHTED_ITEM', 'WeightedItemIssues?', 'AVERAGE_WEIGHT_PER_EACH', 'AverageWeightIssues?', 'AVERAGE_WEIGHT_UOM'], ['PLU', 'PLUIssues?'],
+        ['IS_ALCOHOL', 'IS_CBD', 'RestrictedItemIssues?', 'ExclusionIssues?', 'ExclusionDecision'],
+        ['SNAP_ELIGIBLE', 'SNAPEligibilityIssues?'],
+        ['PRODUCT_GROUP', 'ProductGroupIssues?'],
+        ['VARIANT', 'VariantIssues?'],
+        ['ADDITIONAL_IMAGE_URLS','AuxPhotoIssues?', 'All_Aux_Photos_URLs'],
+        ['SHORT_DESCRIPTION', 'DESCRIPTION', 'DETAILS', 'DescriptionIssues?']
+    ]
+    columns = list(columns)
+    present = set(columns)
+    reordered, seen = [], set()
+    for group in groups:
+        for col in group:
+            if col in present and col not in seen:
+                reordered.append(col)
+                seen.add(col)
+    return reordered + [col for col in columns if col not in seen]
+
+
+# --- Column kernels (one per dtype family, all vectorized) ---
+
+def _render_flag(s: pd.Series) -> pd.Series:
+    values = pd.to_numeric(s, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    return pd.Series(np.select([values == 1.0, values == 0.0], ['True', 'False'], ''), index=s.index, dtype=object)
+
+
+def _render_float(s: pd.Series) -> pd.Series:
+    """Whole numbers without the trailing '.0' (3.0 -> '3'), others as Python prints them, NaN -> ''."""
+    values = s.to_numpy(dtype=float, na_value=np.nan)
+    out = s.astype(str).to_numpy(dtype=object)
+    missing = np.isnan(values)
+    whole = ~missing & (np.abs(np.where(missing, 0.0, values)) < _MAX_EXACT_FLOAT_INT)
+    whole &= np.mod(np.where(whole, values, 0.0), 1.0) == 0.0
+    out[whole] = values[whole].astype(np.int64).astype(str)
+    out[missing] = ''
+    return pd.Series(out, index=s.index, dtype=object)
+
+
+def _render_text(s: pd.Series) -> pd.Series:
+    """Strings pass through untouched; missing values and stringified NaNs become ''."""
+    out = s.to_numpy(dtype=object, na_value='', copy=True)
+    out[s.isin(_MISSING_STRINGS).to_numpy()] = ''
+    return pd.Series(out, index=s.index, dtype=object)
+
+
+def _render_mixed(s: pd.Series) -> pd.Series:
+    # Rare (an agent wrote numbers into a text column): only the non-string cells need number formatting
+    cell_types = s.map(type, na_action='ignore')
+    is_text = cell_types.eq(str)
+    out = _render_text(s.where(is_text))
+    # Booleans are numbers to pd.to_numeric (True -> 1); keep them as words
+    is_bool = cell_types.isin([bool, np.bool_])
+    out[is_bool] = s[is_bool].map(lambda v: 'True' if v else 'False')
+    numbers = s[~is_text & ~is_bool & s.notna()]
+    if len(numbers):
+        numeric = pd.to_numeric(numbers, errors='coerce')
+        rendered = _render_float(numeric.astype(float)).where(numeric.notna(), numbers.astype(str))
+        out.loc[rendered.index] = rendered
+    return out
+
+
+def render_column(s: pd.Series, is_flag: bool = False) -> pd.Series:
+    """One column as display strings, formatted by its dtype."""
+    if is_flag:
+        return _render_flag(s)
+    if pd.api.types.is_bool_dtype(s.dtype):
+        return _render_text(s.map({True: 'True', False: 'False'}))
+    if pd.api.types.is_float_dtype(s.dtype):
+        return _render_float(s)
+    if pd.api.types.is_integer_dtype(s.dtype):
+        return _render_text(s.astype(str).where(s.notna()))
+    if pd.api.types.is_datetime64_any_dtype(s.dtype):
+        return _render_text(s.dt.strftime('%Y-%m-%d %H:%M:%S').str.removesuffix(' 00:00:00'))
+    if s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) not in ('string', 'empty'):
+        return _render_mixed(s)
+    return _render_text(s)
+
+
+def render_frame(
+    df: pd.DataFrame,
+    columns: Optional[Sequence[str]] = None,
+    rows: Optional[Sequence[int]] = None,
+) -> pd.DataFrame:
+    """
+    The display/export version of `df`: every cell a string, built column by column.
+
+    Only `columns` (default: all) and, if given, the row positions `rows` are rendered,
+    so a page or a sample costs in proportion to its own size; `df` itself is never
+    copied or modified.
+    """
+    columns = [c for c in (columns if columns is not None else df.columns) if c in df.columns]
+    rendered = {}
+    for col in columns:
+        s = df[col] if rows is None else df[col].iloc[rows]
+        rendered[col] = render_column(s, is_flag=col in BOOLEAN_FLAGS).to_numpy()
+    index = df.index if rows is None else df.index[rows]
+    out = pd.DataFrame(rendered, index=index, columns=columns)
+    logging.info(f"Rendered {len(out):,} rows x {len(columns)} columns for display.")
+    return out
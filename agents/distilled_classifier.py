@@ -0,0 +1,255 @@
+import os
+import re
+import json
+import zlib
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Where LLM verdicts and the models distilled from them live (per task: "exclusion", "category")
+DEFAULT_STORE_DIR = os.getenv(
+    "DISTILLED_MODEL_DIR", os.path.join(os.path.expanduser("~"), ".mx_assessment", "distilled")
+)
+_WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+_write_lock = threading.Lock()
+
+
+# --- Feature hashing ---
+
+def _hash(token: str) -> int:
+    # crc32 is stable across processes (built-in hash() is salted)
+    return zlib.crc32(token.encode("utf-8"))
+
+
+def _tokens(text: str) -> List[str]:
+    words = _WORD_RE.findall(str(text).lower())
+    feats = [f"w:{w}" for w in words]
+    feats += [f"b:{a}_{b}" for a, b in zip(words, words[1:])]
+    # Character trigrams make the model robust to brand spellings and plurals
+    for w in words:
+        padded = f"^{w}$"
+        feats += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    return feats
+
+
+def hash_features(texts: Sequence[str], n_features: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Signed hashing trick over word unigrams, bigrams and character trigrams.
+    Returns a CSR triple (indptr, indices, data) with L2-normalised rows.
+    """
+    indptr, indices, data = [0], [], []
+    for text in texts:
+        counts: Dict[int, float] = {}
+        for tok in _tokens(text):
+            h = _hash(tok)
+            col = h % n_features
+            counts[col] = counts.get(col, 0.0) + (1.0 if (h >> 31) & 1 == 0 else -1.0)
+        vals = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        norm = float(np.sqrt((vals ** 2).sum())) or 1.0
+        indices.extend(counts.keys())
+        data.extend((vals / norm).tolist())
+        indptr.append(len(indices))
+    return np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int64), np.asarray(data, dtype=np.float32)
+
+
+class DistilledClassifier:
+    """Multinomial logistic regression on hashed text features, trained with numpy SGD."""
+
+    def __init__(self, n_features: int = 2 ** 16):
+        self.n_features = n_features
+        self.classes_: List[str] = []
+        self.W: Optional[np.ndarray] = None
+        self.b: Optional[np.ndarray] = None
+        self.report: Dict = {}
+
+    def _scores(self, indptr, indices, data) -> np.ndarray:
+        n_rows = len(indptr) - 1
+        scores = np.tile(self.b, (n_rows, 1))
+        if len(indices):
+            contrib = self.W[indices] * data[:, None]
+            rows = np.repeat(np.arange(n_rows), np.diff(indptr))
+            np.add.at(scores, rows, contrib)
+        return scores
+
+    def fit(self, texts: Sequence[str], labels: Sequence[str], *, epochs: int = 10, lr: float = 5.0,
+            l2: float = 1e-5, batch_size: int = 64, seed: int = 42) -> "DistilledClassifier":
+        self.classes_ = sorted(set(labels))
+        class_idx = {c: i for i, c in enumerate(self.classes_)}
+        y = np.array([class_idx[l] for l in labels])
+        n_classes = len(self.classes_)
+        self.W = np.zeros((self.n_features, n_classes), dtype=np.float32)
+        self.b = np.zeros(n_classes, dtype=np.float32)
+        indptr, indices, data = hash_features(texts, self.n_features)
+
+        rng = np.random.default_rng(seed)
+        for epoch in range(epochs):
+            order = rng.permutation(len(y))
+            step = lr / (1 + epoch)
+            for start in range(0, len(order), batch_size):
+                rows = order[start:start + batch_size]
+                sub_ptr = np.concatenate([[0], np.cumsum(indptr[rows + 1] - indptr[rows])])
+                sel = np.concatenate([np.arange(indptr[r], indptr[r + 1]) for r in rows]) if len(rows) else np.array([], int)
+                sub_idx, sub_data = indices[sel], data[sel]
+
+                probs = _softmax(self._scores(sub_ptr, sub_idx, sub_data))
+                probs[np.arange(len(rows)), y[rows]] -= 1.0
+                grad = probs / len(rows)
+
+                row_of_nnz = np.repeat(np.arange(len(rows)), np.diff(sub_ptr))
+                np.add.at(self.W, sub_idx, -step * sub_data[:, None] * grad[row_of_nnz])
+                self.b -= step * grad.sum(axis=0)
+                if l2:
+                    self.W[sub_idx] *= (1 - step * l2)
+        return self
+
+    def predict_proba(self, texts: Sequence[str]) -> np.ndarray:
+        if self.W is None:
+            raise ValueError("Classifier is not trained.")
+        return _softmax(self._scores(*hash_features(texts, self.n_features)))
+
+    def predict(self, texts: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+        """Returns (labels, confidence) for each text."""
+        if not len(texts):
+            return [], np.array([])
+        probs = self.predict_proba(texts)
+        best = probs.argmax(axis=1)
+        return [self.classes_[i] for i in best], probs[np.arange(len(best)), best]
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(
+            path, W=self.W, b=self.b, n_features=self.n_features,
+            classes=np.array(self.classes_, dtype=object), report=json.dumps(self.report),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "DistilledClassifier":
+        with np.load(path, allow_pickle=True) as npz:
+            clf = cls(int(npz["n_features"]))
+            clf.W, clf.b = npz["W"], npz["b"]
+            clf.classes_ = [str(c) for c in npz["classes"]]
+            clf.report = json.loads(str(npz["report"]))
+        return clf
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+# --- Verdict log, training and loading ---
+
+def _verdicts_path(task: str, store_dir: str) -> str:
+    return os.path.join(store_dir, f"{task}_verdicts.jsonl")
+
+
+def _model_path(task: str, store_dir: str) -> str:
+    return os.path.join(store_dir, f"{task}_model.npz")
+
+
+def record_verdicts(task: str, texts: Sequence[str], labels: Sequence[str], store_dir: str = DEFAULT_STORE_DIR) -> int:
+    """Appends LLM verdicts (input text -> label) to the task's training log."""
+    rows = [(t, l) for t, l in zip(texts, labels) if str(t).strip() and str(l).strip()]
+    if not rows:
+        return 0
+    ts = datetime.utcnow().isoformat()
+    try:
+        os.makedirs(store_dir, exist_ok=True)
+        with _write_lock, open(_verdicts_path(task, store_dir), "a", encoding="utf-8") as f:
+            for text, label in rows:
+                f.write(json.dumps({"ts": ts, "text": text, "label": label}, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logging.warning(f"Could not record {task} verdicts: {e}")
+        return 0
+    return len(rows)
+
+
+def load_verdicts(task: str, store_dir: str = DEFAULT_STORE_DIR) -> pd.DataFrame:
+    """Recorded verdicts, latest label per text."""
+    path = _verdicts_path(task, store_dir)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=["ts", "text", "label"])
+    df = pd.read_json(path, lines=True, dtype={"text": str, "label": str})
+    return df.drop_duplicates("text", keep="last").reset_index(drop=True)
+
+
+def agreement_report(clf: DistilledClassifier, texts: Sequence[str], labels: Sequence[str],
+                     thresholds: Sequence[float] = (0.0, 0.8, 0.9, 0.95)) -> Dict:
+    """Agreement with the LLM on held-out verdicts, overall and at each confidence threshold."""
+    predicted, confidence = clf.predict(list(texts))
+    agree = np.array([p == l for p, l in zip(predicted, labels)])
+    by_threshold = []
+    for t in thresholds:
+        covered = confidence >= t
+        by_threshold.append({
+            "min_confidence": t,
+            "coverage": float(covered.mean()) if len(agree) else 0.0,
+            "agreement": float(agree[covered].mean()) if covered.any() else None,
+        })
+    return {"n_test": int(len(agree)), "agreement": float(agree.mean()) if len(agree) else None, "by_threshold": by_threshold}
+
+
+def train_from_verdicts(task: str, *, holdout: float = 0.2, seed: int = 42, min_samples: int = 200,
+                        store_dir: str = DEFAULT_STORE_DIR, **fit_kwargs) -> Optional[DistilledClassifier]:
+    """Trains on recorded verdicts, scores a held-out split, then refits on everything and saves."""
+    verdicts = load_verdicts(task, store_dir)
+    if len(verdicts) < min_samples:
+        logging.warning(f"Only {len(verdicts)} recorded {task} verdicts (need {min_samples}); not training.")
+        return None
+
+    shuffled = verdicts.sample(frac=1.0, random_state=seed)
+    n_test = max(1, int(len(shuffled) * holdout))
+    test, train = shuffled.iloc[:n_test], shuffled.iloc[n_test:]
+
+    clf = DistilledClassifier().fit(train["text"].tolist(), train["label"].tolist(), seed=seed, **fit_kwargs)
+    report = agreement_report(clf, test["text"].tolist(), test["label"].tolist())
+
+    final = DistilledClassifier().fit(verdicts["text"].tolist(), verdicts["label"].tolist(), seed=seed, **fit_kwargs)
+    final.report = {"task": task, "trained_at": datetime.utcnow().isoformat(), "n_train": int(len(train)),
+                    "n_classes": len(final.classes_), **report}
+    final.save(_model_path(task, store_dir))
+    _loaded.pop((task, store_dir), None)
+    logging.info(f"Trained {task} classifier: held-out agreement {report['agreement']:.1%} on {report['n_test']} verdicts.")
+    return final
+
+
+_loaded: Dict[Tuple[str, str], Tuple[float, DistilledClassifier]] = {}
+
+
+def load_classifier(task: str, store_dir: str = DEFAULT_STORE_DIR) -> Optional[DistilledClassifier]:
+    """The saved classifier for a task (reloaded when the file changes), or None."""
+    path = _model_path(task, store_dir)
+    if not os.path.exists(path):
+        return None
+    mtime = os.path.getmtime(path)
+    cached = _loaded.get((task, store_dir))
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        clf = DistilledClassifier.load(path)
+    except Exception as e:
+        logging.warning(f"Could not load {task} classifier: {e}")
+        return None
+    _loaded[(task, store_dir)] = (mtime, clf)
+    return clf
+
+
+def confident_predictions(clf: Optional[DistilledClassifier], texts: Sequence[str], min_confidence: float,
+                          min_agreement: float) -> Dict[int, Tuple[str, float]]:
+    """
+    {position: (label, confidence)} for the texts the classifier may answer on its own.
+    Empty unless the model's held-out agreement at `min_confidence` reaches `min_agreement`.
+    """
+    if clf is None or not len(texts):
+        return {}
+    at_threshold = [r for r in clf.report.get("by_threshold", []) if r["min_confidence"] <= min_confidence]
+    trusted = at_threshold and (at_threshold[-1].get("agreement") or 0.0) >= min_agreement
+    if not trusted:
+        return {}
+    labels, confidence = clf.predict(list(texts))
+    return {i: (labels[i], float(confidence[i])) for i in range(len(labels)) if confidence[i] >= min_confidence}
@@ -5,9 +5,39 @@ import re
 from typing import Dict, List, Optional
 
 import pandas as pd
-import yaml
 
 from .base_agent import BaseAgent
+from .llm_batching import estimate_tokens, pack_batches
+from .llm_budget import is_budget_error
+from .llm_parsing import ResponseSchema
+from .distilled_classifier import confident_predictions, load_classifier, record_verdicts
+
+# Static reviewer instructions, sent as the system message so the provider can cache the prefix
+_AI_GUIDANCE = """
+You are a DoorDash compliance checker. Classify each item as one of:
+- "exclude": absolutely prohibited (e.g., weapons, illegal drugs, non-pilot gift cards).
+- "review": potentially restricted but unclear; needs human review OR requires a missing merchant flag.
+- "allow": allowed for sale (including restricted-but-compliant when the correct merchant flag is present).
+
+Rules:
+1) Do NOT classify alcohol, CBD/THC, nicotine/NRT, or typical OTC meds as "exclude" by default. They are allowed when the correct merchant flag is present.
+2) If the item appears to be alcohol but is_alcohol_flag is false or null → "review" with reason "Alcohol suspected but missing flag".
+3) Same logic for CBD/THC (is_cbd_flag), nicotine/NRT (is_nicotine_flag), and OTC cough/cold/pain meds (is_otc_med_flag).
+4) Avoid substring mistakes (do not infer alcohol from letters inside unrelated words: "gin" in "original", "ale" in "wholesale", etc.). Match whole words and use category context.
+5) If L1/L2 are clearly non-restricted (e.g., Snacks > Chips), that should overrule stray name fragments.
+
+Return ONLY valid JSON with this exact schema:
+{
+  "results": [
+    {
+      "item_name": "...",
+      "decision": "allow|review|exclude",
+      "reason": "short reason referencing the rules/flags",
+      "confidence": 0.0
+    }
+  ]
+}
+"""
 
 
 class Agent(BaseAgent):
@@ -44,9 +74,25 @@ class Agent(BaseAgent):
         # Controls for AI hand-off
         self.use_ai_for_ambiguous = True
         self.ai_confidence_threshold = 0.70
-        self.ai_batch_size = 50
+        self.ai_batch_size = 50            # upper bound; batches are packed to the token budget
+        self.completion_tokens_per_item = 60
+        self.response_schema = ResponseSchema(
+            container="list",
+            list_key="results",
+            id_field="item_name",
+            required={"item_name": str, "decision": str, "confidence": (int, float)},
+            checks={"decision": lambda d: str(d).strip().lower() in {"allow", "review", "exclude"}},
+            normalize_id=lambda v: str(v).strip().lower(),
+        )
         self.max_ai_items = 1500
 
+        # Local classifier distilled from past AI verdicts (train_distilled_models.py).
+        # It answers only when it is very sure and its held-out agreement with the AI is high.
+        self.use_distilled_model = True
+        self.record_ai_verdicts = True
+        self.distilled_min_confidence = 0.95
+        self.distilled_min_agreement = 0.97
+
         # Merchant flag canonical names (we auto-detect case-insensitive)
         self.flag_columns: Dict[str, str] = {
             "alcohol": "IS_ALCOHOL",
@@ -96,17 +142,41 @@ class Agent(BaseAgent):
                 items = self._gather_ai_items(df[amb_mask])
                 if self.max_ai_items:
                     items = items[: self.max_ai_items]
-
-                # Batch to reduce token spikes
-                results = {}
-                for i in range(0, len(items), self.ai_batch_size):
-                    batch = items[i : i + self.ai_batch_size]
-                    batch_res = self._ai_review(batch, api_key=api_key)
-                    for rkey, rval in batch_res.items():
-                        results[rkey] = rval
+                local_results = {}
+                if self.use_distilled_model:
+                    items, local_results = self._answer_locally(items)
+
+                # Pack to the token budget; well-formed results are kept and only missing items re-queued
+                batches = pack_batches(
+                    items,
+                    prompt_overhead_tokens=estimate_tokens(_AI_GUIDANCE + self._build_ai_prompt([]), self.model),
+                    max_prompt_tokens=self.max_prompt_tokens,
+                    max_completion_tokens=self.max_completion_tokens,
+                    completion_tokens_per_item=self.completion_tokens_per_item,
+                    max_items=self.ai_batch_size,
+                    model=self.model,
+                )
+                # Cheap tier first; low-confidence or malformed verdicts escalate to self.model
+                self.escalation_confidence = self.ai_confidence_threshold
+                valid, failed = self.run_model_cascade(
+                    batches,
+                    lambda batch, model: self._call_ai_review(batch, api_key, model),
+                    self.response_schema,
+                    lambda item: item.get("item_name", ""),
+                    confidence_field="confidence",
+                )
+                if failed:
+                    logging.error(f"Exclusion AI review failed for {len(failed)} items: {next(iter(failed.values()))}")
+                results = self._parse_ai_review({"results": list(valid.values())})
+                if self.record_ai_verdicts:
+                    self._record_ai_verdicts(items, results)
+                results.update(local_results)
 
                 # Apply AI decisions to DataFrame
                 self._apply_ai_decisions(df, amb_mask, results)
+                skipped = {name for name, error in failed.items() if is_budget_error(error)}
+                if skipped:
+                    self._mark_budget_fallback(df, amb_mask, skipped)
 
         # Final logging
         n_auto = int((df[self.decision_column] == "Auto Exclude").sum())
@@ -223,40 +293,57 @@ class Agent(BaseAgent):
             })
         return items
 
-    def _build_ai_prompt(self, items_for_ai: List[dict]) -> str:
-        guidance = """
-You are a DoorDash compliance checker. Classify each item as one of:
-- "exclude": absolutely prohibited (e.g., weapons, illegal drugs, non-pilot gift cards).
-- "review": potentially restricted but unclear; needs human review OR requires a missing merchant flag.
-- "allow": allowed for sale (including restricted-but-compliant when the correct merchant flag is present).
-
-Rules:
-1) Do NOT classify alcohol, CBD/THC, nicotine/NRT, or typical OTC meds as "exclude" by default. They are allowed when the correct merchant flag is present.
-2) If the item appears to be alcohol but is_alcohol_flag is false or null → "review" with reason "Alcohol suspected but missing flag".
-3) Same logic for CBD/THC (is_cbd_flag), nicotine/NRT (is_nicotine_flag), and OTC cough/cold/pain meds (is_otc_med_flag).
-4) Avoid substring mistakes (do not infer alcohol from letters inside unrelated words: "gin" in "original", "ale" in "wholesale", etc.). Match whole words and use category context.
-5) If L1/L2 are clearly non-restricted (e.g., Snacks > Chips), that should overrule stray name fragments.
+    def _distill_text(self, item: dict) -> str:
+        """The classifier's view of an AI review item: name, categories and merchant flags."""
+        flags = " ".join(
+            f"{k.replace('_flag', '')}={item.get(k)}"
+            for k in ("is_alcohol_flag", "is_cbd_flag", "is_nicotine_flag", "is_otc_med_flag")
+        )
+        return f"{item.get('item_name', '')} | {item.get('l1_category', '')} | {item.get('l2_category', '')} | {flags}"
+
+    def _answer_locally(self, items: List[dict]):
+        """Splits items into (still needs AI, {name: decision}) using the distilled classifier."""
+        clf = load_classifier("exclusion")
+        texts = [self._distill_text(it) for it in items]
+        confident = confident_predictions(clf, texts, self.distilled_min_confidence, self.distilled_min_agreement)
+        if not confident:
+            return items, {}
+        local = {}
+        for i, (label, conf) in confident.items():
+            nm = str(items[i].get("item_name", "")).strip().lower()
+            local[nm] = {"decision": label, "reason": "Local model (distilled from past AI verdicts)", "confidence": conf}
+        logging.info(f"Distilled classifier answered {len(local)}/{len(items)} exclusion items locally.")
+        return [it for i, it in enumerate(items) if i not in confident], local
+
+    def _record_ai_verdicts(self, items: List[dict], results: Dict[str, dict]):
+        """Logs confident AI verdicts as training data for the distilled classifier."""
+        texts, labels = [], []
+        for it in items:
+            r = results.get(str(it.get("item_name", "")).strip().lower())
+            if r and r["confidence"] >= self.ai_confidence_threshold:
+                texts.append(self._distill_text(it))
+                labels.append(r["decision"])
+        record_verdicts("exclusion", texts, labels)
 
-Return ONLY valid JSON with this exact schema:
-{
-  "results": [
-    {
-      "item_name": "...",
-      "decision": "allow|review|exclude",
-      "reason": "short reason referencing the rules/flags",
-      "confidence": 0.0
-    }
-  ]
-}
-"""
-        return f"{guidance}\n\nINPUT:\n{json.dumps(items_for_ai, ensure_ascii=False, indent=2)}"
+    def _build_ai_prompt(self, items_for_ai: List[dict]) -> str:
+        """Per-batch user message; the static guidance goes in the system message (_AI_GUIDANCE)."""
+        return f"INPUT:\n{json.dumps(items_for_ai, ensure_ascii=False, indent=2)}"
 
     def _ai_review(self, items: List[dict], api_key: str) -> Dict[str, dict]:
         if not items:
             return {}
-        prompt = self._build_ai_prompt(items)
-        raw = self.call_ai(prompt, api_key, self.model)
+        raw = self._call_ai_review(items, api_key)
+        if isinstance(raw, dict) and "error" in raw:
+            logging.error(f"AI exclusion review failed: {raw['error']}")
+            return {}
+        return self._parse_ai_review(raw)
+
+    def _call_ai_review(self, items: List[dict], api_key: str, model: Optional[str] = None):
+        """Sends one batch to the model (self.model by default) and returns the raw call_ai result."""
+        return self.call_ai(self._build_ai_prompt(items), api_key, model or self.model, system=_AI_GUIDANCE)
 
+    def _parse_ai_review(self, raw) -> Dict[str, dict]:
+        """Maps a raw review response to {normalized item name: decision} and caches it."""
         if isinstance(raw, dict):
             data = raw
         else:
@@ -310,6 +397,13 @@ Return ONLY valid JSON with this exact schema:
                 df.at[idx, decision_col] = "Review"
                 df.at[idx, issue_col] += f" 🤖 Low confidence: {reason} (conf {conf:.2f})."
 
+    def _mark_budget_fallback(self, df: pd.DataFrame, mask: pd.Series, skipped: set):
+        """Rows the AI never reviewed because the run budget ran out keep their rule-only decision."""
+        names = df.loc[mask, "CONSUMER_FACING_ITEM_NAME"].astype(str).str.strip().str.lower()
+        rows = names[names.isin(skipped)].index
+        df.loc[rows, self.issue_column] += " ℹ️ Rule-only: AI review skipped (run budget exhausted)."
+        self._note_budget_fallback(len(rows), "rule-only exclusion decisions")
+
     # ---------------------------------------------------------------------
     # Utilities
     # ---------------------------------------------------------------------
@@ -371,6 +465,7 @@ Return ONLY valid JSON with this exact schema:
              ...
         We keep the raw strings; later we heuristically map them to groups/keywords.
         """
+        import yaml  # deferred: read once per run, not at startup
         try:
             with open("restricted_items.yaml", "r") as f:
                 data = yaml.safe_load(f) or {}
@@ -296,7 +296,10 @@ class Agent(BaseAgent):
             logging.warning("LLM response was invalid. Using deterministic fallback.")
             failures = [f"- {a['attribute']}: {a['details']}" for a in required_failures]
             summary = [f"**Eligibility is {eligibility}.**"] + failures
-            
+            budget_hit = isinstance(ai_response, dict) and ai_response.get("budget_exhausted")
+            if budget_hit:
+                self._note_budget_fallback(1, "deterministic eligibility summary")
+
             return {
                 "eligibility_score": eligibility,
                 "reasons": summary,
@@ -304,7 +307,11 @@ class Agent(BaseAgent):
                     "recommendations": summary,
                     "assessment_details": all_assessments
                 },
-                "notes": "LLM summary unavailable; returned deterministic result.",
+                "notes": (
+                    "Run budget exhausted; returned deterministic result." if budget_hit
+                    else "LLM summary unavailable; returned deterministic result."
+                ),
+                "budget_fallback": bool(budget_hit),
                 "vertical": vertical,
                 "rule_source": json_path,
             }
@@ -1,9 +1,7 @@
 from .base_agent import BaseAgent
 import pandas as pd
-import requests
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import random
-from tqdm import tqdm
 import logging
 import json
 
@@ -48,6 +46,9 @@ class Agent(BaseAgent):
         
         valid_format_df = df[df['temp_image_errors'] == '']
         if not valid_format_df.empty:
+            # Deferred: only the live check needs them
+            import requests
+            from tqdm import tqdm
             sample_size = min(500, len(valid_format_df))
             sample_indices = random.sample(list(valid_format_df.index), sample_size)
             logging.info(f"Performing live check on a sample of {len(sample_indices)} images...")
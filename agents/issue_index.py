@@ -0,0 +1,205 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Issue columns not named '<Attribute>Issues?'
+EXTRA_ISSUE_COLUMNS = ['Item Name Rule Issues']
+ISSUE_MARK = '❌'
+# Columns users filter by; each value maps to its rows
+DEFAULT_FACET_COLUMNS = ['L1_CATEGORY', 'BRAND_NAME', 'ExclusionDecision']
+# Issue messages kept per column (rarer ones are still reachable through the column filter)
+MAX_ISSUE_TYPES = 50
+# Column the review sampler spreads picks across
+SPREAD_COLUMN = 'L1_CATEGORY'
+
+
+def issue_columns(columns: Sequence[str]) -> List[str]:
+    return [c for c in columns if c.endswith('Issues?') or c in EXTRA_ISSUE_COLUMNS]
+
+
+def _rows_by_value(s: pd.Series, codes: Optional[np.ndarray] = None,
+                   uniques: Optional[Sequence] = None) -> Tuple[List[str], List[np.ndarray]]:
+    """Distinct non-missing values of `s` (as text) and the sorted row positions of each."""
+    if codes is None:
+        codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    present = codes >= 0
+    order = np.argsort(codes[present], kind="stable")
+    positions = np.flatnonzero(present).astype(np.int32)[order]
+    bounds = np.cumsum(np.bincount(codes[present], minlength=len(uniques)))[:-1]
+    return [str(u) for u in uniques], np.split(positions, bounds)
+
+
+@dataclass
+class IssueIndex:
+    """
+    Row positions per issue column, per issue message and per facet value of one assessed frame.
+
+    Built once after a run. Filters intersect the sorted position arrays, so they cost in
+    proportion to the matching rows rather than the catalog.
+    """
+    n_rows: int
+    flagged: Dict[str, np.ndarray] = field(default_factory=dict)
+    issue_types: Dict[str, Dict[str, np.ndarray]] = field(default_factory=dict)
+    facets: Dict[str, Dict[str, np.ndarray]] = field(default_factory=dict)
+    # Row -> value code of each facet column (-1 = blank), for O(1) lookups while sampling
+    facet_codes: Dict[str, np.ndarray] = field(default_factory=dict)
+    # Facet column -> issue column -> distinct value codes of its flagged rows (the sampler's spread)
+    flagged_facet_codes: Dict[str, Dict[str, np.ndarray]] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, facet_columns: Sequence[str] = DEFAULT_FACET_COLUMNS) -> "IssueIndex":
+        started = time.perf_counter()
+        index = cls(n_rows=len(df))
+        # Issue text repeats heavily, so the string work runs once per distinct value
+        for col in issue_columns(df.columns):
+            values, rows = _rows_by_value(df[col])
+            flagged = [(v, r) for v, r in zip(values, rows) if ISSUE_MARK in v]
+            index.flagged[col] = np.sort(np.concatenate([r for _, r in flagged])) if flagged else np.empty(0, np.int32)
+            index.issue_types[col] = cls._issue_types(flagged)
+        for col in facet_columns:
+            if col in df.columns:
+                codes, uniques = pd.factorize(df[col], use_na_sentinel=True)
+                index.facet_codes[col] = codes.astype(np.int32)
+                merged: Dict[str, List[np.ndarray]] = {}
+                for value, rows in zip(*_rows_by_value(df[col], codes, uniques)):
+                    if value.strip():
+                        merged.setdefault(value.strip(), []).append(rows)
+                index.facets[col] = {v: r[0] if len(r) == 1 else np.sort(np.concatenate(r)) for v, r in merged.items()}
+                index.flagged_facet_codes[col] = {c: np.unique(index.facet_codes[col][rows]) for c, rows in index.flagged.items()}
+        logging.info(f"Issue index built for {len(df):,} rows in {time.perf_counter() - started:.2f}s.")
+        return index
+
+    @staticmethod
+    def _issue_types(flagged: List[Tuple[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+        """The column's most common ❌ messages, each with the rows that carry it."""
+        by_message: Dict[str, List[np.ndarray]] = {}
+        for value, rows in flagged:
+            for message in {m.strip().rstrip('. ') for m in value.split(ISSUE_MARK)}:
+                if message:
+                    by_message.setdefault(message, []).append(rows)
+        counts = {m: sum(len(r) for r in parts) for m, parts in by_message.items()}
+        top = sorted(counts, key=counts.get, reverse=True)[:MAX_ISSUE_TYPES]
+        return {m: np.sort(np.concatenate(by_message[m])) for m in top}
+
+    # --- Lookups ---
+
+    def issue_counts(self) -> Dict[str, int]:
+        return {col: len(rows) for col, rows in self.flagged.items()}
+
+    def type_counts(self, column: str) -> List[Tuple[str, int]]:
+        types = self.issue_types.get(column, {})
+        return sorted(((t, len(rows)) for t, rows in types.items()), key=lambda x: -x[1])
+
+    def facet_counts(self, column: str, limit: Optional[int] = None) -> List[Tuple[str, int]]:
+        counts = sorted(((v, len(rows)) for v, rows in self.facets.get(column, {}).items()), key=lambda x: -x[1])
+        return counts[:limit] if limit else counts
+
+    def query(
+        self,
+        issue_column: Optional[str] = None,
+        issue_type: Optional[str] = None,
+        facets: Optional[Dict[str, str]] = None,
+    ) -> np.ndarray:
+        """Sorted row positions matching every given filter (all rows when none is given)."""
+        selections = []
+        if issue_column:
+            if issue_type:
+                selections.append(self.issue_types.get(issue_column, {}).get(issue_type, np.empty(0, np.int32)))
+            else:
+                selections.append(self.flagged.get(issue_column, np.empty(0, np.int32)))
+        for column, value in (facets or {}).items():
+            if value:
+                selections.append(self.facets.get(column, {}).get(value, np.empty(0, np.int32)))
+        if not selections:
+            return np.arange(self.n_rows, dtype=np.int32)
+        selections.sort(key=len)
+        result = selections[0]
+        for rows in selections[1:]:
+            result = np.intersect1d(result, rows, assume_unique=True)
+        return result
+
+    # --- Review samples ---
+
+    def sample(
+        self,
+        n: int,
+        issue_columns: Optional[Sequence[str]] = None,
+        min_per_type: int = 1,
+        seed: int = 42,
+        spread_column: str = SPREAD_COLUMN,
+    ) -> np.ndarray:
+        """
+        `n` row positions for a review file, favouring rows that show the issues under review.
+
+        Every issue message of `issue_columns` (rarest first) gets `min_per_type` rows while
+        room remains; the rest are drawn from the flagged rows of those columns, weighted by
+        column size and capped per `spread_column` value so no category dominates. Clean rows
+        only fill what the flagged ones can't. Seeded, and the work grows with `n` and the
+        flagged rows, not the catalog: every draw is a random position into an existing index array.
+        """
+        if n >= self.n_rows:
+            return np.arange(self.n_rows, dtype=np.int32)
+        rng = np.random.default_rng(seed)
+        columns = [c for c in (issue_columns if issue_columns is not None else self.flagged) if len(self.flagged.get(c, ()))]
+        chosen: Dict[int, None] = {}  # insertion-ordered set
+
+        def draw(pool: np.ndarray, k: int) -> None:
+            for pick in rng.choice(len(pool), size=min(len(pool), k + len(chosen)), replace=False):
+                if k <= 0 or len(chosen) >= n:
+                    return
+                if int(pool[pick]) not in chosen:
+                    chosen[int(pool[pick])] = None
+                    k -= 1
+
+        # 1) Every issue message shows up, rarest first so common ones can't crowd them out
+        strata = sorted((rows for col in columns for rows in self.issue_types.get(col, {}).values()), key=len)
+        for rows in strata:
+            if len(chosen) >= n:
+                break
+            draw(rows, min_per_type)
+
+        # 2) The rest from the flagged rows, spread across the categories that hold them
+        if columns and len(chosen) < n:
+            sizes = np.array([len(self.flagged[c]) for c in columns], dtype=float)
+            codes = self.facet_codes.get(spread_column)
+            per_category: Dict[int, int] = {}
+            if codes is not None:
+                for row in chosen:
+                    per_category[int(codes[row])] = per_category.get(int(codes[row]), 0) + 1
+                spread = self.flagged_facet_codes.get(spread_column) or {}
+                flagged_categories = len(np.unique(np.concatenate(
+                    [spread[c] if c in spread else codes[self.flagged[c]] for c in columns]
+                )))
+            else:
+                flagged_categories = 1
+            cap = max(1, -(-n // flagged_categories))
+            # Every flagged row fits: nothing to spread, the cap fallback below takes them all
+            tries = 0 if sizes.sum() <= n - len(chosen) else 20 * n
+            # Random numbers drawn in bulk; the loop itself only does dict lookups
+            picked_columns = rng.choice(len(columns), size=tries, p=sizes / sizes.sum())
+            offsets = rng.random(tries)
+            for col_i, offset in zip(picked_columns.tolist(), offsets.tolist()):
+                if len(chosen) >= n:
+                    break
+                pool = self.flagged[columns[col_i]]
+                row = int(pool[int(offset * len(pool))])
+                category = int(codes[row]) if codes is not None else 0
+                if row in chosen or (codes is not None and per_category.get(category, 0) >= cap):
+                    continue
+                chosen[row] = None
+                per_category[category] = per_category.get(category, 0) + 1
+
+            # Every category had its turn: the cap gives way before any clean row is used
+            if len(chosen) < n:
+                for c in columns:
+                    draw(self.flagged[c], n - len(chosen))
+
+        # 3) Not enough flagged rows: top up with random rows (n < n_rows, so repeats are rare)
+        while len(chosen) < n:
+            for row in rng.integers(self.n_rows, size=n - len(chosen)):
+                chosen.setdefault(int(row), None)
+        return np.sort(np.fromiter(chosen, dtype=np.int32, count=len(chosen)))
@@ -1,10 +1,12 @@
 from .base_agent import BaseAgent
+from .name_templates import build_name_templates, assign_name_clusters, pick_cluster_representatives
+from .style_guide import compile_style_guide, DEFAULT_STYLE_GUIDES
+from .llm_batching import estimate_tokens, pack_batches
+from .llm_budget import is_budget_error
+from .llm_parsing import ResponseSchema
 import pandas as pd
 import os
-from openai import OpenAI
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import random
-from tqdm import tqdm
 import re
 import logging
 import json
@@ -16,6 +18,19 @@ class Agent(BaseAgent):
         self.is_nexla_mx = False
         self.model = "gpt-5-chat-latest" 
         self.style_guide = ""
+        # Template clustering: the LLM sees a few representatives per naming pattern
+        self.template_column = "Item Name Template"
+        self.reps_per_cluster = 2
+        self.max_ai_clusters = 250
+        # Expected response size per item, used to pack batches to the completion budget
+        self.completion_tokens_per_item = 150
+        self.response_schema = ResponseSchema(
+            container="keyed",
+            required={"is_consistent": bool, "is_complete": bool, "can_be_mapped": bool},
+        )
+        # Compiled style-guide rules score every row; the LLM only sees rows they can't decide
+        self.style_score_column = "Item Name Style Score"
+        self.use_style_rules = True
 
     def assess(self, df: pd.DataFrame, api_key: str = None) -> pd.DataFrame:
         logging.info(f"Running {self.attribute_name} Agent...")
@@ -54,6 +69,24 @@ class Agent(BaseAgent):
         formatting_mask = df[item_name_col].str.endswith(',', na=False)
         df.loc[formatting_mask, self.issue_column] += '❌ Formatting issue: Item name ends with a comma. '
 
+        # --- Cluster names by template + category so each pattern is checked once ---
+        brand_series = df['BRAND_NAME'] if 'BRAND_NAME' in df.columns else None
+        category_series = df['L1_CATEGORY'] if 'L1_CATEGORY' in df.columns else None
+        templates = build_name_templates(df[item_name_col].where(non_blank_mask, ''), brand_series)
+        df[self.template_column] = templates
+        cluster_ids = assign_name_clusters(templates, category_series)
+
+        # --- Style-guide conformance on every row ---
+        decided_mask = pd.Series(False, index=df.index)
+        compiled_guide = compile_style_guide(self.style_guide or DEFAULT_STYLE_GUIDES.get(self.vertical, "")) if self.use_style_rules else None
+        if compiled_guide:
+            conformance = compiled_guide.check(df, item_name_col)
+            df[self.style_score_column] = (conformance['style_score'] * 100).round(1)
+            has_style_issue = conformance['style_issues'].ne('')
+            df.loc[has_style_issue, self.issue_column] += conformance.loc[has_style_issue, 'style_issues'] + ' '
+            decided_mask = conformance['style_decided'] & non_blank_mask
+            logging.info(f"Style guide rules decided {int(decided_mask.sum())} of {len(df)} item names.")
+
         # --- 2. AI-Powered Checks ---
         if not api_key:
             logging.info("OpenAI API key not provided. Skipping AI analysis for Item Names.")
@@ -66,7 +99,8 @@ class Agent(BaseAgent):
             else "This merchant provides the full item name in a single column. Your main goal is to assess the quality and consistency of these pre-built names against our ideal style guide."
         )
 
-        prompt_template = f"""
+        # Static per run (vertical + style guide): sent as the system message so it can be prefix-cached
+        system_prompt = f"""
         You are a data quality analyst. Your goal is to assess item names based on three criteria: consistency, completeness, and mappability.
         
         INSTRUCTIONS:
@@ -79,50 +113,66 @@ class Agent(BaseAgent):
             - "is_complete": boolean. Does the name seem to be missing critical attributes (e.g., flavor, color)?
             - "can_be_mapped": boolean. Does the name contain enough information to be programmatically transformed into our style guide?
             - "suggestion": string. Provide the corrected item name according to our ideal style guide.
+            - "template_suggestion": string. Describe the fix as a reusable pattern for every item named like this one, e.g. `[Brand] [Item Name] ([Size] [UoM])`.
             - "reason": string. Provide a brief explanation for your findings.
+            - "confidence": number between 0 and 1. How certain you are of this assessment.
         Return a single JSON object where keys are the item MSIDs.
-
-        Here are the items to check:
-        {{batch_json}}
         """
 
-        # Sample from the entire DataFrame to ensure the AI always runs
-        sample_size = min(500, len(df))
-        sample_df = df.sample(n=sample_size)
+        # Rows the style rules already settled never reach the LLM
+        cluster_ids = cluster_ids.where(~decided_mask, -1)
+        df.loc[decided_mask, ai_issue_col] = "ℹ️ Decided by style-guide rules."
+        work_df = df.assign(_cluster_id=cluster_ids)
+        sample_df = pick_cluster_representatives(
+            work_df, '_cluster_id', per_cluster=self.reps_per_cluster, max_clusters=self.max_ai_clusters
+        )
+        logging.info(f"Sending {len(sample_df)} representatives from {sample_df['_cluster_id'].nunique()} name clusters to the AI.")
+        # Smaller naming patterns beyond max_ai_clusters are left to the rule checks, visibly
+        unchecked = (cluster_ids >= 0) & ~cluster_ids.isin(set(sample_df['_cluster_id']))
+        if unchecked.any():
+            df.loc[unchecked, ai_issue_col] = (
+                f"ℹ️ Not AI-checked (only the {self.max_ai_clusters} largest naming patterns are sent to the AI)."
+            )
+            logging.info(f"{int(unchecked.sum())} item names in smaller naming patterns were not AI-checked.")
 
-        def get_ai_suggestions(batch_df):
-            try:
-                batch_prompt = prompt_template.format(batch_json=batch_df.to_json(orient='records'))
-                ai_response = self.call_ai(batch_prompt, api_key, self.model)
-                if 'error' in ai_response:
-                    return {"error": ai_response['error'], "msids": batch_df['MSID'].tolist()}
-                return ai_response
-            except Exception as e:
-                logging.error(f"Error in AI batch processing: {e}", exc_info=True)
-                return {"error": str(e), "msids": batch_df['MSID'].tolist()}
-
-        batch_size = 10
-        results = {}
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            required_ai_cols = ['MSID', item_name_col, 'BRAND_NAME', 'SIZE', 'UNIT_OF_MEASUREMENT']
-            cols_to_send = [col for col in required_ai_cols if col in sample_df.columns]
-            
-            futures = [executor.submit(get_ai_suggestions, sample_df.iloc[i:i+batch_size][cols_to_send]) for i in range(0, len(sample_df), batch_size)]
-            for future in as_completed(futures):
-                res = future.result()
-                if res and isinstance(res, dict):
-                    if "error" in res:
-                        # Handle the error and flag all items in the batch
-                        for msid in res["msids"]:
-                            idx = df[df['MSID'].astype(str) == str(msid)].index
-                            if not idx.empty:
-                                df.loc[idx, ai_issue_col] = f"❌ AI Check Failed: {res['error']}"
-                    else:
-                        results.update(res)
+        required_ai_cols = ['MSID', item_name_col, 'BRAND_NAME', 'SIZE', 'UNIT_OF_MEASUREMENT']
+        cols_to_send = [col for col in required_ai_cols if col in sample_df.columns]
+        records = json.loads(sample_df[cols_to_send].to_json(orient='records'))
+
+        def get_ai_suggestions(batch_records, model):
+            batch_prompt = f"Here are the items to check:\n{json.dumps(batch_records, ensure_ascii=False)}"
+            return self.call_ai(batch_prompt, api_key, model, system=system_prompt)
 
+        # Pack representatives up to the token budget
+        batches = pack_batches(
+            records,
+            prompt_overhead_tokens=estimate_tokens(system_prompt, self.model) + estimate_tokens("Here are the items to check:", self.model),
+            max_prompt_tokens=self.max_prompt_tokens,
+            max_completion_tokens=self.max_completion_tokens,
+            completion_tokens_per_item=self.completion_tokens_per_item,
+            model=self.model,
+        )
+        # Keep every well-formed verdict; only missing/invalid MSIDs are re-queued.
+        # Cheap tier first; unsure or malformed verdicts escalate to self.model.
+        results, failed = self.run_model_cascade(
+            batches, get_ai_suggestions, self.response_schema, lambda record: record['MSID'],
+            confidence_field="confidence", max_workers=5,
+        )
+
+        # --- Resolve one verdict per cluster, then propagate it to every member ---
+        rep_cluster = dict(zip(sample_df['MSID'].astype(str), sample_df['_cluster_id']))
+        rep_messages = {}
+        cluster_messages = {}
+        # cluster id -> [flagged?] per answered representative; members only inherit a verdict all agree on
+        cluster_verdicts = {}
+        resolved_clusters = set()
         for msid_str, analysis in results.items():
             try:
-                msid = msid_str
+                msid = str(msid_str)
+                if msid not in rep_cluster or not isinstance(analysis, dict):
+                    continue
+                resolved_clusters.add(rep_cluster[msid])
+                rep_messages[msid] = ""
                 issue_msg = ""
                 # Add a comprehensive check for any of the AI's boolean flags
                 if not analysis.get('is_consistent') or not analysis.get('is_complete') or not analysis.get('can_be_mapped'):
@@ -131,15 +181,45 @@ class Agent(BaseAgent):
                     reason = analysis.get('reason', 'No specific reason provided.')
                     issue_msg += f"Reason: '{reason}'"
                 
+                cluster_verdicts.setdefault(rep_cluster[msid], []).append(bool(issue_msg))
                 if issue_msg:
                     suggestion = analysis.get('suggestion', 'N/A')
-                    issue_msg += f"Suggestion: '{suggestion}'"
-                    idx = df[df['MSID'].astype(str) == msid].index
-                    if not idx.empty:
-                        df.loc[idx, ai_issue_col] = f"{issue_msg}"
+                    rep_messages[msid] = issue_msg + f"Suggestion: '{suggestion}'"
+                    template_fix = analysis.get('template_suggestion') or 'N/A'
+                    cluster_messages.setdefault(
+                        rep_cluster[msid],
+                        issue_msg + f" Template suggestion: '{template_fix}' (checked via representative MSID {msid})"
+                    )
             except (ValueError, TypeError) as e:
                 logging.error(f"Could not process AI result for MSID: {msid_str}. Error: {e}")
 
+        mixed_clusters = {cid for cid, flags in cluster_verdicts.items() if any(flags) and not all(flags)}
+        for cid in mixed_clusters:
+            cluster_messages[cid] = "ℹ️ Not AI-checked (representatives of this naming pattern got different verdicts)."
+
+        skipped_clusters = set()
+        for msid, error in failed.items():
+            cid = rep_cluster.get(msid)
+            if cid is not None and cid not in resolved_clusters:
+                if is_budget_error(error):
+                    # Not an item problem: the rule checks above still stand
+                    skipped_clusters.add(cid)
+                    cluster_messages.setdefault(cid, "ℹ️ AI check skipped (run budget exhausted); rule checks only.")
+                else:
+                    cluster_messages.setdefault(cid, f"❌ AI Check Failed: {error}")
+        if skipped_clusters:
+            self._note_budget_fallback(int(cluster_ids.isin(skipped_clusters).sum()), "rule-only item name checks")
+
+        if cluster_messages:
+            member_msgs = cluster_ids.map(cluster_messages)
+            has_msg = member_msgs.notna()
+            df.loc[has_msg, ai_issue_col] = member_msgs[has_msg]
+        # Representatives always show their own verdict (blank when the AI found nothing)
+        if rep_messages:
+            rep_msgs = df['MSID'].map(rep_messages)
+            has_msg = rep_msgs.notna()
+            df.loc[has_msg, ai_issue_col] = rep_msgs[has_msg]
+
         return df
 
     def get_summary(self, df: pd.DataFrame) -> dict:
@@ -181,6 +261,11 @@ class Agent(BaseAgent):
             "formatting_issues": formatting_issues,
         }
 
+        if self.style_score_column in df.columns:
+            scores = pd.to_numeric(df[self.style_score_column], errors='coerce')
+            summary["style_conformance_pct"] = round(float(scores.mean()), 2) if scores.notna().any() else None
+            summary["style_scored_count"] = int(scores.notna().sum())
+
         logging.info(f"Item Name Agent Summary: {json.dumps(summary, indent=2)}")
         
         return summary
@@ -0,0 +1,367 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import subprocess
+import sys
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKER_SCRIPT = os.path.join(APP_DIR, "run_assessment_worker.py")
+# A frozen desktop build has no separate Python: its binary (app_entry) runs the worker given this flag
+FROZEN_WORKER_FLAG = "--assessment-worker"
+# Queue database and one folder per job (input file, results) shared by the app and the worker
+DEFAULT_JOBS_DIR = os.getenv("ASSESSMENT_JOBS_DIR", os.path.join(os.path.expanduser("~"), ".mx_assessment", "jobs"))
+# Jobs the worker runs at once, each in its own process
+DEFAULT_MAX_PARALLEL = int(os.getenv("ASSESSMENT_WORKERS", "2"))
+# A worker whose last heartbeat is older than this is treated as gone
+HEARTBEAT_STALE_S = 15.0
+# Finished jobs (their input copy and results) are deleted this long after they end
+JOB_RETENTION_HOURS = float(os.getenv("ASSESSMENT_JOB_RETENTION_HOURS", "72"))
+# A worker started by the app exits after this long with nothing to do
+APP_WORKER_IDLE_EXIT_S = 15 * 60
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+API_KEY_FILE = "api_key"
+RESULTS_DIR = "results"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    worker_pid INTEGER,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    owner TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    step INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_job ON events (job_id, id);
+CREATE TABLE IF NOT EXISTS workers (
+    pid INTEGER PRIMARY KEY,
+    heartbeat REAL NOT NULL,
+    max_parallel INTEGER NOT NULL
+);
+"""
+
+
+@dataclass
+class Job:
+    id: str
+    status: str
+    file_name: str
+    settings: Dict[str, Any]
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    worker_pid: Optional[int] = None
+    cancel_requested: bool = False
+    error: Optional[str] = None
+    owner: str = ""
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        data = dict(row)
+        data["settings"] = json.loads(data["settings"])
+        data["cancel_requested"] = bool(data["cancel_requested"])
+        return cls(**data)
+
+
+@dataclass
+class JobEvent:
+    id: int
+    job_id: str
+    ts: float
+    step: int
+    total: int
+    message: str
+
+
+def pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    Assessment jobs in a local SQLite database, shared by the Streamlit app and the worker.
+
+    The app submits jobs and reads their progress events; `run_assessment_worker.py` claims
+    queued jobs, runs each in its own process and records progress and the outcome. Every
+    call opens its own connection, so the queue can be used from any thread or process.
+    App-side calls pass the submitter's `owner` token, so a session only sees its own jobs.
+    """
+
+    def __init__(self, jobs_dir: str = DEFAULT_JOBS_DIR):
+        self.jobs_dir = jobs_dir
+        self.db_path = os.path.join(jobs_dir, "queue.sqlite3")
+        os.makedirs(jobs_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            # Queues created before jobs had owners
+            if "owner" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            yield conn
+        finally:
+            conn.close()
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, job_id)
+
+    def input_path(self, job: Job) -> str:
+        return os.path.join(self.job_dir(job.id), os.path.basename(job.file_name))
+
+    def results_dir(self, job_id: str) -> str:
+        return os.path.join(self.job_dir(job_id), RESULTS_DIR)
+
+    # --- Submitting (app side) ---
+
+    def submit(self, file_content: bytes, file_name: str, settings: Dict[str, Any], owner: str,
+               api_key: str = "") -> str:
+        """Queues a run of `settings` over the file for `owner`; returns the job id. The API key never goes in the database."""
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        folder = self.job_dir(job_id)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, os.path.basename(file_name)), "wb") as f:
+            f.write(file_content)
+        if api_key:
+            # Read and deleted by the job's process; only the owner can read it meanwhile
+            fd = os.open(os.path.join(folder, API_KEY_FILE), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(api_key)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, file_name, settings, created_at, owner) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, file_name, json.dumps(settings, default=str), time.time(), owner),
+            )
+        logging.info(f"Queued assessment job {job_id} for {file_name}.")
+        return job_id
+
+    def cancel(self, job_id: str, owner: str) -> None:
+        """Cancels `owner`'s job: a queued one at once, a running one on the worker's next check."""
+        if self.get(job_id, owner) is None:
+            return
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                         (time.time(), job_id))
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+        self.pop_api_key(job_id)
+
+    # --- Reading ---
+
+    def get(self, job_id: str, owner: Optional[str] = None) -> Optional[Job]:
+        """The job, or None if it doesn't exist or (when `owner` is given) belongs to someone else."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (owner is not None and row["owner"] != owner):
+            return None
+        return Job.from_row(row)
+
+    def list_jobs(self, owner: str, limit: int = 50) -> List[Job]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE owner = ? ORDER BY created_at DESC LIMIT ?",
+                                (owner, limit)).fetchall()
+        return [Job.from_row(r) for r in rows]
+
+    def events(self, job_id: str, after_id: int = 0) -> List[JobEvent]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM events WHERE job_id = ? AND id > ? ORDER BY id",
+                                (job_id, after_id)).fetchall()
+        return [JobEvent(**dict(r)) for r in rows]
+
+    def last_event(self, job_id: str) -> Optional[JobEvent]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM events WHERE job_id = ? ORDER BY id DESC LIMIT 1", (job_id,)).fetchone()
+        return JobEvent(**dict(row)) if row else None
+
+    def queue_position(self, job_id: str) -> int:
+        """Queued jobs ahead of this one (0 when it is next or not queued)."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < "
+                "(SELECT created_at FROM jobs WHERE id = ? AND status = 'queued')", (job_id,)).fetchone()
+        return int(row[0] or 0)
+
+    # --- Running (worker side) ---
+
+    def claim_next(self, worker_pid: int) -> Optional[Job]:
+        """Marks the oldest queued job running and returns it (None when the queue is empty)."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+                if row is not None:
+                    conn.execute("UPDATE jobs SET status = 'running', started_at = ?, worker_pid = ? WHERE id = ?",
+                                 (time.time(), worker_pid, row["id"]))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"]) if row is not None else None
+
+    def set_worker_pid(self, job_id: str, pid: int) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET worker_pid = ? WHERE id = ?", (pid, job_id))
+
+    def add_event(self, job_id: str, step: int, total: int, message: str) -> None:
+        with self._connect() as conn:
+            conn.execute("INSERT INTO events (job_id, ts, step, total, message) VALUES (?, ?, ?, ?, ?)",
+                         (job_id, time.time(), step, total, message))
+
+    def finish(self, job_id: str) -> None:
+        self._end(job_id, "done")
+
+    def fail(self, job_id: str, error: str, status: str = "failed") -> None:
+        self._end(job_id, status, error)
+
+    def _end(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ? AND status = 'running'",
+                         (status, time.time(), error, job_id))
+        self.pop_api_key(job_id)
+        logging.info(f"Job {job_id} {status}" + (f": {error}" if error else "."))
+
+    def pop_api_key(self, job_id: str) -> str:
+        """Reads and deletes the job's API key file ('' when there is none)."""
+        path = os.path.join(self.job_dir(job_id), API_KEY_FILE)
+        try:
+            with open(path) as f:
+                key = f.read().strip()
+            os.remove(path)
+            return key
+        except FileNotFoundError:
+            return ""
+
+    def running_jobs(self) -> List[Job]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE status = 'running'").fetchall()
+        return [Job.from_row(r) for r in rows]
+
+    def purge_finished(self, max_age_hours: float = JOB_RETENTION_HOURS) -> int:
+        """Deletes jobs that ended more than `max_age_hours` ago, with their events and folders; returns how many."""
+        cutoff = time.time() - max_age_hours * 3600
+        with self._connect() as conn:
+            ids = [row["id"] for row in conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND COALESCE(finished_at, created_at) < ?", (cutoff,))]
+            for job_id in ids:
+                conn.execute("DELETE FROM events WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        for job_id in ids:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        if ids:
+            logging.info(f"Purged {len(ids)} finished job(s) older than {max_age_hours:.0f}h.")
+        return len(ids)
+
+    def fail_orphaned(self) -> int:
+        """Fails running jobs whose process is gone (e.g. after a crash or restart); returns how many."""
+        orphaned = [j for j in self.running_jobs() if not pid_alive(j.worker_pid)]
+        for job in orphaned:
+            self.fail(job.id, "The worker stopped before the job finished; submit it again.")
+        return len(orphaned)
+
+    # --- Worker liveness ---
+
+    def register_worker(self, pid: int, max_parallel: int) -> bool:
+        """Records this worker unless another live one is registered (only one worker per queue)."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT pid FROM workers WHERE heartbeat > ? AND pid != ?",
+                                (time.time() - HEARTBEAT_STALE_S, pid)).fetchall()
+            if any(pid_alive(row["pid"]) for row in rows):
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute("DELETE FROM workers")
+            conn.execute("INSERT INTO workers (pid, heartbeat, max_parallel) VALUES (?, ?, ?)",
+                         (pid, time.time(), max_parallel))
+            conn.execute("COMMIT")
+        return True
+
+    def heartbeat(self, pid: int, max_parallel: int) -> None:
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO workers (pid, heartbeat, max_parallel) VALUES (?, ?, ?)",
+                         (pid, time.time(), max_parallel))
+
+    def remove_worker(self, pid: int) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM workers WHERE pid = ?", (pid,))
+
+    def live_worker(self) -> Optional[Dict[str, Any]]:
+        """The worker with a recent heartbeat and a running process, if any."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM workers WHERE heartbeat > ? ORDER BY heartbeat DESC",
+                                (time.time() - HEARTBEAT_STALE_S,)).fetchall()
+        for row in rows:
+            if pid_alive(row["pid"]):
+                return dict(row)
+        return None
+
+
+def worker_command(*args: str) -> List[str]:
+    """Command line that runs run_assessment_worker.py with `args`, from source or from a frozen build."""
+    if getattr(sys, "frozen", False):
+        return [sys.executable, FROZEN_WORKER_FLAG, *args]
+    return [sys.executable, WORKER_SCRIPT, *args]
+
+
+def start_worker(jobs_dir: str = DEFAULT_JOBS_DIR, max_parallel: int = DEFAULT_MAX_PARALLEL,
+                 idle_exit_s: float = APP_WORKER_IDLE_EXIT_S, wait_s: float = 10.0) -> bool:
+    """
+    Starts the worker in its own session, so it outlives the page (and the Streamlit server)
+    that started it, and waits for its first heartbeat. It runs in the app's working folder,
+    so it reads the same taxonomy. Returns False if it did not come up; its output is in
+    worker.log in the jobs folder.
+    """
+    queue = JobQueue(jobs_dir)
+    if queue.live_worker():
+        return True
+    with open(os.path.join(jobs_dir, "worker.log"), "ab") as log:
+        proc = subprocess.Popen(
+            worker_command("--jobs-dir", jobs_dir, "--max-parallel", str(max_parallel), "--idle-exit", str(idle_exit_s)),
+            cwd=os.getcwd(), stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+        )
+    deadline = time.monotonic() + wait_s
+    while time.monotonic() < deadline and proc.poll() is None:
+        if queue.live_worker():
+            return True
+        time.sleep(0.2)
+    # Exited early: another worker won the race, or it failed to start
+    if queue.live_worker():
+        return True
+    logging.error(f"The assessment worker did not start; see {os.path.join(jobs_dir, 'worker.log')}.")
+    return False
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from . import llm_client
+from .llm_cache import ResponseCache
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+_TERMINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+
+
+def write_batch_file(requests: Dict[str, Dict[str, Any]], path: str) -> str:
+    """Writes collected requests as Batch API JSONL; the request hash doubles as custom_id."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for key, params in requests.items():
+            line = {"custom_id": key, "method": "POST", "url": BATCH_ENDPOINT, "body": params}
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    logging.info(f"Wrote {len(requests)} requests to batch file {path}.")
+    return path
+
+
+def submit_batch(client, path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+    """Uploads a JSONL file and starts a batch job; returns the batch id."""
+    with open(path, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h",
+        metadata=metadata or None,
+    )
+    logging.info(f"Submitted batch {batch.id} ({os.path.basename(path)}).")
+    return batch.id
+
+
+def wait_for_batch(
+    client,
+    batch_id: str,
+    *,
+    initial_delay: float = 5.0,
+    max_delay: float = 300.0,
+    timeout: float = 24 * 3600,
+    sleep: Callable[[float], None] = time.sleep,
+):
+    """Polls a batch with exponential backoff until it reaches a terminal state."""
+    delay = initial_delay
+    deadline = time.monotonic() + timeout
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = getattr(batch, "request_counts", None)
+        progress = f" ({counts.completed}/{counts.total} done)" if counts else ""
+        logging.info(f"Batch {batch_id}: {batch.status}{progress}.")
+        if batch.status in _TERMINAL_STATES:
+            return batch
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Batch {batch_id} still '{batch.status}' after {timeout:.0f}s.")
+        sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def ingest_batch_results(client, batch, cache: ResponseCache) -> Tuple[int, int]:
+    """Stores every successful response in the cache; returns (stored, failed)."""
+    stored = failed = 0
+    if getattr(batch, "output_file_id", None):
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") == 200 and response.get("body"):
+                cache.put(record["custom_id"], response["body"])
+                stored += 1
+            else:
+                failed += 1
+                logging.warning(f"Batch request {record.get('custom_id', '?')[:12]} failed: {record.get('error') or response}")
+    if getattr(batch, "error_file_id", None):
+        errors = [l for l in client.files.content(batch.error_file_id).text.splitlines() if l.strip()]
+        failed += len(errors)
+        for line in errors[:5]:
+            logging.warning(f"Batch error: {line}")
+    logging.info(f"Batch {batch.id}: cached {stored} responses, {failed} failed.")
+    return stored, failed
+
+
+def run_with_batch_api(
+    run_fn: Callable[[], Any],
+    api_key: str,
+    *,
+    workdir: str,
+    cache: Optional[ResponseCache] = None,
+    max_rounds: int = 4,
+    poll_initial_delay: float = 5.0,
+    poll_max_delay: float = 300.0,
+) -> Any:
+    """
+    Runs `run_fn` (the pipeline) in collect mode, ships its cache misses as a batch job,
+    fills the response cache from the results and runs it again. Each pass replays the
+    cached answers through the agents' normal apply steps; repeats until no request is
+    left (retries/re-queued items can add a few) or `max_rounds` is reached.
+    """
+    cache = cache or ResponseCache()
+    client = llm_client.get_client(api_key)
+    llm_client.configure(mode="collect", response_cache=cache)
+    try:
+        for round_no in range(1, max_rounds + 1):
+            llm_client.take_pending()
+            result = run_fn()
+            pending = llm_client.take_pending()
+            if not pending:
+                logging.info(f"Batch mode: all requests answered after {round_no - 1} batch job(s).")
+                return result
+
+            path = write_batch_file(pending, os.path.join(workdir, f"batch_round_{round_no}.jsonl"))
+            batch_id = submit_batch(client, path, metadata={"round": str(round_no)})
+            batch = wait_for_batch(client, batch_id, initial_delay=poll_initial_delay, max_delay=poll_max_delay)
+            if batch.status != "completed":
+                logging.error(f"Batch {batch_id} ended as '{batch.status}'.")
+            stored, _ = ingest_batch_results(client, batch, cache)
+            if stored == 0:
+                logging.error("Batch returned no usable responses; stopping.")
+                break
+
+        # Final pass: whatever is still missing stays marked as deferred/failed in the results
+        llm_client.take_pending()
+        result = run_fn()
+        left = llm_client.take_pending()
+        if left:
+            logging.warning(f"Batch mode: {len(left)} requests still unanswered after {max_rounds} rounds.")
+        return result
+    finally:
+        llm_client.configure(mode="live")
@@ -0,0 +1,157 @@
+import json
+import logging
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .llm_client import call_annotations, context_executor, next_batch_id
+from .llm_parsing import ResponseSchema, extract_items
+
+# Rough chars-per-token ratio used when tiktoken is unavailable
+_CHARS_PER_TOKEN = 4
+
+# Error fragments that mean "the batch was too big", not "the call is broken": the API's
+# context-length error, a completion cut off at the token limit, and call_ai's own JSON parse failure
+_RETRIABLE_ERRORS = (
+    "context_length_exceeded", "maximum context length", "finish_reason=length", "failed to parse json response",
+)
+
+
+@lru_cache(maxsize=8)
+def _encoder(model: str):
+    try:
+        import tiktoken  # optional, imported on first use: fall back to a character heuristic
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        try:
+            return tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logging.warning(f"tiktoken unavailable ({e}); using character heuristic for token estimates.")
+            return None
+
+
+def estimate_tokens(value: Any, model: str = "gpt-4o") -> int:
+    """Estimates how many tokens `value` (str or JSON-serialisable) costs in a prompt."""
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    enc = _encoder(model)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+def pack_batches(
+    items: List[Any],
+    *,
+    prompt_overhead_tokens: int,
+    max_prompt_tokens: int,
+    max_completion_tokens: int,
+    completion_tokens_per_item: int,
+    max_items: Optional[int] = None,
+    model: str = "gpt-4o",
+    item_tokens: Optional[Callable[[Any], int]] = None,
+) -> List[List[Any]]:
+    """
+    Greedily packs items into batches that fit both the prompt and the completion budget.
+    An item too large for an empty batch still gets a batch of its own.
+    """
+    measure = item_tokens or (lambda it: estimate_tokens(it, model))
+    per_item_completion = max(completion_tokens_per_item, 1)
+    completion_cap = max(max_completion_tokens // per_item_completion, 1)
+    item_cap = min(completion_cap, max_items) if max_items else completion_cap
+
+    batches: List[List[Any]] = []
+    current: List[Any] = []
+    used = prompt_overhead_tokens
+    for item in items:
+        cost = measure(item)
+        if current and (used + cost > max_prompt_tokens or len(current) >= item_cap):
+            batches.append(current)
+            current, used = [], prompt_overhead_tokens
+        current.append(item)
+        used += cost
+    if current:
+        batches.append(current)
+
+    logging.info(f"Packed {len(items)} items into {len(batches)} batches (prompt budget {max_prompt_tokens}, item cap {item_cap}).")
+    return batches
+
+
+def is_retriable_error(result: Any) -> bool:
+    """True when a call_ai-style result failed in a way a smaller batch could fix."""
+    if not isinstance(result, dict) or "error" not in result:
+        return False
+    msg = str(result["error"]).lower()
+    return any(fragment in msg for fragment in _RETRIABLE_ERRORS)
+
+
+def run_validated_batches(
+    batches: List[List[Any]],
+    call_fn: Callable[[List[Any]], Any],
+    schema: ResponseSchema,
+    item_id: Callable[[Any], str],
+    *,
+    max_workers: int = 1,
+    max_single_retries: int = 1,
+    is_retriable: Callable[[Any], bool] = is_retriable_error,
+) -> Tuple[Dict[str, dict], Dict[str, str]]:
+    """
+    Runs batches and keeps every schema-valid item, even from responses that failed to parse.
+
+    Only the items missing from (or invalid in) a response are re-queued, in batches half
+    the size of the one they came from. Single items get `max_single_retries` more tries.
+    Returns ({item id: validated item}, {item id: last error}).
+    """
+    results: Dict[str, dict] = {}
+    failures: Dict[str, str] = {}
+    lock = threading.Lock()
+
+    def run_one(batch: List[Any], attempt: int, depth: int) -> List[Tuple[List[Any], int, int]]:
+        try:
+            # depth = how many times these items have been re-queued
+            with call_annotations(batch_id=next_batch_id(), retries=depth, items=len(batch)):
+                result = call_fn(batch)
+        except Exception as e:
+            logging.error(f"Batch call raised: {e}", exc_info=True)
+            result = {"error": str(e)}
+
+        wanted = {schema.normalize_id(item_id(it)): it for it in batch}
+        valid = {k: v for k, v in extract_items(result, schema).items() if k in wanted}
+        missing = [it for k, it in wanted.items() if k not in valid]
+        failed_call = isinstance(result, dict) and "error" in result
+        error = str(result["error"]) if failed_call else "Item missing or invalid in AI response."
+
+        with lock:
+            results.update(valid)
+            for k in valid:
+                failures.pop(k, None)
+        if not missing:
+            return []
+        if failed_call:
+            logging.warning(f"Batch of {len(batch)} failed ({error}); kept {len(valid)} well-formed items.")
+
+        # Calls that broke for reasons a smaller batch can't fix are not retried
+        hopeless = failed_call and not result.get("raw_content") and not is_retriable(result)
+        if hopeless or (len(missing) == 1 and attempt >= max_single_retries):
+            with lock:
+                for it in missing:
+                    failures[schema.normalize_id(item_id(it))] = error
+            return []
+
+        chunk = max(1, len(batch) // 2)
+        next_attempt = attempt + 1 if len(missing) == 1 else attempt
+        return [(missing[i:i + chunk], next_attempt, depth + 1) for i in range(0, len(missing), chunk)]
+
+    queue: List[Tuple[List[Any], int, int]] = [(batch, 0, 0) for batch in batches if batch]
+    while queue:
+        if max_workers > 1 and len(queue) > 1:
+            with context_executor(max_workers) as executor:
+                rounds = list(executor.map(lambda job: run_one(*job), queue))
+        else:
+            rounds = [run_one(*job) for job in queue]
+        queue = [job for requeued in rounds for job in requeued]
+        if queue:
+            logging.info(f"Re-queuing {sum(len(job[0]) for job in queue)} missing/invalid items in {len(queue)} smaller batches.")
+    return results, failures
@@ -0,0 +1,138 @@
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from .api_tracker import PRICES_USD_PER_MTOK, estimate_usage_cost
+
+# Largest share of the run budget each LLM agent may spend on its own (shares may sum past 1.0:
+# they stop one agent from starving the rest, the run total still applies).
+# Agents not listed are only held to the run total.
+DEFAULT_AGENT_SHARES: Dict[str, float] = {
+    "Item Name Rules": 0.5,
+    "Exclusion": 0.3,
+    "Category": 0.3,
+    "Master Reporting": 0.4,
+    "Website Comparison": 0.1,
+    "Final Summary": 0.1,
+}
+
+BUDGET_EXHAUSTED = "Run budget exhausted"
+
+
+class BudgetExceeded(Exception):
+    """Raised instead of sending a request once the run (or the calling agent's share) is spent."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"{BUDGET_EXHAUSTED}: {reason}.")
+        self.reason = reason
+
+
+def is_budget_error(error: Any) -> bool:
+    """True for a BudgetExceeded, its message, or a call_ai-style result that carries one."""
+    if isinstance(error, dict):
+        error = error.get("error", "")
+    return str(error).startswith(BUDGET_EXHAUSTED)
+
+
+class RunBudget:
+    """
+    Caps on USD, tokens and wall-clock seconds for one assessment run.
+
+    Checked before every request that would reach the API (cache replays and coalesced
+    calls are free) and charged with the response's usage. Calls already in flight when
+    a cap is reached still complete, so the overshoot is bounded by the concurrency limit.
+    """
+
+    def __init__(
+        self,
+        max_usd: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        max_seconds: Optional[float] = None,
+        agent_shares: Optional[Dict[str, float]] = None,
+        price_table: Optional[Dict[str, Dict[str, float]]] = None,
+    ):
+        self.max_usd = max_usd or None
+        self.max_tokens = max_tokens or None
+        self.max_seconds = max_seconds or None
+        self.agent_shares = DEFAULT_AGENT_SHARES if agent_shares is None else agent_shares
+        self.price_table = price_table or PRICES_USD_PER_MTOK
+        self.started = time.monotonic()
+        self.spent_usd: Dict[str, float] = {}
+        self.spent_tokens: Dict[str, int] = {}
+        self.fallbacks: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return any(v is not None for v in (self.max_usd, self.max_tokens, self.max_seconds))
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining_seconds(self) -> Optional[float]:
+        return None if self.max_seconds is None else max(self.max_seconds - self.elapsed(), 0.0)
+
+    def exhausted_reason(self, agent: str = "") -> Optional[str]:
+        """Why `agent` may not send another request, or None if it may."""
+        with self._lock:
+            total_usd, total_tokens = sum(self.spent_usd.values()), sum(self.spent_tokens.values())
+            agent_usd, agent_tokens = self.spent_usd.get(agent, 0.0), self.spent_tokens.get(agent, 0)
+        if self.max_seconds is not None and self.elapsed() >= self.max_seconds:
+            return f"{self.max_seconds:.0f}s time limit reached"
+        if self.max_usd is not None and total_usd >= self.max_usd:
+            return f"${total_usd:.4f} of ${self.max_usd:.4f} spent"
+        if self.max_tokens is not None and total_tokens >= self.max_tokens:
+            return f"{total_tokens:,} of {self.max_tokens:,} tokens used"
+
+        share = self.agent_shares.get(agent)
+        if share is not None:
+            if self.max_usd is not None and agent_usd >= self.max_usd * share:
+                return f"'{agent}' spent its {share:.0%} share (${agent_usd:.4f})"
+            if self.max_tokens is not None and agent_tokens >= self.max_tokens * share:
+                return f"'{agent}' used its {share:.0%} share ({agent_tokens:,} tokens)"
+        return None
+
+    def check(self, agent: str = "") -> None:
+        reason = self.exhausted_reason(agent)
+        if reason:
+            raise BudgetExceeded(reason)
+
+    def charge(self, agent: str, model: str, response: Any) -> None:
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        usage_dict = usage.model_dump() if hasattr(usage, "model_dump") else dict(usage)
+        cost = estimate_usage_cost(model, usage_dict, self.price_table)
+        tokens = int(usage_dict.get("total_tokens") or 0)
+        with self._lock:
+            self.spent_usd[agent] = self.spent_usd.get(agent, 0.0) + cost
+            self.spent_tokens[agent] = self.spent_tokens.get(agent, 0) + tokens
+
+    def record_fallback(self, agent: str, items: int, detail: str) -> None:
+        """Notes that `agent` answered `items` with its deterministic path instead of the LLM."""
+        logging.warning(f"Budget fallback for '{agent}': {items} item(s) handled without AI ({detail}).")
+        with self._lock:
+            self.fallbacks.append({"agent": agent, "items": int(items), "detail": detail})
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "spent_usd": round(sum(self.spent_usd.values()), 6),
+                "spent_tokens": sum(self.spent_tokens.values()),
+                "elapsed_s": round(self.elapsed(), 1),
+                "max_usd": self.max_usd,
+                "max_tokens": self.max_tokens,
+                "max_seconds": self.max_seconds,
+                "by_agent": {
+                    agent: {"usd": round(usd, 6), "tokens": self.spent_tokens.get(agent, 0)}
+                    for agent, usd in self.spent_usd.items()
+                },
+                "fallbacks": self._grouped_fallbacks(),
+            }
+
+    def _grouped_fallbacks(self) -> List[Dict[str, Any]]:
+        grouped: Dict[tuple, int] = {}
+        for f in self.fallbacks:
+            grouped[(f["agent"], f["detail"])] = grouped.get((f["agent"], f["detail"]), 0) + f["items"]
+        return [{"agent": agent, "items": items, "detail": detail} for (agent, detail), items in grouped.items()]
@@ -0,0 +1,53 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+from typing import Any, Dict, Optional
+
+# On-disk cache of raw chat-completion bodies, keyed on a hash of the request parameters
+DEFAULT_CACHE_DIR = os.getenv(
+    "LLM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".mx_assessment", "llm_cache")
+)
+
+
+def request_key(params: Dict[str, Any]) -> str:
+    """Stable content hash of a chat-completion request (model, messages, options)."""
+    canonical = json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """One JSON file per response, sharded by hash prefix; writes are atomic renames."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"Ignoring unreadable cache entry {key[:12]}: {e}")
+            return None
+
+    def put(self, key: str, body: Dict[str, Any]) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(body, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
@@ -0,0 +1,285 @@
+import os
+import hashlib
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from .llm_budget import BudgetExceeded, RunBudget
+from .llm_cache import ResponseCache, request_key
+
+if TYPE_CHECKING:  # openai takes ~0.5s to import; it loads on the first request instead
+    from openai import OpenAI
+
+# Process-wide cap on in-flight LLM requests, shared by every agent and session
+MAX_CONCURRENT_REQUESTS = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+_request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# Execution mode:
+#   - "live":    call the API synchronously (default)
+#   - "collect": record cache misses for an offline batch job instead of calling the API
+_mode = "live"
+_response_cache: Optional[ResponseCache] = ResponseCache() if os.getenv("LLM_RESPONSE_CACHE") == "1" else None
+_pending: Dict[str, Dict[str, Any]] = {}
+_pending_lock = threading.Lock()
+
+# Identical requests already on the wire, keyed like the response cache; shared by every session
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+_call_info = threading.local()
+_batch_ids = itertools.count(1)
+
+
+class DeferredRequest(Exception):
+    """Raised in collect mode: the request was queued for a batch job rather than sent."""
+
+    def __init__(self, key: str):
+        super().__init__(f"Request deferred to batch job ({key[:12]}).")
+        self.key = key
+
+
+@lru_cache(maxsize=16)
+def get_client(api_key: str) -> "OpenAI":
+    """One OpenAI client (and its connection pool) per API key."""
+    from openai import OpenAI
+    return OpenAI(api_key=api_key)
+
+
+def configure(mode: Optional[str] = None, response_cache: Optional[ResponseCache] = None) -> None:
+    """Switches the execution mode and/or installs a response cache for this process."""
+    global _mode, _response_cache
+    if mode is not None:
+        if mode not in ("live", "collect"):
+            raise ValueError(f"Unknown LLM execution mode: {mode}")
+        _mode = mode
+    if response_cache is not None:
+        _response_cache = response_cache
+
+
+def take_pending() -> Dict[str, Dict[str, Any]]:
+    """Returns and clears the requests collected since the last call, keyed by request hash."""
+    global _pending
+    with _pending_lock:
+        pending, _pending = _pending, {}
+    return pending
+
+
+def next_batch_id() -> str:
+    return f"b{next(_batch_ids)}"
+
+
+@contextmanager
+def call_annotations(**fields):
+    """Tags every LLM call made by this thread inside the block (batch_id, retries, items)."""
+    previous = getattr(_call_info, "annotations", {})
+    _call_info.annotations = {**previous, **fields}
+    try:
+        yield
+    finally:
+        _call_info.annotations = previous
+
+
+def current_annotations() -> Dict[str, Any]:
+    return dict(getattr(_call_info, "annotations", {}))
+
+
+@contextmanager
+def budget_scope(budget: Optional[RunBudget]):
+    """Enforces `budget` on every LLM call made by this thread (and context_executor workers) inside the block."""
+    previous = getattr(_call_info, "budget", None)
+    _call_info.budget = budget
+    try:
+        yield budget
+    finally:
+        _call_info.budget = previous
+
+
+def active_budget() -> Optional[RunBudget]:
+    return getattr(_call_info, "budget", None)
+
+
+@contextmanager
+def dry_run():
+    """
+    Collects the requests made inside the block instead of sending them (each raises
+    DeferredRequest, like collect mode, but only for this thread and its context_executor
+    workers). Yields the list of {"agent", "items", "params"} entries.
+    """
+    previous = getattr(_call_info, "dry_run", None)
+    collected: List[Dict[str, Any]] = []
+    _call_info.dry_run = collected
+    try:
+        yield collected
+    finally:
+        _call_info.dry_run = previous
+
+
+def is_dry_run() -> bool:
+    return getattr(_call_info, "dry_run", None) is not None
+
+
+def last_call_source() -> str:
+    """How this thread's last chat_completion was served: "api", "cache" or "coalesced"."""
+    return getattr(_call_info, "source", "api")
+
+
+def chat_completion(api_key: str, params: Dict[str, Any]) -> Any:
+    """
+    Runs a chat completion under the shared concurrency limit.
+
+    Cached responses are replayed; in collect mode cache misses raise DeferredRequest.
+    A request identical to one already in flight under the same API key (any agent, any
+    session) waits for that call and shares its response instead of making another. Under an
+    active RunBudget, a request that would exceed it raises BudgetExceeded instead of being
+    sent or joined; another run's BudgetExceeded is never shared.
+    """
+    key = request_key(params)
+    if _response_cache is not None:
+        body = _response_cache.get(key)
+        if body is not None:
+            from openai.types.chat import ChatCompletion
+            _call_info.source = "cache"
+            logging.info(f"LLM response cache hit ({key[:12]}).")
+            return ChatCompletion.model_validate(body)
+
+    collected = getattr(_call_info, "dry_run", None)
+    if collected is not None:
+        annotations = current_annotations()
+        collected.append({"agent": annotations.get("agent", ""), "items": annotations.get("items", 1), "params": params})
+        raise DeferredRequest(key)
+
+    if _mode == "collect":
+        with _pending_lock:
+            _pending[key] = params
+        raise DeferredRequest(key)
+
+    budget = active_budget()
+    agent = current_annotations().get("agent", "")
+    # Callers only share a call made with their own key (a bad or over-quota key fails alone)
+    inflight_key = f"{hashlib.sha256((api_key or '').encode()).hexdigest()[:16]}:{key}"
+    while True:
+        with _inflight_lock:
+            shared = _inflight.get(inflight_key)
+            if shared is None:
+                _inflight[inflight_key] = leader = Future()
+        if shared is None:
+            break
+        # A follower answers to its own run's budget, never to the leader's
+        if budget is not None:
+            budget.check(agent)
+        try:
+            response = shared.result()
+        except BudgetExceeded:
+            # The leader's budget ran out, not necessarily ours: retry, as the leader if nobody else is
+            continue
+        _call_info.source = "coalesced"
+        logging.info(f"Coalesced with an identical in-flight LLM request ({key[:12]}).")
+        return response
+
+    _call_info.source = "api"
+    try:
+        with _request_slots:
+            extra = {}
+            if budget is not None:
+                # Checked once a slot is free: waiting for it may have used up the time limit
+                budget.check(agent)
+                if budget.max_seconds is not None:
+                    extra["timeout"] = max(budget.remaining_seconds(), 1.0)
+            response = get_client(api_key).chat.completions.create(**params, **extra)
+        if budget is not None:
+            budget.charge(agent, params.get("model", ""), response)
+        if _response_cache is not None:
+            _response_cache.put(key, response.model_dump(mode="json"))
+        leader.set_result(response)
+        return response
+    except BaseException as e:
+        leader.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(inflight_key, None)
+
+
+class StreamedReply:
+    """
+    Consumes a streamed chat completion: `text()` yields content deltas as they arrive
+    (e.g. for st.write_stream) while tool-call fragments and the final usage are collected.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.content = ""
+        self.tool_calls: Dict[int, Dict[str, Any]] = {}
+        self.usage: Optional[Dict[str, Any]] = None
+
+    def text(self):
+        for chunk in self._chunks:
+            if chunk.usage is not None:
+                self.usage = chunk.usage.model_dump()
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            for call in delta.tool_calls or []:
+                entry = self.tool_calls.setdefault(call.index, {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+                entry["id"] = call.id or entry["id"]
+                if call.function is not None:
+                    entry["function"]["name"] += call.function.name or ""
+                    entry["function"]["arguments"] += call.function.arguments or ""
+            if delta.content:
+                self.content += delta.content
+                yield delta.content
+
+    def message(self) -> Dict[str, Any]:
+        """The reply as an assistant message to append to the conversation."""
+        message: Dict[str, Any] = {"role": "assistant", "content": self.content}
+        if self.tool_calls:
+            message["tool_calls"] = [self.tool_calls[i] for i in sorted(self.tool_calls)]
+        return message
+
+
+def stream_chat_completion(api_key: str, params: Dict[str, Any]) -> StreamedReply:
+    """
+    Streams a chat completion under the shared concurrency limit, holding a slot until the
+    stream is drained. Streams are neither cached nor coalesced: interactive replies are
+    unique and are read as they arrive.
+    """
+    def chunks():
+        with _request_slots:
+            yield from get_client(api_key).chat.completions.create(
+                **params, stream=True, stream_options={"include_usage": True}
+            )
+
+    _call_info.source = "api"
+    return StreamedReply(chunks())
+
+
+def _attach_script_context(ctx, annotations: Dict[str, Any], budget: Optional[RunBudget],
+                           collected: Optional[List[Dict[str, Any]]]) -> None:
+    _call_info.annotations = annotations
+    _call_info.budget = budget
+    _call_info.dry_run = collected
+    if ctx is None:
+        return
+    try:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx
+        add_script_run_ctx(threading.current_thread(), ctx)
+    except Exception as e:
+        logging.debug(f"Could not attach Streamlit context to worker thread: {e}")
+
+
+def context_executor(max_workers: int) -> ThreadPoolExecutor:
+    """
+    ThreadPoolExecutor whose workers inherit the caller's Streamlit script context,
+    so agents can still reach st.session_state (e.g. the API usage tracker) from threads,
+    along with its call annotations, run budget and dry-run collector.
+    """
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+    except Exception:
+        ctx = None
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=_attach_script_context,
+                              initargs=(ctx, current_annotations(), active_budget(), getattr(_call_info, "dry_run", None)))
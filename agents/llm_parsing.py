@@ -0,0 +1,126 @@
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+_decoder = json.JSONDecoder()
+_KEYED_OBJECT_RE = re.compile(r'"((?:[^"\\]|\\.)*)"\s*:\s*\{')
+
+
+@dataclass
+class ResponseSchema:
+    """
+    Describes one agent's batch response so every well-formed item can be kept.
+
+    container:
+      - "keyed": {"<item id>": {...}, ...}          (Item Name)
+      - "list":  {"<list_key>": [{...}, ...]}      (Exclusion, taxonomy mapping)
+    required maps field name -> accepted type(s); `checks` holds extra per-field predicates.
+    """
+    container: str
+    required: Dict[str, Any]
+    list_key: Optional[str] = None
+    id_field: Optional[str] = None
+    checks: Dict[str, Callable[[Any], bool]] = field(default_factory=dict)
+    normalize_id: Callable[[Any], str] = lambda v: str(v).strip()
+
+    def is_valid(self, obj: Any) -> bool:
+        if not isinstance(obj, dict):
+            return False
+        for name, types in self.required.items():
+            if name not in obj or not isinstance(obj[name], types):
+                return False
+        for name, predicate in self.checks.items():
+            try:
+                if not predicate(obj.get(name)):
+                    return False
+            except Exception:
+                return False
+        return True
+
+
+def extract_items(result: Any, schema: ResponseSchema) -> Dict[str, dict]:
+    """
+    Returns {item id: item} for every schema-valid item in a call_ai-style result.
+    Parsed responses are validated item by item; failed parses are salvaged from raw text.
+    """
+    if isinstance(result, dict) and "error" in result:
+        raw = result.get("raw_content")
+        return dict(salvage_items(raw, schema)) if raw else {}
+
+    if isinstance(result, str):
+        try:
+            result = json.loads(result)
+        except json.JSONDecodeError:
+            return dict(salvage_items(result, schema))
+
+    items: Dict[str, dict] = {}
+    if not isinstance(result, dict):
+        return items
+    if schema.container == "keyed":
+        pairs = result.items()
+    else:
+        pairs = ((None, obj) for obj in result.get(schema.list_key, []) or [])
+    for key, obj in pairs:
+        item_id = _item_id(key, obj, schema)
+        if item_id is not None and schema.is_valid(obj):
+            items[item_id] = obj
+    return items
+
+
+def salvage_items(text: str, schema: ResponseSchema) -> Iterator[Tuple[str, dict]]:
+    """
+    Scans malformed/truncated JSON left to right and yields every complete, valid item.
+    Anything after the point where the text breaks off is simply never yielded.
+    """
+    if not text:
+        return
+    kept = 0
+    if schema.container == "keyed":
+        pos = 0
+        while True:
+            match = _KEYED_OBJECT_RE.search(text, pos)
+            if not match:
+                break
+            start = match.end() - 1
+            try:
+                obj, end = _decoder.raw_decode(text, start)
+            except json.JSONDecodeError:
+                pos = match.end()
+                continue
+            key = json.loads(f'"{match.group(1)}"')
+            item_id = _item_id(key, obj, schema)
+            if item_id is not None and schema.is_valid(obj):
+                kept += 1
+                yield item_id, obj
+                pos = end
+            else:
+                # Not an item (e.g. the outer wrapper) - look inside it
+                pos = match.end()
+    else:
+        anchor = re.search(rf'"{re.escape(schema.list_key)}"\s*:\s*\[', text) if schema.list_key else None
+        pos = anchor.end() if anchor else 0
+        while True:
+            start = text.find("{", pos)
+            if start < 0:
+                break
+            try:
+                obj, end = _decoder.raw_decode(text, start)
+            except json.JSONDecodeError:
+                pos = start + 1
+                continue
+            item_id = _item_id(None, obj, schema)
+            if item_id is not None and schema.is_valid(obj):
+                kept += 1
+                yield item_id, obj
+            pos = end
+    logging.info(f"Salvaged {kept} well-formed items from an unparseable AI response.")
+
+
+def _item_id(key: Optional[str], obj: Any, schema: ResponseSchema) -> Optional[str]:
+    if schema.container == "keyed":
+        return schema.normalize_id(key) if key is not None else None
+    if not isinstance(obj, dict) or schema.id_field not in obj:
+        return None
+    return schema.normalize_id(obj[schema.id_field])
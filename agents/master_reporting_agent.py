@@ -4,11 +4,52 @@ import json
 import logging
 import numpy as np
 import re
+from concurrent.futures import as_completed
+from typing import Callable, Optional
+
+from .llm_batching import estimate_tokens
+from .llm_client import context_executor
+
+# Values that count as "not populated" when computing coverage
+_BLANK_VALUES = ['nan', 'none', 'null', 'undefined']
+
+# Columns that identify a row in every attribute's data sample
+ID_COLUMNS = ["MSID", "CONSUMER_FACING_ITEM_NAME"]
+
+# --- FIX: Added new attributes to the assessment list ---
+# "context_cols" are extra columns the model needs to judge the attribute
+ATTRIBUTES_TO_ASSESS = [
+    {"name": "msid", "data_col": "MSID", "issue_col": "MSIDIssues?"},
+    {"name": "upc", "data_col": "UPC", "issue_col": "UPCIssues?"},
+    {"name": "brand", "data_col": "BRAND_NAME", "issue_col": "BrandIssues?"},
+    {"name": "consumer_facing_item_name", "data_col": "CONSUMER_FACING_ITEM_NAME", "issue_col": "Item Name Rule Issues"},
+    {"name": "photo_url", "data_col": "IMAGE_URL", "issue_col": "ImageIssues?"},
+    {"name": "size", "data_col": "SIZE", "issue_col": "SizeIssues?", "context_cols": ["UNIT_OF_MEASUREMENT"]},
+    {"name": "unit_of_measure", "data_col": "UNIT_OF_MEASUREMENT", "issue_col": "UNIT_OF_MEASUREMENTIssues?", "context_cols": ["SIZE"]},
+    {"name": "Taxonomy Path", "data_col": "Taxonomy Path", "issue_col": "CategoryIssues?"},
+    {"name": "product_group", "data_col": "PRODUCT_GROUP", "issue_col": "ProductGroupIssues?"},
+    {"name": "variant", "data_col": "VARIANT", "issue_col": "VariantIssues?", "context_cols": ["PRODUCT_GROUP"]},
+    {"name": "short_description", "data_col": "DESCRIPTION", "issue_col": "DescriptionIssues?"},
+    {"name": "is_weighted_item", "data_col": "IS_WEIGHTED_ITEM", "issue_col": "WeightedItemIssues?", "context_cols": ["UNIT_OF_MEASUREMENT"]},
+    {"name": "average_weight_per_each", "data_col": "AVERAGE_WEIGHT_PER_EACH", "issue_col": "AverageWeightIssues?", "context_cols": ["IS_WEIGHTED_ITEM"]},
+    {"name": "plu", "data_col": "PLU", "issue_col": "PLUIssues?", "context_cols": ["IS_WEIGHTED_ITEM"]},
+    {"name": "snap_eligible", "data_col": "SNAP_ELIGIBLE", "issue_col": "SNAPEligibilityIssues?"},
+    {"name": "restricted_item_check", "data_col": "CONSUMER_FACING_ITEM_NAME", "issue_col": None},
+    {"name": "additional_image_urls", "data_col": "ADDITIONAL_IMAGE_URLS", "issue_col": "AuxPhotoIssues?"},
+]
 
 class Agent(BaseAgent):
     def __init__(self):
         super().__init__("Master Reporting")
         self.model = "gpt-5-chat-latest"
+        # Attribute prompts run in parallel; llm_client still caps requests process-wide
+        self.max_concurrent_calls = 6
+        # Data samples: only the attribute's own columns, truncated, with rows from a seeded pool
+        # added until the token budget is used; sample_size only caps the pool
+        self.sample_size = 1000
+        self.sample_token_budget = 1500
+        self.max_cell_chars = 80
+        self.random_state = 42
 
     # ---------- Unicode + JSON cleanup helpers ----------
     def _unescape_unicode(self, s: str) -> str:
@@ -79,7 +120,14 @@ class Agent(BaseAgent):
         Provides detailed, attribute-specific instructions for the AI to improve assessment accuracy.
         This acts as a dynamic rulebook for the LLM.
         """
-        instructions = {
+        instructions = self._attribute_instructions(vertical)
+        # Default instruction if no specific rule is found
+        default_instruction = "Assess this attribute for overall completeness, consistency, and accuracy based on the provided data sample."
+        return instructions.get(attr_name, default_instruction)
+
+    def _attribute_instructions(self, vertical: str) -> dict:
+        """The attribute rulebook for a vertical."""
+        return {
             "brand": "Focus on consistency and accuracy. Is the brand name correctly populated, or is it mixed into the item name? A 'Perfect' score requires high coverage and consistent brand names. Downgrade if brands are missing where implied by the item name (e.g., 'Tostitos Chips' with an empty BRAND_NAME field).",
             "consumer_facing_item_name": "Assess for customer readability and completeness. Are names clear, or full of internal codes or repeated information (like brand/size)? 'Modifier' items needing customer choices (e.g., 'Build Your Own Pizza') are critical issues. 'Perfect' means names are clean, descriptive, and unique.",
             "size": "Evaluate standardization. Are sizes consistent (e.g., '12 fl oz' vs. '12oz')? Look for text like 'varies' which indicates a problem. High coverage of standardized values is 'Perfect'.",
@@ -98,99 +146,24 @@ class Agent(BaseAgent):
             "plu": f"For the '{vertical}' vertical (especially CnG), assess if PLU codes are present for relevant items (like produce). Check for valid formatting (typically 4-5 digits). 'Perfect' requires high coverage on relevant items.",
             "snap_eligible": "Assess this boolean flag for correctness. It should be 'True' for eligible grocery items. 'Perfect' means correct assignment for all items in the sample."
         }
-        # Default instruction if no specific rule is found
-        default_instruction = "Assess this attribute for overall completeness, consistency, and accuracy based on the provided data sample."
-        return instructions.get(attr_name, default_instruction)
-
-    def assess(self, df: pd.DataFrame, vertical: str = "Unknown", api_key: str = None) -> dict:
-        logging.info("Running Master Reporting Agent with optimized prompt...")
-        if not api_key:
-            logging.warning("OpenAI API key not provided. Skipping report generation.")
-            return {"error": "API Key not provided."}
-
-        full_report = {}
-        total_skus = len(df)
-        full_report['vertical'] = vertical
-        full_report['total_skus'] = int(total_skus)
-
-        # --- FIX: Added new attributes to the assessment list ---
-        attributes_to_assess = [
-            {"name": "msid", "data_col": "MSID", "issue_col": "MSIDIssues?"},
-            {"name": "upc", "data_col": "UPC", "issue_col": "UPCIssues?"},
-            {"name": "brand", "data_col": "BRAND_NAME", "issue_col": "BrandIssues?"},
-            {"name": "consumer_facing_item_name", "data_col": "CONSUMER_FACING_ITEM_NAME", "issue_col": "Item Name Rule Issues"},
-            {"name": "photo_url", "data_col": "IMAGE_URL", "issue_col": "ImageIssues?"},
-            {"name": "size", "data_col": "SIZE", "issue_col": "SizeIssues?"},
-            {"name": "unit_of_measure", "data_col": "UNIT_OF_MEASUREMENT", "issue_col": "UNIT_OF_MEASUREMENTIssues?"},
-            {"name": "Taxonomy Path", "data_col": "Taxonomy Path", "issue_col": "CategoryIssues?"},
-            {"name": "product_group", "data_col": "PRODUCT_GROUP", "issue_col": "ProductGroupIssues?"},
-            {"name": "variant", "data_col": "VARIANT", "issue_col": "VariantIssues?"},
-            {"name": "short_description", "data_col": "DESCRIPTION", "issue_col": "DescriptionIssues?"},
-            {"name": "is_weighted_item", "data_col": "IS_WEIGHTED_ITEM", "issue_col": "WeightedItemIssues?"},
-            {"name": "average_weight_per_each", "data_col": "AVERAGE_WEIGHT_PER_EACH", "issue_col": "AverageWeightIssues?"},
-            {"name": "plu", "data_col": "PLU", "issue_col": "PLUIssues?"},
-            {"name": "snap_eligible", "data_col": "SNAP_ELIGIBLE", "issue_col": "SNAPEligibilityIssues?"},
-            {"name": "restricted_item_check", "data_col": "CONSUMER_FACING_ITEM_NAME", "issue_col": None},
-            {"name": "additional_image_urls", "data_col": "ADDITIONAL_IMAGE_URLS", "issue_col": "AuxPhotoIssues?"},
-        ]
-
-        for attr in attributes_to_assess:
-            # Check if the data column exists before proceeding
-            if attr['data_col'] not in df.columns:
-                logging.warning(f"Skipping attribute '{attr['name']}' because data column '{attr['data_col']}' was not found.")
-                continue
 
-            logging.info(f"Generating report for attribute: {attr['name']}...")
-
-            data_col = attr['data_col']
-            issue_col = attr['issue_col']
-
-            # Coverage
-            coverage_count = 0
-            if data_col in df.columns:
-                s = df[data_col].copy().astype(str).str.strip()
-                s_lower = s.str.lower()
-                s[s_lower.isin(['nan', 'none', 'null', 'undefined'])] = np.nan
-                coverage_count = s.notna().sum()
-
-            # Duplicates
-            duplicate_count = 0
-            if data_col in df.columns and attr['name'] not in ['brand', 'photo_url']:
-                subset_col = 'Taxonomy Path' if attr['name'] == 'Taxonomy Path' else data_col
-                if subset_col in df.columns:
-                    duplicate_count = df[df.duplicated(subset=[subset_col], keep='first')].shape[0]
-
-            unique_category_count = (
-                df['Taxonomy Path'].nunique()
-                if attr['name'] == 'Taxonomy Path' and 'Taxonomy Path' in df.columns
-                else "N/A"
-            )
-
-            # Issue sample
-            issues_sample = []
-            if issue_col and issue_col in df.columns:
-                issue_rows = df[df[issue_col].astype(str).str.strip().ne('')]
-                raw_sample = issue_rows[issue_col].head(5).tolist()
-                issues_sample = [self._clean_field(s) for s in raw_sample]
-            issues_sample_json = json.dumps(issues_sample, indent=2, ensure_ascii=False)
-
-            # Data sample
-            sample_size = 50
-            sample_n = min(sample_size, len(df))
-            data_sample_str = df.sample(n=sample_n).to_string() if sample_n > 0 else "No data to sample."
-            data_sample_str = self._clean_field(data_sample_str)
-
-            specific_instructions = self._get_attribute_specific_instructions(attr['name'], vertical)
-
-            prompt = f"""
-            You are an expert data quality consultant with a deep understanding of e-commerce standards. Your task is to provide a precise and actionable assessment for the '{attr['name']}' attribute.
+    def _build_system_prompt(self, vertical: str) -> str:
+        """
+        Role, analysis steps, rubric, full rulebook and output schema. Identical for every attribute
+        in a run, so it leads each request and the provider's prefix cache can serve it.
+        """
+        rulebook = "\n".join(
+            f"            - **{name}**: {text}" for name, text in self._attribute_instructions(vertical).items()
+        )
+        return f"""
+            You are an expert data quality consultant with a deep understanding of e-commerce standards. Your task is to provide a precise and actionable assessment for the attribute named in the user message.
 
             **Your Goal:** Evaluate the data based on the provided metrics and data sample to determine its quality and readiness for an e-commerce platform.
 
             **Step-by-Step Analysis Guide (Think through these steps before giving your JSON response):**
             1.  **Quantitative Review:** Look at the `coverage` and `duplicates` count. Is the coverage high? This sets the baseline. Low coverage is a major red flag.
             2.  **Qualitative Review:** Examine the `Qualitative Data Sample`. Does the data *look* correct and consistent? Compare this with the `Pre-flagged Issues Sample`.
-            3.  **Apply Specific Instructions:** Use the rules below to guide your judgment for this specific attribute.
+            3.  **Apply Specific Instructions:** Use the attribute's guidance to steer your judgment.
             4.  **Synthesize and Score:** Combine your findings to assign an `assessment_score` based on the rubric below.
             5.  **Summarize:** Write your `commentary` and `improvements_needed` based on your analysis. Be specific and actionable.
 
@@ -199,7 +172,95 @@ class Agent(BaseAgent):
             - **"Has Some Issues/Nuances to Accommodate"**: The attribute is mostly populated but has correctable problems like inconsistent formatting, moderate coverage (80-98%), or some inaccuracies. The data is usable but requires cleanup.
             - **"Missing or Unusable"**: Coverage is low (<80%), the attribute is mostly empty, or the data shows critical errors, placeholder text, or is fundamentally incorrect. The data requires significant intervention.
 
+            **Attribute Rulebook ('{vertical}' vertical):**
+{rulebook}
+
             ---
+            **Return ONLY this JSON object:**
+            {{
+            "assessment_score": "...",
+            "commentary": "...",
+            "improvements_needed": "...",
+            "bad_data_examples": "...",        // may be a list OR a stringified JSON list
+            "corrected_data_examples": "..."
+            }}
+            """
+
+    def _compute_attribute_metrics(self, df: pd.DataFrame, attributes: list) -> dict:
+        """
+        Coverage, duplicate and issue-sample metrics for every attribute, computed once per column.
+        Attributes sharing a data column (e.g. item name / restricted check) reuse the same numbers.
+        """
+        data_cols = list(dict.fromkeys(a['data_col'] for a in attributes))
+        issue_cols = list(dict.fromkeys(a['issue_col'] for a in attributes if a['issue_col'] in df.columns))
+
+        # Coverage: one vectorised blank-mask over all data columns
+        data = df[data_cols]
+        lowered = data.apply(lambda s: s.astype(str).str.strip().str.lower())
+        blank = data.isna() | lowered.isin(_BLANK_VALUES)
+        coverage = (~blank).sum()
+
+        duplicates = {col: int(df[col].duplicated().sum()) for col in data_cols}
+
+        issue_samples = {}
+        for col in issue_cols:
+            has_issue = df[col].astype(str).str.strip().ne('').to_numpy()
+            first_rows = np.flatnonzero(has_issue)[:5]
+            issue_samples[col] = [self._clean_field(v) for v in df[col].iloc[first_rows].tolist()]
+
+        metrics = {}
+        for attr in attributes:
+            col = attr['data_col']
+            metrics[attr['name']] = {
+                "coverage_count": int(coverage[col]),
+                "duplicate_count": 0 if attr['name'] in ['brand', 'photo_url'] else duplicates[col],
+                "issues_sample": issue_samples.get(attr['issue_col'], []),
+            }
+        if 'Taxonomy Path' in metrics:
+            metrics['Taxonomy Path']['unique_category_count'] = df['Taxonomy Path'].nunique()
+        return metrics
+
+    def _build_data_sample(self, df: pd.DataFrame, row_index: pd.Index, attr: dict) -> tuple:
+        """
+        Renders the qualitative sample for one attribute: ID columns, context columns, the data
+        column and its issue column only, long cells truncated. Rows of `row_index` are added in
+        order until the token budget is used. Returns (sample text, number of rows included).
+        """
+        wanted = ID_COLUMNS + attr.get('context_cols', []) + [attr['data_col'], attr['issue_col']]
+        cols = [c for c in dict.fromkeys(wanted) if c and c in df.columns]
+        if row_index.empty or not cols:
+            return "No data to sample.", 0
+
+        sample = df.loc[row_index, cols].fillna("").astype(str)
+        limit = self.max_cell_chars
+        for col in cols:
+            # One line per row: the budget loop below splits the CSV at line breaks
+            cells = sample[col].str.replace(r"\s*[\r\n]+\s*", " ", regex=True).str.strip()
+            sample[col] = cells.where(cells.str.len() <= limit, cells.str[:limit - 1] + "…")
+
+        # CSV avoids to_string()'s column padding; keep rows until the budget is spent
+        lines = sample.to_csv(index=False).splitlines()
+        kept, used = [lines[0]], estimate_tokens(lines[0], self.model)
+        for line in lines[1:]:
+            cost = estimate_tokens(line, self.model)
+            if len(kept) > 1 and used + cost > self.sample_token_budget:
+                break
+            kept.append(line)
+            used += cost
+        return self._clean_field("\n".join(kept)), len(kept) - 1
+
+    def _assess_attribute(self, attr: dict, metrics: dict, total_skus: int, data_sample_str: str,
+                          sample_n: int, vertical: str, api_key: str, system_prompt: str) -> dict:
+        """Builds the prompt for one attribute, calls the AI and shapes its report entry."""
+        coverage_count = metrics['coverage_count']
+        duplicate_count = metrics['duplicate_count']
+        issues_sample_json = json.dumps(metrics['issues_sample'], indent=2, ensure_ascii=False)
+        specific_instructions = self._get_attribute_specific_instructions(attr['name'], vertical)
+
+        # Only the per-attribute data goes in the user message; the rubric lives in the system prompt
+        prompt = f"""
+            **Attribute to assess:** '{attr['name']}'
+
             **1) Quantitative Metrics**
             - Total SKUs: {total_skus}
             - Coverage: {coverage_count} / {total_skus}
@@ -212,44 +273,105 @@ class Agent(BaseAgent):
 
             **3) Attribute-Specific Guidance**
             - {specific_instructions}
-
-            ---
-            **Return ONLY this JSON object:**
-            {{
-            "assessment_score": "...",
-            "commentary": "...",
-            "improvements_needed": "...",
-            "bad_data_examples": "...",        // may be a list OR a stringified JSON list
-            "corrected_data_examples": "..."
-            }}
             """
 
-            ai_response = self.call_ai(prompt, api_key, self.model)
-            if "error" in ai_response:
-                full_report[attr['name']] = {"error": ai_response["error"]}
-                continue
+        ai_response = self.call_ai(prompt, api_key, self.model, system=system_prompt)
+        if ai_response.get("budget_exhausted"):
+            return self._metrics_only_report(attr, metrics, total_skus)
+        if "error" in ai_response:
+            return {"error": ai_response["error"]}
+
+        # Clean/normalize all AI fields
+        cleaned = {k: self._clean_field(v) for k, v in ai_response.items()}
+
+        # Special handling: examples may be list OR stringified JSON
+        bad_ex = self._coerce_examples_to_text(cleaned.get("bad_data_examples", ""))
+        corr_ex = self._coerce_examples_to_text(cleaned.get("corrected_data_examples", ""))
+
+        coverage_pct = (coverage_count / total_skus * 100) if total_skus > 0 else 0.0
+        report_for_attr = {
+            "coverage": f"{coverage_count} / {total_skus} ({coverage_pct:.2f}%)",
+            "duplicates": duplicate_count,
+            "assessment": cleaned.get("assessment_score", "N/A"),
+            "commentary": cleaned.get("commentary", "N/A"),
+            "improvements": cleaned.get("improvements_needed", "N/A"),
+            "bad_examples": bad_ex,
+            "corrected_examples": corr_ex,
+        }
+        if attr['name'] == 'Taxonomy Path':
+            report_for_attr['unique_categories'] = metrics.get('unique_category_count', "N/A")
+        return report_for_attr
+
+    def _metrics_only_report(self, attr: dict, metrics: dict, total_skus: int) -> dict:
+        """Deterministic entry used when the run budget leaves no room for the AI review."""
+        coverage_count = metrics['coverage_count']
+        coverage_pct = (coverage_count / total_skus * 100) if total_skus > 0 else 0.0
+        self._note_budget_fallback(1, "metrics-only attribute reports")
+        report_for_attr = {
+            "coverage": f"{coverage_count} / {total_skus} ({coverage_pct:.2f}%)",
+            "duplicates": metrics['duplicate_count'],
+            "assessment": "N/A",
+            "commentary": "AI review skipped (run budget exhausted); coverage and duplicate metrics only.",
+            "improvements": "N/A",
+            "bad_examples": "",
+            "corrected_examples": "",
+            "budget_fallback": True,
+        }
+        if attr['name'] == 'Taxonomy Path':
+            report_for_attr['unique_categories'] = metrics.get('unique_category_count', "N/A")
+        return report_for_attr
 
-            # Clean/normalize all AI fields
-            cleaned = {k: self._clean_field(v) for k, v in ai_response.items()}
-
-            # Special handling: examples may be list OR stringified JSON
-            bad_ex = self._coerce_examples_to_text(cleaned.get("bad_data_examples", ""))
-            corr_ex = self._coerce_examples_to_text(cleaned.get("corrected_data_examples", ""))
-
-            coverage_pct = (coverage_count / total_skus * 100) if total_skus > 0 else 0.0
-            report_for_attr = {
-                "coverage": f"{coverage_count} / {total_skus} ({coverage_pct:.2f}%)",
-                "duplicates": duplicate_count,
-                "assessment": cleaned.get("assessment_score", "N/A"),
-                "commentary": cleaned.get("commentary", "N/A"),
-                "improvements": cleaned.get("improvements_needed", "N/A"),
-                "bad_examples": bad_ex,
-                "corrected_examples": corr_ex,
-            }
-            if attr['name'] == 'Taxonomy Path':
-                report_for_attr['unique_categories'] = unique_category_count
+    def assess(self, df: pd.DataFrame, vertical: str = "Unknown", api_key: str = None,
+               progress_callback: Optional[Callable[[int, int, str], None]] = None) -> dict:
+        logging.info("Running Master Reporting Agent with optimized prompt...")
+        if not api_key:
+            logging.warning("OpenAI API key not provided. Skipping report generation.")
+            return {"error": "API Key not provided."}
 
-            full_report[attr['name']] = report_for_attr
+        full_report = {}
+        total_skus = len(df)
+        full_report['vertical'] = vertical
+        full_report['total_skus'] = int(total_skus)
+
+        attributes = []
+        for attr in ATTRIBUTES_TO_ASSESS:
+            # Check if the data column exists before proceeding
+            if attr['data_col'] not in df.columns:
+                logging.warning(f"Skipping attribute '{attr['name']}' because data column '{attr['data_col']}' was not found.")
+                continue
+            attributes.append(attr)
+
+        # --- Single pass: metrics for all attributes, then one seeded row pool each attribute's sample fills from ---
+        metrics = self._compute_attribute_metrics(df, attributes)
+        # Narrow attributes fit many more rows in the token budget than wide ones, so the pool is
+        # larger than any one sample; each attribute takes rows from it until its budget is used
+        sample_rows = df.sample(n=min(self.sample_size, len(df)), random_state=self.random_state).index
+        samples = {attr['name']: self._build_data_sample(df, sample_rows, attr) for attr in attributes}
+        system_prompt = self._build_system_prompt(vertical)
+
+        # --- Concurrent AI calls; the shared limiter in llm_client caps in-flight requests ---
+        with context_executor(self.max_concurrent_calls) as executor:
+            futures = {
+                executor.submit(
+                    self._assess_attribute, attr, metrics[attr['name']], total_skus,
+                    *samples[attr['name']], vertical, api_key, system_prompt,
+                ): attr['name']
+                for attr in attributes
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                name = futures[future]
+                try:
+                    full_report[name] = future.result()
+                except Exception as e:
+                    logging.error(f"Report generation failed for attribute '{name}': {e}", exc_info=True)
+                    full_report[name] = {"error": str(e)}
+                logging.info(f"Report for attribute '{name}' ready ({done}/{len(futures)}).")
+                if progress_callback:
+                    progress_callback(done, len(futures), name)
+
+        # Keep the report in the canonical attribute order regardless of completion order
+        ordered = ['vertical', 'total_skus'] + [a['name'] for a in attributes]
+        full_report = {key: full_report[key] for key in ordered}
 
         logging.info("Master Reporting Agent finished. Final report structure:")
         logging.info(json.dumps(full_report, indent=2, ensure_ascii=False))
@@ -0,0 +1,118 @@
+import re
+import logging
+from typing import Optional
+
+import pandas as pd
+
+# Placeholders used inside a name template
+BRAND_TOKEN = "{BRAND}"
+SIZE_TOKEN = "{SIZE}"
+NUMBER_TOKEN = "#"
+
+# Size + unit pairs such as "12 oz", "1.5L", "2 x 330 ml" or "6 pk"
+_UNITS = (
+    r"fl\.?\s?oz|oz|ounces?|lbs?|pounds?|kg|g|grams?|mg|ml|cl|l|liters?|litres?|gal|gallons?|"
+    r"qt|pt|ct|count|pk|packs?|pc|pcs|pieces?|ea|each|in|cm|mm|ft|sq\s?ft"
+)
+SIZE_RE = re.compile(
+    rf"(?<![\w.])\d+(?:[.,]\d+)?(?:\s?[x×]\s?\d+(?:[.,]\d+)?)?\s?(?:{_UNITS})\.?(?![\w])",
+    re.IGNORECASE,
+)
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+_TOKEN_RE = re.compile(r"\{BRAND\}|\{SIZE\}|#|[^\W\d_]+(?:['’][^\W\d_]+)?|[^\w\s]")
+
+
+def _word_shape(word: str) -> str:
+    """Collapses a word into its casing class: 'Aa' (title), 'AA' (upper) or 'aa' (lower)."""
+    if word.isupper() and len(word) > 1:
+        return "AA"
+    if word[:1].isupper():
+        return "Aa"
+    return "aa"
+
+
+def name_template(name: str, brand: Optional[str] = None) -> str:
+    """
+    Reduces an item name to the merchant pattern it follows.
+
+    The brand token is masked, size/UoM pairs and bare numbers are replaced with
+    placeholders and every remaining word is reduced to its casing class; runs of
+    same-cased words keep their length, so "Coca-Cola Classic Soda (12 oz)" and
+    "Pepsi Cherry Soda (20 oz)" (with their brands) both become "{BRAND} Aa*2 ( {SIZE} )"
+    while "Pepsi Wild Cherry Soda (20 oz)" becomes "{BRAND} Aa*3 ( {SIZE} )".
+    """
+    if not isinstance(name, str) or not name.strip():
+        return ""
+    text = name.strip()
+
+    if isinstance(brand, str) and brand.strip() and brand.strip().lower() not in ("nan", "none"):
+        text = re.sub(r"(?<!\w)" + re.escape(brand.strip()) + r"(?!\w)", BRAND_TOKEN, text, flags=re.IGNORECASE)
+
+    text = SIZE_RE.sub(f" {SIZE_TOKEN} ", text)
+    text = _NUMBER_RE.sub(f" {NUMBER_TOKEN} ", text)
+
+    # [token, run length]: runs of same-cased words collapse into one "shape*count" slot, so
+    # only names with the same number of words in each run share a template
+    parts = []
+    for tok in _TOKEN_RE.findall(text):
+        if tok in (BRAND_TOKEN, SIZE_TOKEN, NUMBER_TOKEN) or not tok[:1].isalpha():
+            parts.append([tok, 0])
+            continue
+        shape = _word_shape(tok)
+        if parts and parts[-1][1] and parts[-1][0] == shape:
+            parts[-1][1] += 1
+        else:
+            parts.append([shape, 1])
+    return " ".join(tok if count <= 1 else f"{tok}*{count}" for tok, count in parts)
+
+
+def build_name_templates(names: pd.Series, brands: Optional[pd.Series] = None) -> pd.Series:
+    """Vectorised wrapper around name_template() aligned to the names index."""
+    if brands is None:
+        brands = pd.Series("", index=names.index)
+    return pd.Series(
+        [name_template(n, b) for n, b in zip(names.tolist(), brands.reindex(names.index).tolist())],
+        index=names.index,
+        dtype=object,
+    )
+
+
+def assign_name_clusters(templates: pd.Series, categories: Optional[pd.Series] = None) -> pd.Series:
+    """
+    Groups rows by (template, category) and returns an integer cluster id per row.
+    Rows with an empty template get -1 so they never join a cluster.
+    """
+    if categories is None:
+        categories = pd.Series("", index=templates.index)
+    cats = categories.reindex(templates.index).fillna("").astype(str).str.strip().str.lower()
+    keys = pd.DataFrame({"template": templates.fillna(""), "category": cats})
+    ids = keys.groupby(["template", "category"], sort=False).ngroup()
+    ids[keys["template"].eq("")] = -1
+    logging.info(f"Name clustering: {len(templates)} rows -> {ids[ids >= 0].nunique()} template clusters.")
+    return ids
+
+
+def pick_cluster_representatives(
+    df: pd.DataFrame,
+    cluster_col: str,
+    per_cluster: int = 2,
+    max_clusters: Optional[int] = None,
+    random_state: int = 42,
+) -> pd.DataFrame:
+    """
+    Returns up to `per_cluster` rows from each cluster, largest clusters first.
+    Sampling is seeded so the same file always yields the same representatives.
+    """
+    clustered = df[df[cluster_col] >= 0]
+    if clustered.empty:
+        return clustered
+
+    sizes = clustered[cluster_col].value_counts()
+    if max_clusters:
+        sizes = sizes.head(max_clusters)
+    keep = clustered[clustered[cluster_col].isin(sizes.index)]
+
+    shuffled = keep.sample(frac=1.0, random_state=random_state)
+    reps = shuffled.groupby(cluster_col, sort=False).head(per_cluster)
+    order = {cid: rank for rank, cid in enumerate(sizes.index)}
+    return reps.loc[reps[cluster_col].map(order).sort_values(kind="stable").index]
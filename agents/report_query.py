@@ -0,0 +1,153 @@
+import json
+import logging
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from .issue_index import IssueIndex, issue_columns
+
+MAX_FILTERS = 8
+MAX_GROUP_BY = 2
+MAX_GROUPS = 50
+TEXT_OPS = {"eq", "ne", "contains", "not_contains", "in", "is_blank", "not_blank"}
+NUMERIC_OPS = {"gt", "gte", "lt", "lte"}
+ISSUE_OPS = {"has_issue", "no_issue"}
+
+# OpenAI tool definition for the chat model; run_query executes the calls locally
+QUERY_TOOL: Dict[str, Any] = {
+    "type": "function",
+    "function": {
+        "name": "query_assessment",
+        "description": (
+            "Exact counts over the full assessed catalog. Filter rows, then count them overall, per group, "
+            "and/or per issue column. Use this for any question about how many SKUs, totals, rates or breakdowns."
+        ),
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "filters": {
+                    "type": "array",
+                    "description": "All filters must match (AND).",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "column": {"type": "string", "description": "A data column, an issue column (e.g. 'UPCIssues?'), or an attribute name with has_issue/no_issue (e.g. 'UPC', 'Image')."},
+                            "op": {"type": "string", "enum": sorted(TEXT_OPS | NUMERIC_OPS | ISSUE_OPS)},
+                            "value": {"description": "Text or number; a list for 'in'. Text matching ignores case."},
+                        },
+                        "required": ["column", "op"],
+                    },
+                },
+                "group_by": {"type": "array", "items": {"type": "string"}, "description": "Up to 2 columns to count by."},
+                "issue_breakdown": {"type": "boolean", "description": "Also count flagged (❌) rows per issue column."},
+                "limit": {"type": "integer", "description": "Most groups to return (default 20, max 50)."},
+            },
+        },
+    },
+}
+
+
+class QueryError(ValueError):
+    """A query the tool refuses (unknown column, unsupported operator, ...); its message goes back to the model."""
+
+
+def _resolve_issue_column(name: str, columns: List[str]) -> str:
+    wanted = name.lower().replace(' ', '').replace('_', '')
+    for col in issue_columns(columns):
+        key = col.lower().replace(' ', '').replace('_', '')
+        if key == wanted or key in (f"{wanted}issues?", f"{wanted}ruleissues"):
+            return col
+    raise QueryError(f"No issue column for '{name}'. Issue columns: {', '.join(issue_columns(columns))}")
+
+
+def _text_mask(s: pd.Series, op: str, value: Any) -> np.ndarray:
+    # Evaluated once per distinct value, then spread to the rows
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    text = pd.Series(np.asarray(uniques, dtype=object)).astype(str).str.strip().str.lower()
+    blank = np.append((text == '').to_numpy(), True)  # last slot: missing values (code -1)
+    if op == "is_blank":
+        return blank[codes]
+    if op == "not_blank":
+        return ~blank[codes]
+    if op == "in":
+        if not isinstance(value, list):
+            raise QueryError("'in' needs a list value.")
+        hit = text.isin([str(v).strip().lower() for v in value]).to_numpy()
+    elif op in ("contains", "not_contains"):
+        hit = text.str.contains(str(value).strip().lower(), regex=False).to_numpy()
+    else:
+        hit = (text == str(value).strip().lower()).to_numpy()
+    hit = np.append(hit, False)[codes]
+    return ~hit if op in ("ne", "not_contains") else hit
+
+
+def _numeric_mask(s: pd.Series, op: str, value: Any) -> np.ndarray:
+    try:
+        threshold = float(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"'{op}' needs a number, got {value!r}.")
+    numbers = pd.to_numeric(s, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    with np.errstate(invalid='ignore'):
+        return {"gt": numbers > threshold, "gte": numbers >= threshold,
+                "lt": numbers < threshold, "lte": numbers <= threshold}[op]
+
+
+def run_query(df: pd.DataFrame, issue_index: IssueIndex, spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs one query_assessment call against the assessed frame and returns compact counts.
+
+    Only whitelisted operators on existing columns are accepted; nothing from the model is
+    evaluated as code. Issue filters use the precomputed issue index.
+    """
+    columns = list(df.columns)
+    filters = spec.get("filters") or []
+    group_by = spec.get("group_by") or []
+    if not isinstance(filters, list) or not isinstance(group_by, list):
+        raise QueryError("filters and group_by must be lists.")
+    if len(filters) > MAX_FILTERS:
+        raise QueryError(f"At most {MAX_FILTERS} filters.")
+    if len(group_by) > MAX_GROUP_BY:
+        raise QueryError(f"At most {MAX_GROUP_BY} group_by columns.")
+    for col in group_by:
+        if col not in columns:
+            raise QueryError(f"Unknown column '{col}'.")
+
+    mask = np.ones(len(df), dtype=bool)
+    for f in filters:
+        col, op, value = f.get("column", ""), f.get("op", ""), f.get("value")
+        if op in ISSUE_OPS:
+            issue_col = col if col in issue_index.flagged else _resolve_issue_column(col, columns)
+            flagged = np.zeros(len(df), dtype=bool)
+            flagged[issue_index.flagged[issue_col]] = True
+            mask &= flagged if op == "has_issue" else ~flagged
+        elif op in TEXT_OPS | NUMERIC_OPS:
+            if col not in columns:
+                raise QueryError(f"Unknown column '{col}'.")
+            mask &= _text_mask(df[col], op, value) if op in TEXT_OPS else _numeric_mask(df[col], op, value)
+        else:
+            raise QueryError(f"Unsupported op '{op}'.")
+
+    result: Dict[str, Any] = {"total_rows": len(df), "matched_rows": int(mask.sum())}
+    if group_by:
+        limit = max(1, min(int(spec.get("limit") or 20), MAX_GROUPS))
+        keys = df.loc[mask, group_by].astype(object)
+        keys = keys.where(keys.notna() & (keys.astype(str).apply(lambda c: c.str.strip()) != ''), '(blank)')
+        counts = keys.value_counts().head(limit)
+        result["groups"] = [dict(zip(group_by, k if isinstance(k, tuple) else (k,)), count=int(c))
+                            for k, c in counts.items()]
+        result["distinct_groups"] = int(keys.drop_duplicates().shape[0])
+    if spec.get("issue_breakdown"):
+        result["issues"] = {col: int(np.count_nonzero(mask[rows])) for col, rows in issue_index.flagged.items()
+                            if np.count_nonzero(mask[rows])}
+    return result
+
+
+def run_tool_call(df: pd.DataFrame, issue_index: IssueIndex, arguments: str) -> str:
+    """JSON result of one tool call; refusals and bad arguments come back as {'error': ...}."""
+    try:
+        spec = json.loads(arguments or "{}")
+        return json.dumps(run_query(df, issue_index, spec))
+    except (ValueError, TypeError, AttributeError) as e:  # QueryError and JSONDecodeError are ValueErrors
+        logging.info(f"Chat query refused: {e}")
+        return json.dumps({"error": str(e)})
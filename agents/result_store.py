@@ -0,0 +1,178 @@
+import os
+import time
+import uuid
+import shutil
+import logging
+import weakref
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import pandas as pd
+
+from .display_render import render_frame
+
+# Where spilled frames and rendered exports live (one sub-folder per stored run)
+DEFAULT_SPILL_DIR = os.getenv("RESULT_SPILL_DIR", os.path.join(tempfile.gettempdir(), "mx_assessment_results"))
+# Frames larger than this stay on disk instead of in the session
+DEFAULT_MEMORY_CAP_MB = float(os.getenv("SESSION_MEMORY_CAP_MB", "256"))
+# Spilled frames kept loaded at once, shared by every session in the process
+HOT_SPILLED_FRAMES = int(os.getenv("HOT_SPILLED_FRAMES", "2"))
+EXPORT_CHUNK_ROWS = 100_000
+STALE_AFTER_HOURS = 24
+# A run folder's mtime is refreshed at most this often while its session reads from it
+TOUCH_INTERVAL_S = 60
+
+
+class _SpilledFrameCache:
+    """Small LRU of frames read back from disk, so a rerun doesn't re-read a spilled frame."""
+
+    def __init__(self, max_frames: int):
+        self.max_frames = max_frames
+        self._frames: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> pd.DataFrame:
+        with self._lock:
+            if path in self._frames:
+                self._frames.move_to_end(path)
+                return self._frames[path]
+        frame = pd.read_pickle(path)
+        with self._lock:
+            self._frames[path] = frame
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+        return frame
+
+    def drop(self, prefix: str) -> None:
+        with self._lock:
+            for path in [p for p in self._frames if p.startswith(prefix)]:
+                del self._frames[path]
+
+
+_hot_frames = _SpilledFrameCache(HOT_SPILLED_FRAMES)
+# Stores still held by a session in this process; their folders are never purged
+_live_stores: "weakref.WeakSet[ResultStore]" = weakref.WeakSet()
+
+
+class ResultStore:
+    """
+    Holds one run's result frames for a session and produces exports on demand.
+
+    Frames under `memory_cap_mb` stay in memory; larger ones are pickled to the spill
+    folder and read back through a small process-wide cache. Exports are rendered in
+    row chunks straight to a CSV file the first time they are requested, so neither
+    the CSV bytes nor a rendered copy of the frame is kept in the session.
+    """
+
+    def __init__(self, spill_dir: str = DEFAULT_SPILL_DIR, memory_cap_mb: float = DEFAULT_MEMORY_CAP_MB):
+        self.run_dir = os.path.join(spill_dir, f"{int(time.time())}-{uuid.uuid4().hex[:8]}")
+        self.memory_cap_bytes = memory_cap_mb * 1024 * 1024
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self._spilled: Dict[str, str] = {}
+        self._exports: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._touched = 0.0
+        _live_stores.add(self)
+
+    # --- Frames ---
+
+    def put_frame(self, name: str, df: pd.DataFrame) -> None:
+        size = int(df.memory_usage(deep=True).sum())
+        if size <= self.memory_cap_bytes:
+            self._frames[name] = df
+            return
+        os.makedirs(self.run_dir, exist_ok=True)
+        path = os.path.join(self.run_dir, f"{name}.pkl")
+        df.to_pickle(path)
+        self._spilled[name] = path
+        logging.info(f"Spilled '{name}' ({size / 1024 ** 2:.0f} MB) to {path}")
+
+    def attach_frame(self, name: str, path: str) -> None:
+        """A frame already pickled at `path` (e.g. by a background job); clear() leaves the file in place."""
+        if os.path.getsize(path) <= self.memory_cap_bytes:
+            self._frames[name] = pd.read_pickle(path)
+        else:
+            self._spilled[name] = path
+
+    def has(self, name: str) -> bool:
+        return name in self._frames or name in self._spilled
+
+    def frame(self, name: str) -> Optional[pd.DataFrame]:
+        if name in self._frames:
+            return self._frames[name]
+        if name in self._spilled:
+            self._touch()
+            return _hot_frames.get(self._spilled[name])
+        return None
+
+    def is_spilled(self, name: str) -> bool:
+        return name in self._spilled
+
+    # --- Exports ---
+
+    def export_csv(self, name: str, columns: Optional[Sequence[str]] = None,
+                   rows: Optional[Sequence[int]] = None, export_name: Optional[str] = None) -> bytes:
+        """CSV of a stored frame (optionally some columns / row positions), rendered once and reused."""
+        export_name = export_name or name
+        self._touch()
+        with self._lock:
+            path = self._exports.get(export_name)
+            if path is None or not os.path.exists(path):
+                path = self._write_csv(name, columns, rows, export_name)
+                self._exports[export_name] = path
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _write_csv(self, name: str, columns, rows, export_name: str) -> str:
+        df = self.frame(name)
+        if df is None:
+            raise KeyError(f"No stored frame named '{name}'")
+        os.makedirs(self.run_dir, exist_ok=True)
+        path = os.path.join(self.run_dir, f"{export_name}.csv")
+        positions: List[int] = list(rows) if rows is not None else list(range(len(df)))
+        started = time.perf_counter()
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            if not positions:
+                render_frame(df, columns, rows=[]).to_csv(f, index=False)
+            for i in range(0, len(positions), EXPORT_CHUNK_ROWS):
+                chunk = render_frame(df, columns, rows=positions[i:i + EXPORT_CHUNK_ROWS])
+                chunk.to_csv(f, index=False, header=(i == 0))
+        logging.info(f"Export '{export_name}' written in {time.perf_counter() - started:.1f}s to {path}")
+        return path
+
+    # --- Cleanup ---
+
+    def _touch(self) -> None:
+        """Marks the spill folder as in use, so purges by other app processes keep it too."""
+        now = time.time()
+        if now - self._touched < TOUCH_INTERVAL_S:
+            return
+        self._touched = now
+        try:
+            os.utime(self.run_dir)
+        except OSError:
+            pass  # nothing spilled or exported yet
+
+    def clear(self) -> None:
+        """Forgets this run's frames and deletes its spill folder."""
+        _hot_frames.drop(self.run_dir)
+        self._frames.clear()
+        self._spilled.clear()
+        self._exports.clear()
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+
+def purge_stale_results(spill_dir: str = DEFAULT_SPILL_DIR, max_age_hours: float = STALE_AFTER_HOURS) -> None:
+    """
+    Deletes spill folders left behind by sessions that ended more than `max_age_hours` ago.
+    Folders of stores still alive in this process are kept however long they sat unused.
+    """
+    if not os.path.isdir(spill_dir):
+        return
+    cutoff = time.time() - max_age_hours * 3600
+    live = {os.path.abspath(store.run_dir) for store in list(_live_stores)}
+    for entry in os.scandir(spill_dir):
+        if entry.is_dir() and entry.stat().st_mtime < cutoff and os.path.abspath(entry.path) not in live:
+            shutil.rmtree(entry.path, ignore_errors=True)
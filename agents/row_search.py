@@ -0,0 +1,143 @@
+import math
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+import numpy as np
+import pandas as pd
+
+from .issue_index import IssueIndex
+
+# Columns searched for a question's words
+SEARCH_COLUMNS = ['CONSUMER_FACING_ITEM_NAME', 'BRAND_NAME', 'Taxonomy Path',
+                  'L1_CATEGORY', 'L2_CATEGORY', 'L3_CATEGORY', 'MSID', 'UPC']
+# Columns whose distinct values are kept to name them in aggregates
+AGGREGATE_COLUMNS = ['L1_CATEGORY', 'BRAND_NAME']
+MAX_NAMED_VALUES = 10_000
+
+STOPWORDS = {
+    'a', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'does', 'for', 'from', 'have', 'how',
+    'i', 'in', 'is', 'it', 'many', 'me', 'much', 'my', 'of', 'on', 'or', 'our', 'show', 'so', 'that', 'the',
+    'their', 'there', 'these', 'this', 'those', 'to', 'wa', 'were', 'what', 'when', 'where', 'which', 'who',
+    'why', 'with', 'you', 'your', 'sku', 'item', 'items', 'product', 'products', 'row', 'rows',
+}
+_TOKEN_PATTERN = r'[a-z0-9]+'
+_PLURAL_PATTERN = r'(?<=[a-z]{3})s\b'
+
+
+def tokenize(text: str, stopwords: Set[str] = STOPWORDS, unique: bool = True) -> List[str]:
+    tokens = pd.Series([str(text).lower()]).str.replace(_PLURAL_PATTERN, '', regex=True).str.findall(_TOKEN_PATTERN)[0]
+    return [t for t in (dict.fromkeys(tokens) if unique else tokens) if len(t) > 1 and t not in stopwords]
+
+
+@dataclass
+class _ColumnPostings:
+    codes: np.ndarray                      # row -> distinct value code (-1 = blank)
+    counts: np.ndarray                     # rows per code
+    postings: Dict[str, np.ndarray]        # token -> codes of the values containing it
+    values: Optional[List[str]] = None     # the distinct values, for low-cardinality columns
+
+
+@dataclass
+class RowSearchIndex:
+    """
+    Inverted index from words to assessed rows, for picking the rows a chat question is about.
+
+    Postings point at a column's distinct values, not rows, so the index stays small and is
+    built once per distinct value. A query scores each distinct value (IDF of the words it
+    contains), gathers those scores per row and adds the rows of the issue messages and
+    attributes the question names. Work per question is O(rows), with no Python per-row loops.
+    """
+    n_rows: int
+    columns: Dict[str, _ColumnPostings] = field(default_factory=dict)
+    issue_terms: Dict[str, List[np.ndarray]] = field(default_factory=dict)
+    issue_index: Optional[IssueIndex] = None
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, issue_index: IssueIndex,
+              columns: Sequence[str] = SEARCH_COLUMNS) -> "RowSearchIndex":
+        started = time.perf_counter()
+        index = cls(n_rows=len(df), issue_index=issue_index)
+        for col in columns:
+            if col in df.columns:
+                index.columns[col] = cls._index_column(df[col], keep_values=col in AGGREGATE_COLUMNS)
+        # Issue vocabulary: the attribute behind each issue column, and each issue message
+        for col, rows in issue_index.flagged.items():
+            attribute = col.replace('Issues?', '').replace('_', ' ')
+            attribute = ''.join(f' {c}' if c.isupper() and i and attribute[i - 1].islower() else c
+                                for i, c in enumerate(attribute))
+            for token in tokenize(attribute):
+                index.issue_terms.setdefault(token, []).append(rows)
+            for message, message_rows in issue_index.issue_types.get(col, {}).items():
+                for token in tokenize(message):
+                    index.issue_terms.setdefault(token, []).append(message_rows)
+        logging.info(f"Chat row index built for {len(df):,} rows in {time.perf_counter() - started:.2f}s.")
+        return index
+
+    @staticmethod
+    def _index_column(s: pd.Series, keep_values: bool) -> _ColumnPostings:
+        codes, uniques = pd.factorize(s, use_na_sentinel=True)
+        tokens = (pd.Series(np.asarray(uniques, dtype=object)).astype(str).str.lower()
+                  .str.replace(_PLURAL_PATTERN, '', regex=True).str.findall(_TOKEN_PATTERN).explode())
+        tokens = tokens[tokens.notna() & (tokens.str.len() > 1)]
+        by_token = pd.Series(tokens.index.to_numpy(dtype=np.int32), index=tokens.to_numpy()).groupby(level=0)
+        postings = {token: np.unique(group.to_numpy()) for token, group in by_token if token not in STOPWORDS}
+        values = [str(u) for u in uniques] if keep_values and len(uniques) <= MAX_NAMED_VALUES else None
+        return _ColumnPostings(codes=codes.astype(np.int32), counts=np.bincount(codes[codes >= 0], minlength=len(uniques)),
+                               postings=postings, values=values)
+
+    # --- Queries ---
+
+    def _idf(self, rows_with_term: int) -> float:
+        return math.log(1 + self.n_rows / (1 + rows_with_term))
+
+    def scores(self, question: str) -> np.ndarray:
+        scores = np.zeros(self.n_rows, dtype=np.float32)
+        tokens = tokenize(question)
+        for col in self.columns.values():
+            value_scores = np.zeros(len(col.counts) + 1, dtype=np.float32)  # last slot: blank (-1)
+            for token in tokens:
+                matched = col.postings.get(token)
+                if matched is not None:
+                    value_scores[matched] += self._idf(int(col.counts[matched].sum()))
+            if value_scores.any():
+                scores += value_scores[col.codes]
+        for token in tokens:
+            for rows in self.issue_terms.get(token, []):
+                scores[rows] += self._idf(len(rows))
+        return scores
+
+    def search(self, question: str, k: int = 40) -> Dict[str, Any]:
+        """
+        The `k` rows most relevant to `question`, plus aggregates over every matching row.
+
+        Falls back to an issue-stratified sample when no word of the question is indexed.
+        """
+        scores = self.scores(question)
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) == 0:
+            rows = self.issue_index.sample(k) if self.issue_index else np.arange(min(k, self.n_rows))
+            return {"rows": rows, "matched": 0, "aggregates": self.aggregates(None), "fallback": True}
+        top = matched if len(matched) <= k else matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[matched] = True
+        return {"rows": top, "matched": int(len(matched)), "aggregates": self.aggregates(mask), "fallback": False}
+
+    def aggregates(self, mask: Optional[np.ndarray]) -> Dict[str, Any]:
+        """Issue counts and top categories/brands over the rows in `mask` (all rows when None)."""
+        result: Dict[str, Any] = {"rows": int(self.n_rows if mask is None else mask.sum())}
+        if self.issue_index:
+            issues = {col: int(len(rows) if mask is None else np.count_nonzero(mask[rows]))
+                      for col, rows in self.issue_index.flagged.items()}
+            result["issues"] = {col: count for col, count in issues.items() if count}
+        for name in AGGREGATE_COLUMNS:
+            col = self.columns.get(name)
+            if col is None or col.values is None:
+                continue
+            codes = col.codes if mask is None else col.codes[mask]
+            counts = np.bincount(codes[codes >= 0], minlength=len(col.values))
+            top = np.argsort(-counts, kind="stable")[:5]
+            result[f"top_{name}"] = {col.values[i]: int(counts[i]) for i in top if counts[i]}
+        return result
@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import logging
+import statistics
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from .api_tracker import ApiUsageTracker, PRICES_USD_PER_MTOK, estimate_usage_cost
+from .llm_batching import estimate_tokens
+from .llm_client import dry_run
+
+# Throughput of past runs, one JSON line per run (see record_run)
+DEFAULT_HISTORY_PATH = os.getenv(
+    "RUN_HISTORY_PATH", os.path.join(os.path.expanduser("~"), ".mx_assessment", "run_history.jsonl")
+)
+
+# LLM-backed agents in pipeline order; the planner dry-runs these on a sample
+PLANNED_AGENTS = ["Category", "Item Name Rules", "Exclusion", "Master Reporting", "Final Summary"]
+# Agents that send a fixed number of requests whatever the row count
+# (Category maps the paths found in a 100-row sample)
+FIXED_AGENTS = {"Category", "Master Reporting", "Final Summary"}
+
+# Fallbacks until the run history has data
+DEFAULT_TOKENS_PER_SEC = 1500.0
+DEFAULT_ESCALATION_RATE = 0.3
+DEFAULT_COMPLETION_TOKENS = 600
+MESSAGE_OVERHEAD_TOKENS = 4
+BATCH_API_DISCOUNT = 0.5
+_DRY_RUN_KEY = "dry-run"
+
+
+@dataclass
+class AgentEstimate:
+    agent: str
+    models: str
+    requests: float
+    prompt_tokens: int
+    completion_tokens: int
+    cost_usd: float
+    llm_seconds: float
+    local_seconds: float
+
+
+# --- Run history ---
+
+def record_run(tracker: ApiUsageTracker, rows: int, wall_s: float, path: str = DEFAULT_HISTORY_PATH) -> None:
+    """Appends one finished run's per-agent throughput to the history the planner learns from."""
+    entry = {"ts": datetime.utcnow().isoformat(), "rows": int(rows), "wall_s": round(float(wall_s), 3), **tracker.run_stats()}
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError as e:
+        logging.warning(f"Could not record run history: {e}")
+
+
+def load_history(path: str = DEFAULT_HISTORY_PATH, last_n: int = 20) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+    return runs[-last_n:]
+
+
+def _history_rates(history: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Medians over past runs: tokens/sec and completion/prompt ratio per agent, escalation, local s/row."""
+    tps: Dict[str, List[float]] = {}
+    ratio: Dict[str, List[float]] = {}
+    escalation: Dict[str, List[float]] = {}
+    local_per_row: List[float] = []
+    for run in history:
+        llm_s = 0.0
+        for agent, a in run.get("agents", {}).items():
+            tokens = a["prompt_tokens"] + a["completion_tokens"]
+            if a.get("llm_wall_s", 0) > 0:
+                tps.setdefault(agent, []).append(tokens / a["llm_wall_s"])
+                llm_s += a["llm_wall_s"]
+            if a["prompt_tokens"]:
+                ratio.setdefault(agent, []).append(a["completion_tokens"] / a["prompt_tokens"])
+        for agent, rate in run.get("escalation", {}).items():
+            escalation.setdefault(agent, []).append(rate)
+        if run.get("rows"):
+            local_per_row.append(max(run.get("wall_s", 0) - llm_s, 0.0) / run["rows"])
+    median = lambda d: {k: statistics.median(v) for k, v in d.items() if v}
+    return {
+        "tokens_per_sec": median(tps),
+        "completion_ratio": median(ratio),
+        "escalation": median(escalation),
+        "local_s_per_row": statistics.median(local_per_row) if local_per_row else None,
+    }
+
+
+# --- Estimation ---
+
+def _prompt_tokens(params: Dict[str, Any]) -> int:
+    model = params.get("model", "gpt-4o")
+    return sum(
+        estimate_tokens(str(m.get("content", "")), model) + MESSAGE_OVERHEAD_TOKENS
+        for m in params.get("messages", [])
+    )
+
+
+def _dry_run_agent(agent, df: pd.DataFrame, vertical: str, report: Optional[dict]):
+    """Runs one agent the way the pipeline does; returns (df, report)."""
+    name = agent.attribute_name
+    if name == "Category":
+        # assess() would overwrite the session's taxonomy mapping download
+        df[agent.issue_column] = ''
+        df = agent.run_initial_assessment(df, _DRY_RUN_KEY)
+        if agent.taxonomy_df is not None:
+            agent.run_detailed_taxonomy_mapping(df, _DRY_RUN_KEY)
+        return df, report
+    if name == "Master Reporting":
+        return df, agent.assess(df, vertical=vertical, api_key=_DRY_RUN_KEY)
+    if name == "Final Summary":
+        agent.assess(report or {}, api_key=_DRY_RUN_KEY)
+        return df, report
+    return agent.assess(df, api_key=_DRY_RUN_KEY), report
+
+
+def _item_cap(agent) -> Optional[int]:
+    """Most items the agent ever sends to its first model tier, whatever the row count."""
+    if agent.attribute_name == "Exclusion":
+        return getattr(agent, "max_ai_items", None) or None
+    if agent.attribute_name == "Item Name Rules":
+        return agent.max_ai_clusters * agent.reps_per_cluster
+    return None
+
+
+def estimate_run(
+    df: pd.DataFrame,
+    agents: List[Any],
+    *,
+    vertical: str = "CnG",
+    sample_rows: int = 5000,
+    seed: int = 42,
+    history_path: str = DEFAULT_HISTORY_PATH,
+    price_table: Optional[Dict[str, Dict[str, float]]] = None,
+    progress_callback: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Projects the cost and duration of running `agents` on `df` without calling the API.
+
+    The LLM-backed agents are dry-run on a seeded sample: they build the exact requests
+    they would send, which are counted locally and scaled up to the full file (per row,
+    or not at all for the agents that sample a fixed amount, and never past the agents'
+    own item caps). Cheap-tier requests count in full, escalations at the
+    historical rate. Duration uses the tokens/sec and local seconds per row recorded by
+    past runs (record_run); costs ignore provider prompt caching, so they err high.
+    """
+    price_table = price_table or PRICES_USD_PER_MTOK
+    history = load_history(history_path)
+    rates = _history_rates(history)
+    by_name = {a.attribute_name: a for a in agents}
+    planned = [by_name[name] for name in PLANNED_AGENTS if name in by_name]
+
+    work = df.sample(n=min(sample_rows, len(df)), random_state=seed) if len(df) else df.copy()
+    work = work.copy()
+    for flag_col in ['IS_WEIGHTED_ITEM', 'IS_ALCOHOL', 'IS_CBD', 'SNAP_ELIGIBLE']:
+        if flag_col in work.columns:
+            work[flag_col] = pd.to_numeric(work[flag_col], errors='coerce')
+    row_scale = len(df) / len(work) if len(work) else 0.0
+
+    estimates: List[AgentEstimate] = []
+    report = None
+    local_measured = 0.0
+    for agent in planned:
+        name = agent.attribute_name
+        if progress_callback:
+            progress_callback(name)
+        started = time.perf_counter()
+        with dry_run() as collected:
+            try:
+                work, report = _dry_run_agent(agent, work, vertical, report)
+            except Exception as e:
+                logging.warning(f"Dry run of '{name}' failed; its estimate is incomplete: {e}")
+        local_s = (time.perf_counter() - started) * row_scale
+        local_measured += local_s
+
+        # Cascading agents send every item to a cheaper tier first; a dry run gets no answers, so
+        # nothing reaches self.model and escalations are priced from the cheap-tier requests
+        cascade = any(c["params"].get("model") != agent.model for c in collected)
+        escalation = rates["escalation"].get(name, DEFAULT_ESCALATION_RATE)
+        first_tier_items = sum(c["items"] for c in collected if not cascade or c["params"].get("model") != agent.model)
+
+        scale = 1.0 if name in FIXED_AGENTS else row_scale
+        cap = _item_cap(agent)
+        if cap and first_tier_items:
+            scale = min(scale, max(cap / first_tier_items, 1.0))
+
+        priced = [(c, c["params"].get("model", agent.model), scale) for c in collected]
+        if cascade:
+            priced += [(c, agent.model, scale * escalation) for c, model, _ in list(priced) if model != agent.model]
+
+        requests = prompt_tokens = completion_tokens = cost = 0.0
+        models = []
+        for c, model, weight in priced:
+            p_tokens = _prompt_tokens(c["params"])
+            per_item = getattr(agent, "completion_tokens_per_item", None)
+            if per_item:
+                c_tokens = per_item * c["items"]
+            elif name in rates["completion_ratio"]:
+                c_tokens = p_tokens * rates["completion_ratio"][name]
+            else:
+                c_tokens = DEFAULT_COMPLETION_TOKENS
+            requests += weight
+            prompt_tokens += weight * p_tokens
+            completion_tokens += weight * c_tokens
+            cost += weight * estimate_usage_cost(
+                model, {"prompt_tokens": p_tokens, "completion_tokens": c_tokens}, price_table
+            )
+            if model not in models:
+                models.append(model)
+
+        tps = rates["tokens_per_sec"].get(name, DEFAULT_TOKENS_PER_SEC)
+        estimates.append(AgentEstimate(
+            agent=name, models=", ".join(models), requests=round(requests, 1),
+            prompt_tokens=int(prompt_tokens), completion_tokens=int(completion_tokens),
+            cost_usd=round(cost, 4), llm_seconds=round((prompt_tokens + completion_tokens) / tps, 1),
+            local_seconds=round(local_s, 1),
+        ))
+
+    llm_seconds = sum(e.llm_seconds for e in estimates)
+    local_seconds = rates["local_s_per_row"] * len(df) if rates["local_s_per_row"] is not None else local_measured
+    total_cost = sum(e.cost_usd for e in estimates)
+    return {
+        "rows": int(len(df)),
+        "sample_rows": int(len(work)),
+        "agents": [asdict(e) for e in estimates],
+        "prompt_tokens": sum(e.prompt_tokens for e in estimates),
+        "completion_tokens": sum(e.completion_tokens for e in estimates),
+        "cost_usd": round(total_cost, 4),
+        "batch_cost_usd": round(total_cost * BATCH_API_DISCOUNT, 4),
+        "duration_s": round(llm_seconds + local_seconds, 1),
+        "history_runs": len(history),
+    }
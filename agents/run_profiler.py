@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    from pyinstrument import Profiler as _PyinstrumentProfiler
+except ImportError:
+    _PyinstrumentProfiler = None
+
+# One folder per run: manifest.json plus any per-step profiler output
+DEFAULT_RUNS_DIR = os.getenv("RUN_MANIFEST_DIR", os.path.join(os.path.expanduser("~"), ".mx_assessment", "runs"))
+PROFILE_MODES = ("off", "cprofile", "pyinstrument")
+
+
+@dataclass
+class StepRecord:
+    name: str
+    kind: str
+    wall_s: float
+    cpu_s: float
+    rows: int
+    rows_per_sec: float
+    peak_mem_mb: Optional[float]
+    rss_peak_mb: Optional[float]
+    profile_file: str = ""
+    error: str = ""
+
+
+def _rss_peak_mb() -> Optional[float]:
+    """Process high-water RSS (ru_maxrss is KB on Linux, bytes on macOS)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _slug(name: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in name).strip("_").lower() or "step"
+
+
+class RunProfiler:
+    """
+    Times the steps of one assessment run and writes them to a run manifest.
+
+    Each step records wall and CPU time, row throughput, the process's peak RSS and,
+    with `trace_memory`, the step's own tracemalloc peak (slower, so off by default).
+    `profile_mode` "cprofile" or "pyinstrument" also saves a per-step profile next to
+    the manifest. CPU time is process-wide, so it includes the step's worker threads.
+    """
+
+    def __init__(self, *, profile_mode: str = "off", trace_memory: bool = False,
+                 runs_dir: str = DEFAULT_RUNS_DIR, metadata: Optional[Dict[str, Any]] = None):
+        if profile_mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {profile_mode}")
+        if profile_mode == "pyinstrument" and _PyinstrumentProfiler is None:
+            logging.warning("pyinstrument is not installed; falling back to cProfile.")
+            profile_mode = "cprofile"
+        self.profile_mode = profile_mode
+        self.trace_memory = trace_memory
+        self.run_id = f"{datetime.utcnow():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        self.run_dir = os.path.join(runs_dir, self.run_id)
+        self.metadata: Dict[str, Any] = dict(metadata or {})
+        self.steps: List[StepRecord] = []
+        self.started = time.perf_counter()
+        self._active = False
+
+    @contextmanager
+    def step(self, name: str, kind: str = "step", rows: int = 0):
+        """Measures the enclosed block. Nested steps are recorded without their own profiler."""
+        outer = not self._active
+        self._active = True
+        profiler = self._start_profiler() if outer and self.profile_mode != "off" else None
+        tracing = self.trace_memory and outer
+        if tracing:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        error = ""
+        try:
+            yield
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            wall = time.perf_counter() - wall0
+            cpu = time.process_time() - cpu0
+            peak = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 1) if tracing else None
+            if tracing:
+                tracemalloc.stop()
+            profile_file = self._stop_profiler(profiler, name) if profiler is not None else ""
+            if outer:
+                self._active = False
+            self.steps.append(StepRecord(
+                name=name, kind=kind, wall_s=round(wall, 4), cpu_s=round(cpu, 4), rows=int(rows),
+                rows_per_sec=round(rows / wall, 1) if rows and wall > 0 else 0.0,
+                peak_mem_mb=peak, rss_peak_mb=_rss_peak_mb(), profile_file=profile_file, error=error,
+            ))
+            logging.info(f"[profile] {name}: {wall:.2f}s wall, {cpu:.2f}s CPU" + (f", {peak} MB peak" if peak is not None else ""))
+
+    def _start_profiler(self):
+        """The step's profiler, or None when another run in this process is already profiling."""
+        try:
+            if self.profile_mode == "pyinstrument":
+                profiler = _PyinstrumentProfiler()
+                profiler.start()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+        except (ValueError, RuntimeError) as e:
+            # Python allows one active profiler per process (e.g. two Streamlit sessions profiling at once)
+            logging.warning(f"[profile] Step not profiled: {e}")
+            return None
+        return profiler
+
+    def _stop_profiler(self, profiler, name: str) -> str:
+        os.makedirs(self.run_dir, exist_ok=True)
+        index = len(self.steps) + 1
+        try:
+            if self.profile_mode == "pyinstrument":
+                profiler.stop()
+                path = os.path.join(self.run_dir, f"{index:02d}_{_slug(name)}.html")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+            else:
+                profiler.disable()
+                path = os.path.join(self.run_dir, f"{index:02d}_{_slug(name)}.prof")
+                profiler.dump_stats(path)
+            return os.path.basename(path)
+        except Exception as e:
+            logging.warning(f"Could not save profile for '{name}': {e}")
+            return ""
+
+    def manifest(self, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return {
+            "run_id": self.run_id,
+            "ts": datetime.utcnow().isoformat(),
+            "total_wall_s": round(time.perf_counter() - self.started, 3),
+            "profile_mode": self.profile_mode,
+            "trace_memory": self.trace_memory,
+            **self.metadata,
+            **(extra or {}),
+            "steps": [asdict(s) for s in self.steps],
+        }
+
+    def write_manifest(self, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Writes manifest.json for this run (best effort) and returns the manifest."""
+        manifest = self.manifest(extra)
+        path = os.path.join(self.run_dir, "manifest.json")
+        try:
+            os.makedirs(self.run_dir, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2, default=str)
+            logging.info(f"Run manifest written to {path}")
+        except OSError as e:
+            logging.warning(f"Could not write run manifest: {e}")
+        return manifest
+
+
+def load_manifests(runs_dir: str = DEFAULT_RUNS_DIR, last_n: int = 10) -> List[Dict[str, Any]]:
+    """The most recent run manifests, oldest first."""
+    if not os.path.isdir(runs_dir):
+        return []
+    manifests = []
+    for run_id in sorted(os.listdir(runs_dir))[-last_n:]:
+        path = os.path.join(runs_dir, run_id, "manifest.json")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                manifests.append(json.load(f))
+    return manifests
+
+
+def compare_steps(current: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """This run's steps with the previous run's wall time for the same step."""
+    before = {(s["name"], s["kind"]): s for s in (previous or {}).get("steps", [])}
+    rows = []
+    for s in current["steps"]:
+        prev = before.get((s["name"], s["kind"]))
+        rows.append({
+            "Step": s["name"], "Kind": s["kind"], "Wall (s)": s["wall_s"], "CPU (s)": s["cpu_s"],
+            "Rows/sec": s["rows_per_sec"], "Peak Mem (MB)": s["peak_mem_mb"], "RSS Peak (MB)": s["rss_peak_mb"],
+            "Prev Wall (s)": prev["wall_s"] if prev else None,
+            "Δ Wall": f"{(s['wall_s'] - prev['wall_s']) / prev['wall_s']:+.0%}" if prev and prev["wall_s"] else "",
+            "Profile": s["profile_file"],
+        })
+    return rows
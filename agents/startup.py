@@ -0,0 +1,75 @@
+import os
+import ast
+import time
+import logging
+import importlib
+import urllib.request
+from typing import List, Optional, Sequence
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Scripts the first page load runs; their top-level imports are the cold-start cost
+STARTUP_SCRIPTS = ("launcher.py", "streamlit_app.py")
+# Seconds from process start until the first page can render (checked by scripts/profile_startup.py)
+COLD_START_BUDGET_S = float(os.getenv("COLD_START_BUDGET_S", "3.0"))
+READY_MARKER = "APP_READY"
+
+
+def startup_imports(scripts: Sequence[str] = STARTUP_SCRIPTS, app_dir: str = APP_DIR) -> List[str]:
+    """Modules imported at the top level of `scripts`, read from the source."""
+    modules = []
+    for script in scripts:
+        path = os.path.join(app_dir, script)
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                modules += [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def warm_imports(modules: Optional[Sequence[str]] = None) -> float:
+    """
+    Imports the first page's modules ahead of the first browser session, while the server
+    starts, so the first script run finds them loaded. Returns the seconds it took.
+    """
+    started = time.perf_counter()
+    for module in modules if modules is not None else startup_imports():
+        try:
+            importlib.import_module(module)
+        except Exception as e:  # the page itself reports real import errors
+            logging.warning(f"Warm-up import of {module} failed: {e}")
+    return time.perf_counter() - started
+
+
+def wait_until_ready(health_url: str, timeout_s: float = 60.0, interval_s: float = 0.1) -> bool:
+    """Polls Streamlit's health endpoint until it answers 200 (True) or `timeout_s` passes (False)."""
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(health_url, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            pass
+        time.sleep(interval_s)
+    return False
+
+
+def signal_ready(port: int, process_started: float, warm: bool = True) -> bool:
+    """
+    Warms the startup imports, waits for the server and prints `APP_READY <port> <seconds>`
+    on stdout for the desktop launcher. Run it in a background thread next to the server.
+    """
+    warm_s = warm_imports() if warm else 0.0
+    ready = wait_until_ready(f"http://127.0.0.1:{port}/_stcore/health")
+    elapsed = time.monotonic() - process_started
+    if not ready:
+        logging.error(f"Streamlit did not become healthy on port {port} within the timeout.")
+        return False
+    logging.info(f"Ready after {elapsed:.2f}s (imports warmed in {warm_s:.2f}s; budget {COLD_START_BUDGET_S:.1f}s).")
+    print(f"{READY_MARKER} {port} {elapsed:.2f}", flush=True)
+    return True
@@ -0,0 +1,159 @@
+import re
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Default item-name style guides per business vertical
+DEFAULT_STYLE_GUIDES = {
+    "CnG": "[Brand] [Dietary Tag] [Variation] [Item Name] [Container] [Size & UOM]",
+    "Alcohol": "[Brand] [Dietary Tag] [Flavor] [Variation] [Size] [Color] [Age] [Item Name] [Container] [Appellation Location] [Vintage Year] [Size & UOM]",
+    "Office": "[Brand] [Variation] [Size] [Color] [Item Name] [Product Key]",
+    "Home Improvement": "[Brand] [Material/Fabric] [Power] [Variation] [Size] [Color] [Scent] [Item Name] [with Accessories]",
+    "Beauty": "[Brand] [Item Name] [Product Type] [Variation] [Size] [Scent] [Color][Size & UOM]",
+    "Sports": "[Brand] [Age (specific to infant clothing)] [Gender] [Collection/Sub Brand] [Quantity if more than 1, e.g., '2 Pack' or '2 Piece'] [Style] [Color] [Fabric] [Item Name]",
+    "Electronics": "[Brand] [Variant 1] [Variant 2] [Size] [Color] [Item Name] [with Additional Detail] ['(Open Box)']",
+    "Pets": "[Brand] [Item Name] [Variation] [Dietary Tag] [Flavor] [Size] [Color] [Pet/Animal Type] [Container]",
+    "Party": "[Brand/exclude if parent brand] [Variation] [Size] [Color] [Item Name]",
+    "Halloween": "[Brand] [Item Name] [Size] [Quantity]",
+    "Home": "[Brand] [Material/Fabric] [Variation] [Size] [Color] [Scent] [Room] [Item Name]",
+    "Produce": "[Brand] [Variety] [Item Name] [Container] [Size & UOM]",
+    "Outdoor": "[Brand] [Gender/Age] [Variation] [Color] [Size] [Sport/Activity] [Item Name] [Clothing Size]"
+}
+
+_SLOT_RE = re.compile(r"\[([^\[\]]+)\]")
+_BLANKS = {"", "nan", "none", "null", "default", "n/a"}
+
+# "(12 oz)" / "(1.5 fl oz)" at the end of the name: number, single space, unit
+_SIZE_SUFFIX_RE = r"\(\d+(?:\.\d+)?(?:\s?[x×]\s?\d+(?:\.\d+)?)? [^\d\s()][^()]*\)\s*$"
+# "12oz", "500ml": a size glued to its unit
+_SIZE_NO_SPACE_RE = r"\d(?:fl\.?\s?oz|oz|lbs?|kg|g|mg|ml|cl|l|ct|pk|ea)\b"
+# "Banana (ea)": weighted items end with the UoM in parentheses
+_WEIGHTED_SUFFIX_RE = r"\([^\d()]+\)\s*$"
+
+
+@dataclass(frozen=True)
+class CompiledStyleGuide:
+    """Machine-checkable view of a bracketed style guide string."""
+    guide: str
+    slots: tuple
+    brand_first: bool
+    has_size_uom: bool
+    size_uom_last: bool
+    # Every slot is brand-first or Size & UoM, so passing the rules means the name follows the guide
+    rules_cover_all_slots: bool
+
+    def check(self, df: pd.DataFrame, name_col: str) -> pd.DataFrame:
+        """
+        Runs every applicable rule column-wise over `df`.
+
+        Returns a frame aligned to df.index with:
+          - style_score: share of applicable rules passed (NaN if none applied)
+          - style_issues: human-readable failures
+          - style_decided: True when the rules alone settle the row
+        """
+        names = df[name_col].fillna("").astype(str).str.strip()
+        names_lower = names.str.lower()
+        checks = {}
+        # Rows whose brand/size data lets every slot-backed rule run
+        covered = pd.Series(True, index=df.index)
+
+        brand = _clean_text(df.get("BRAND_NAME"), df.index)
+        has_brand = ~brand.str.lower().isin(_BLANKS)
+        if self.brand_first:
+            covered &= has_brand
+            # The brand as a whole word: "Bic Pen" starts with "Bic", "Bicycle Pump" doesn't
+            name_arr, brand_arr = names_lower.to_numpy(dtype=str), brand.str.lower().to_numpy(dtype=str)
+            starts = np.char.startswith(name_arr, np.char.add(brand_arr, " ")) | (name_arr == brand_arr)
+            checks["Brand is not the first token"] = _tri_state(starts, has_brand)
+
+        if self.has_size_uom:
+            weighted = _weighted_mask(df)
+            size = _clean_text(df.get("SIZE"), df.index).str.replace(r"\.0+$", "", regex=True)
+            uom = _clean_text(df.get("UNIT_OF_MEASUREMENT"), df.index)
+            has_size = ~size.str.lower().isin(_BLANKS) & ~uom.str.lower().isin(_BLANKS) & ~weighted
+            covered &= has_size | weighted
+
+            expected = ("(" + size + " " + uom + ")").str.lower()
+            found_at = np.char.find(names_lower.to_numpy(dtype=str), expected.to_numpy(dtype=str))
+            checks["Size & UoM from SIZE/UNIT_OF_MEASUREMENT missing from name"] = _tri_state(found_at >= 0, has_size)
+            if self.size_uom_last:
+                ends = np.char.endswith(names_lower.to_numpy(dtype=str), expected.to_numpy(dtype=str))
+                checks["Size & UoM is not the last token"] = _tri_state(ends, has_size)
+
+            size_fmt = names.str.contains(_SIZE_SUFFIX_RE, regex=True)
+            glued = names_lower.str.contains(_SIZE_NO_SPACE_RE, regex=True)
+            checks["Size/UoM not formatted as '(12 oz)'"] = _tri_state(size_fmt & ~glued, ~weighted & names.ne(""))
+            if weighted.any():
+                checks["Weighted item not formatted as 'Item Name (UoM)'"] = _tri_state(
+                    names.str.contains(_WEIGHTED_SUFFIX_RE, regex=True), weighted
+                )
+
+        if not checks:
+            return pd.DataFrame(
+                {"style_score": np.nan, "style_issues": "", "style_decided": False}, index=df.index
+            )
+
+        matrix = pd.DataFrame(checks, index=df.index)
+        failed = matrix.eq(0.0)
+        n_applicable = matrix.notna().sum(axis=1)
+        score = matrix.sum(axis=1, min_count=1) / n_applicable.replace(0, np.nan)
+
+        issues = pd.Series("", index=df.index)
+        for label in matrix.columns:
+            issues = issues.where(~failed[label], issues + f"⚠️ Style guide: {label}. ")
+
+        # Rules settle a row when something failed; a pass only settles it when the rules check every
+        # slot of the guide and the brand/size data let them all run (otherwise the AI checks the rest)
+        decided = failed.any(axis=1) | (covered & self.rules_cover_all_slots)
+        return pd.DataFrame(
+            {"style_score": score, "style_issues": issues.str.strip(), "style_decided": decided & names.ne("")},
+            index=df.index,
+        )
+
+
+def parse_style_guide(guide: str) -> List[str]:
+    """Returns the bracketed slots of a style guide in order."""
+    return [slot.strip() for slot in _SLOT_RE.findall(guide or "")]
+
+
+@lru_cache(maxsize=64)
+def compile_style_guide(guide: str) -> Optional[CompiledStyleGuide]:
+    """Parses a style guide once and returns the compiled checker (None if it has no slots)."""
+    slots = parse_style_guide(guide)
+    if not slots:
+        logging.warning("Style guide has no [bracketed] slots; rule-based conformance disabled.")
+        return None
+    lowered = [s.lower() for s in slots]
+    size_uom_idx = [i for i, s in enumerate(lowered) if "size" in s and "uom" in s]
+    brand_first = lowered[0].startswith("brand")
+    return CompiledStyleGuide(
+        guide=guide,
+        slots=tuple(slots),
+        brand_first=brand_first,
+        has_size_uom=bool(size_uom_idx),
+        size_uom_last=bool(size_uom_idx) and size_uom_idx[-1] == len(slots) - 1,
+        rules_cover_all_slots=int(brand_first) + len(size_uom_idx) == len(slots),
+    )
+
+
+def _clean_text(series: Optional[pd.Series], index: pd.Index) -> pd.Series:
+    if series is None:
+        return pd.Series("", index=index)
+    return series.fillna("").astype(str).str.strip()
+
+
+def _weighted_mask(df: pd.DataFrame) -> pd.Series:
+    if "IS_WEIGHTED_ITEM" not in df.columns:
+        return pd.Series(False, index=df.index)
+    flags = df["IS_WEIGHTED_ITEM"].astype(str).str.strip().str.lower()
+    return flags.isin({"1", "1.0", "true", "t", "yes", "y"})
+
+
+def _tri_state(passed, applicable: pd.Series) -> pd.Series:
+    """1.0 = passed, 0.0 = failed, NaN = rule does not apply to the row."""
+    out = pd.Series(np.where(np.asarray(passed, dtype=bool), 1.0, 0.0), index=applicable.index)
+    return out.where(applicable.to_numpy(dtype=bool))
@@ -0,0 +1,20 @@
+import os
+import json
+import logging
+from typing import Optional
+
+import pandas as pd
+
+# Relative to the working folder: the app, the scripts and the worker all run from the app's folder
+DEFAULT_TAXONOMY_PATH = "taxonomy.json"
+
+
+def load_taxonomy(path: Optional[str] = DEFAULT_TAXONOMY_PATH) -> Optional[pd.DataFrame]:
+    """Taxonomy rows from taxonomy.json (its "taxonomy" list) or a CSV; None when there is no file."""
+    if not path or not os.path.exists(path):
+        logging.warning(f"No taxonomy at {path}; taxonomy-based agents will be limited.")
+        return None
+    if path.endswith(".json"):
+        with open(path, "r") as f:
+            return pd.DataFrame(json.load(f)["taxonomy"])
+    return pd.read_csv(path)
@@ -2,10 +2,14 @@
 # app_entry.py — robust launcher for a packaged Streamlit app
 import os
 import sys
+import time
+import threading
 from pathlib import Path
 from streamlit import config as _config
 from streamlit.web import bootstrap
 
+_PROCESS_STARTED = time.monotonic()
+
 
 def _pick_port(default: int) -> int:
     """Read port from env (STREAMLIT_SERVER_PORT) with sane fallback."""
@@ -46,12 +50,24 @@ def _run_streamlit(script_path: Path, port: int) -> None:
 
 def main() -> None:
     base_dir = Path(__file__).resolve().parent
+    sys.path.insert(0, str(base_dir))
+    from agents.job_queue import FROZEN_WORKER_FLAG
+    if sys.argv[1:2] == [FROZEN_WORKER_FLAG]:
+        # Frozen builds have no separate Python: this binary also runs the background job worker
+        sys.argv = [sys.argv[0]] + sys.argv[2:]
+        import run_assessment_worker
+        run_assessment_worker.main()
+        return
+
     script_path = base_dir / "launcher.py"
     if not script_path.exists():
         sys.stderr.write(f"ERROR: Streamlit app not found: {script_path}\n")
         sys.exit(2)
 
     port = _pick_port(8501)
+    # Tell the launcher when the app can actually serve a page instead of making it guess
+    from agents.startup import signal_ready
+    threading.Thread(target=signal_ready, args=(port, _PROCESS_STARTED), daemon=True).start()
     _run_streamlit(script_path, port)
 
 
@@ -0,0 +1,52 @@
+import argparse
+import json
+
+import pandas as pd
+
+from agents.category_agent import Agent as CategoryAgent
+from agents.exclusion_agent import Agent as ExclusionAgent
+from agents.final_summary_agent import Agent as FinalSummaryAgent
+from agents.item_name_agent import Agent as ItemNameAgent
+from agents.master_reporting_agent import Agent as MasterReportingAgent
+from agents.run_planner import DEFAULT_HISTORY_PATH, estimate_run
+from agents.style_guide import DEFAULT_STYLE_GUIDES
+from agents.taxonomy import load_taxonomy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate the cost and duration of an assessment without calling the API.")
+    parser.add_argument("--input", "-i", required=True, help="Path to input CSV (standardized column names)")
+    parser.add_argument("--output", "-o", help="Optional path to save the estimate as JSON")
+    parser.add_argument("--vertical", default="CnG")
+    parser.add_argument("--style-guide", default="", help="Defaults to the vertical's built-in style guide")
+    parser.add_argument("--nexla", action="store_true", help="Merchant is Nexla-enabled")
+    parser.add_argument("--model", default="gpt-5-chat-latest")
+    parser.add_argument("--no-cascade", action="store_true", help="Estimate without the cheap-model-first cascade")
+    parser.add_argument("--taxonomy", default="taxonomy.json", help="taxonomy.json or a CSV of taxonomy rows")
+    parser.add_argument("--sample-rows", type=int, default=5000, help="Rows dry-run to build the sample prompts")
+    parser.add_argument("--history", default=DEFAULT_HISTORY_PATH, help="Run history with recorded throughput")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input, low_memory=False, dtype={'BUSINESS_ID': str, 'MSID': str, 'UPC': str})
+
+    agents = [CategoryAgent(), ItemNameAgent(), ExclusionAgent(), MasterReportingAgent(), FinalSummaryAgent()]
+    for agent in agents:
+        agent.model = args.model
+        agent.use_model_cascade = not args.no_cascade
+    agents[0].taxonomy_df, agents[0].vertical = load_taxonomy(args.taxonomy), args.vertical
+    agents[1].vertical, agents[1].is_nexla_mx = args.vertical, args.nexla
+    agents[1].style_guide = args.style_guide or DEFAULT_STYLE_GUIDES.get(args.vertical, "")
+
+    estimate = estimate_run(df, agents, vertical=args.vertical, sample_rows=args.sample_rows, history_path=args.history)
+
+    print(pd.DataFrame(estimate["agents"]).to_string(index=False))
+    print(f"✅ {estimate['rows']:,} rows: ~${estimate['cost_usd']:.2f} "
+          f"(~${estimate['batch_cost_usd']:.2f} in batch mode), ~{estimate['duration_s'] / 60:.1f} min "
+          f"[{estimate['history_runs']} past runs in history]")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(estimate, f, indent=2)
+        print(f"✅ Estimate written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -113,10 +113,11 @@ function waitForHttp(url, timeoutMs = 60000) {
   return new Promise((resolve, reject) => {
     const tryOnce = () => {
       const req = http.get(url, res => {
-        if ((res.statusCode || 0) < 600) resolve();
-        else setTimeout(next, 300);
+        res.resume();
+        if (res.statusCode === 200) resolve();
+        else setTimeout(next, 100);
       });
-      req.on('error', () => setTimeout(next, 300));
+      req.on('error', () => setTimeout(next, 100));
       req.end();
     };
     const next = () => (Date.now() > deadline ? reject(new Error('Server not ready')) : tryOnce());
@@ -124,6 +125,22 @@ function waitForHttp(url, timeoutMs = 60000) {
   });
 }
 
+// Resolves when the Python side prints "APP_READY <port> <seconds>" (see agents/startup.py):
+// server healthy and first-page imports warmed.
+function waitForReadySignal(proc, timeoutMs = 60000) {
+  return new Promise((resolve, reject) => {
+    const timer = setTimeout(() => reject(new Error('No ready signal')), timeoutMs);
+    proc.stdout.on('data', d => {
+      const m = String(d).match(/APP_READY (\d+) ([\d.]+)/);
+      if (m) {
+        clearTimeout(timer);
+        console.log(`App ready on port ${m[1]} after ${m[2]}s`);
+        resolve();
+      }
+    });
+  });
+}
+
 // ------------------------------ main -------------------------------
 
 async function createWindow() {
@@ -243,12 +260,15 @@ async function createWindow() {
   const childEnv = { ...env, STREAMLIT_SERVER_PORT: String(PORT) };
   pyProc = spawn(cmd, args, { env: childEnv, cwd: RES_BASE });
 
+  const ready = waitForReadySignal(pyProc, 60000);
   pyProc.stdout.on('data', d => process.stdout.write('[py] ' + d));
   pyProc.stderr.on('data', d => process.stderr.write('[py] ' + d));
   pyProc.on('exit', code => console.log('Python exited:', code));
 
   try {
     await waitForHttp(HEALTH_URL, 60000);
+    // Healthy server: give the warm-up a bounded moment to finish (older entries never signal)
+    await Promise.race([ready.catch(() => {}), new Promise(r => setTimeout(r, 10000))]);
     await win.loadURL(APP_URL);
   } catch (err) {
     console.error('Health check failed:', err.message);
@@ -5,6 +5,7 @@ import threading
 import time
 import os
 import sys
+from agents.startup import signal_ready
 
 # --- FIX: Updated Monkey-patch for Streamlit's signal handler ---
 # This version now accepts any arguments (*args, **kwargs) that Streamlit
@@ -35,13 +36,15 @@ def run_streamlit():
 
 def main():
     """Main function to launch the Streamlit server and the PyWebView window."""
+    started = time.monotonic()
     # Start Streamlit in a background thread
     thread = threading.Thread(target=run_streamlit)
     thread.daemon = True
     thread.start()
 
-    # Wait a moment for the server to start
-    time.sleep(5) 
+    # Open the window once the server is healthy and the first page's imports are warm
+    if not signal_ready(port, started):
+        print(f"Streamlit did not start on {url}; opening the window anyway.")
 
     # Create and show the native window
     webview.create_window("Mx Data Assessment Tool", url, width=1280, height=800)
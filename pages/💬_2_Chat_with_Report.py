@@ -1,11 +1,16 @@
 import streamlit as st
 import pandas as pd
-from openai import OpenAI
-import re
-import yaml
+from agents.display_render import render_frame
+from agents.issue_index import IssueIndex
+from agents.report_query import QUERY_TOOL, run_tool_call
+from agents.row_search import RowSearchIndex
+from agents.llm_client import chat_completion, stream_chat_completion, last_call_source
+from agents.chat_memory import ChatMemory
+from agents.criteria_index import CriteriaIndex
 from utils import validate_api_key
 import json, os
 import logging
+import time
 from datetime import date
 from ui import add_footer
 
@@ -50,7 +55,7 @@ def initialize_chat_session():
     # to avoid errors, providing default/empty values if necessary.
     keys_to_check = [
         'assessment_done', 'api_key_validated', 'api_key', 'criteria_content',
-        'assessed_df', 'style_guide', 'vertical', 'ai_model', 'full_report'
+        'results', 'style_guide', 'vertical', 'ai_model', 'full_report'
     ]
     for key in keys_to_check:
         if key not in st.session_state:
@@ -58,24 +63,25 @@ def initialize_chat_session():
 
 initialize_chat_session()
 
-# --- Parse criteria .yaml ---
-@st.cache_data
-def parse_criteria_yaml(yaml_content):
-    """Parses a YAML string and extracts the overview and instructions."""
+# Rows retrieved into the prompt per question
+CONTEXT_ROWS = 40
+# Rounds of local query_assessment calls allowed before the model must answer
+MAX_TOOL_ROUNDS = 3
+
+# Criteria passages sent with each question
+CRITERIA_PASSAGES = 3
+
+# --- Index criteria .yaml (once per document, shared by every session) ---
+@st.cache_resource
+def load_criteria_index(yaml_content):
+    """Parses the criteria YAML into a passage index; None when missing or malformed."""
     if not yaml_content:
-        return {}
+        return None
     try:
-        data = yaml.safe_load(yaml_content)
-        # Flatten the YAML data into a simpler dictionary for the chatbot
-        criteria_dict = {}
-        for key, value in data.items():
-            if isinstance(value, dict):
-                criteria_dict[key.replace('_', ' ').title()] = value.get('overview', '') + '\n\n' + value.get('instructions', '')
-        return criteria_dict
-
+        return CriteriaIndex.build(yaml_content)
     except Exception as e:
         st.error(f"Failed to parse the criteria document. Error: {e}")
-        return {}
+        return None
 
 
 # --- Main Page UI ---
@@ -97,10 +103,10 @@ if not st.session_state.get('api_key_validated'):
 
 # --- Load and Display Criteria Status ---
 # Pass the YAML string from session state to the parsing function
-assessment_criteria_dict = parse_criteria_yaml(st.session_state.get('criteria_content'))
+criteria_index = load_criteria_index(st.session_state.get('criteria_content'))
 
 
-if assessment_criteria_dict:
+if criteria_index and criteria_index.passages:
     st.info("✅ Assessment criteria document is loaded and ready for questions.")
 else:
     st.warning("⚠️ Assessment criteria document not uploaded. The chatbot will have limited knowledge of specific rules.")
@@ -118,111 +124,152 @@ for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
+def log_chat_call(agent, model, usage, started):
+    if 'api_tracker' in st.session_state:
+        st.session_state.api_tracker.log_call(
+            endpoint="chat.completions", model=model, usage=usage, agent=agent,
+            latency_s=time.perf_counter() - started, items=1, cache_status=last_call_source(),
+        )
+
+
+def static_system_prompt():
+    """
+    Instructions, full report and style guide: identical on every turn of a run, so it forms a
+    stable prompt prefix the API can serve from its prompt cache. Per-question context goes last.
+    """
+    style_guide = st.session_state.get("style_guide") or "No style guide provided."
+    vertical = st.session_state.get("vertical") or "this vertical"
+    full_report_context = "No full report available."
+    if st.session_state.get('full_report'):
+        full_report_context = json.dumps(st.session_state.full_report, indent=2)
+    return {
+        "role": "system",
+        "content": f"""
+You are a data analyst assistant. Your task is to answer the user's question based *only* on the provided context.
+Use all available information to provide a detailed and comprehensive response.
+For any count, total, rate or breakdown, call the query_assessment tool: it runs over the full catalog and
+its numbers are exact. The data context rows sent with each question are only examples.
+
+--- FULL ASSESSMENT REPORT ---
+{full_report_context}
+
+--- STYLE GUIDE for {vertical} ---
+{style_guide}
+"""
+    }
+
+
+if "chat_memory" not in st.session_state or st.session_state.chat_memory is None:
+    st.session_state.chat_memory = ChatMemory()
+
 if prompt := st.chat_input("Ask about your assessment results or the rules..."):
     st.session_state.messages.append({"role": "user", "content": prompt})
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    with st.spinner("Thinking..."):
-        try:
-            client = OpenAI(api_key=st.session_state.api_key)
-
-            # --- Build Context for the AI ---
-            # 1. Create a sample of the main data
-            if st.session_state.assessed_df is not None and not st.session_state.assessed_df.empty:
-                sample_size = min(500, len(st.session_state.assessed_df))
-                context_df_sample = st.session_state.assessed_df.sample(n=sample_size)
+    chat_model = st.session_state.get("ai_model", "gpt-4o")
+    try:
+        # --- Build Context for the AI ---
+        with st.spinner("Finding the relevant rows..."):
+            # 1. Retrieve the rows the question is about, plus aggregates over every match
+            assessed_df = st.session_state.results.frame("assessed") if st.session_state.results else None
+            if assessed_df is not None and not assessed_df.empty:
+                if st.session_state.get("row_search") is None:
+                    if st.session_state.get("issue_index") is None:
+                        st.session_state.issue_index = IssueIndex.build(assessed_df)
+                    st.session_state.row_search = RowSearchIndex.build(assessed_df, st.session_state.issue_index)
+                hits = st.session_state.row_search.search(prompt, k=CONTEXT_ROWS)
+                sample_size = len(hits["rows"])
 
                 context_cols = [
                     'MSID', 'BRAND_NAME', 'CONSUMER_FACING_ITEM_NAME',
                     'Taxonomy Path', 'Item Name Rule Issues',
                     'AI Item Name Assessment', 'CategoryIssues?'
-                ]
-                existing_cols = [col for col in context_cols if col in context_df_sample.columns]
-                sanitized_df = context_df_sample[existing_cols].copy()
+                ] + list(hits["aggregates"].get("issues", {}))
+                sanitized_df = render_frame(assessed_df, list(dict.fromkeys(context_cols)), rows=hits["rows"])
 
                 # Sanitize text to prevent encoding errors
-                def sanitize_text(text):
-                    if isinstance(text, str):
-                        return text.encode('ascii', 'ignore').decode('ascii')
-                    return text
-
                 for col in sanitized_df.columns:
-                    if sanitized_df[col].dtype == 'object':
-                        sanitized_df[col] = sanitized_df[col].apply(sanitize_text)
-
-                data_context = sanitized_df.to_string()
+                    sanitized_df[col] = sanitized_df[col].str.encode('ascii', 'ignore').str.decode('ascii')
+
+                if hits["fallback"]:
+                    data_description = f"no rows matched the question's words; {sample_size} rows sampled across issue types"
+                else:
+                    data_description = f"the {sample_size} best-matching of {hits['matched']:,} rows that share a word with the question"
+                data_context = (
+                    f"Aggregates over those {hits['aggregates']['rows']:,} rows: {json.dumps(hits['aggregates'])}\n\n"
+                    + sanitized_df.to_csv(index=False)
+                )
             else:
                 data_context = "No assessed data available."
-                sample_size = 0
+                data_description = "none"
 
-            # 2. Find the best-matching criteria based on the user's prompt
+            # 2. Pull the criteria passages that best match the user's prompt
             relevant_criteria = "No specific criteria found for this topic in the document."
-            if assessment_criteria_dict:
-                best_match_key = None
-                max_match_count = 0
-                prompt_words = set(prompt.lower().split())
-
-                for key, content in assessment_criteria_dict.items():
-                    key_words = set(key.lower().split())
-                    match_count = len(prompt_words.intersection(key_words))
-
-                    if match_count > max_match_count:
-                        max_match_count = match_count
-                        best_match_key = key
-
-                if best_match_key:
-                    relevant_criteria = f"--- Relevant Assessment Criteria for '{best_match_key}' ---\n{assessment_criteria_dict[best_match_key]}"
-
-            # 3. Get style guide and vertical info
-            style_guide = st.session_state.get("style_guide", "No style guide provided.")
-            vertical = st.session_state.get("vertical", "this vertical")
-
-            # 4. Get the full report for detailed analysis
-            full_report_context = "No full report available."
-            if st.session_state.get('full_report'):
-                full_report_context = json.dumps(st.session_state.full_report, indent=2)
-
-            # 5. Construct the full system prompt with all available context
-            system_prompt = {
-                "role": "system",
-                "content": f"""
-You are a data analyst assistant. Your task is to answer the user's question based *only* on the provided context.
-Use all available information to provide a detailed and comprehensive response.
-
---- FULL ASSESSMENT REPORT ---
-{full_report_context}
-
---- RELEVANT ASSESSMENT CRITERIA ---
+            passages = criteria_index.search(prompt, k=CRITERIA_PASSAGES) if criteria_index else []
+            if passages:
+                relevant_criteria = "\n\n".join(p.render() for p in passages)
+
+        # 3. Keep the history within budget: fold older turns into the rolling digest
+        memory = st.session_state.chat_memory
+        folded = memory.turns_to_fold(st.session_state.messages[:-1], chat_model)
+        if folded:
+            with st.spinner("Summarizing the earlier conversation..."):
+                started = time.perf_counter()
+                digest_params = memory.digest_request(folded)
+                response = chat_completion(st.session_state.api_key, digest_params)
+                log_chat_call("Chat digest", digest_params["model"], response.usage.model_dump() if response.usage else None, started)
+                memory.fold(folded, response.choices[0].message.content or "")
+
+        # 4. Stable prefix first, then history, then this question with its own context
+        question = {
+            "role": "user",
+            "content": f"""--- RELEVANT ASSESSMENT CRITERIA ---
 {relevant_criteria}
 
---- STYLE GUIDE for {vertical} ---
-{style_guide}
-
---- DATA CONTEXT (a random sample of {sample_size} rows) ---
+--- DATA CONTEXT ({data_description}) ---
 {data_context}
-"""
-            }
 
-            messages_to_send = [system_prompt] + st.session_state.messages
-            
-            # New log message to confirm the selected model
-            st.info(f"Using AI model: **{st.session_state.get('ai_model', 'gpt-4o')}**")
+--- QUESTION ---
+{prompt}"""
+        }
+        messages_to_send = ([static_system_prompt()]
+                            + memory.history(st.session_state.messages[:-1], chat_model)
+                            + [question])
+
+        st.caption(f"Using AI model: **{chat_model}**")
+
+        # --- Call OpenAI API (streamed) ---
+        tools = [QUERY_TOOL] if assessed_df is not None and not assessed_df.empty else None
+        queries_run = []
+        with st.chat_message("assistant"):
+            for round_no in range(MAX_TOOL_ROUNDS + 1):
+                params = {"model": chat_model, "messages": messages_to_send}
+                if tools and round_no < MAX_TOOL_ROUNDS:
+                    params["tools"] = tools
+                started = time.perf_counter()
+                reply = stream_chat_completion(st.session_state.api_key, params)
+                st.write_stream(reply.text())
+                log_chat_call("Chat", chat_model, reply.usage, started)
+                if not reply.tool_calls:
+                    break
+                # Aggregate questions: run the model's queries locally and send back only the counts
+                messages_to_send = messages_to_send + [reply.message()]
+                for call in reply.message()["tool_calls"]:
+                    arguments = call["function"]["arguments"]
+                    result = run_tool_call(assessed_df, st.session_state.issue_index, arguments)
+                    queries_run.append((arguments, result))
+                    messages_to_send.append({"role": "tool", "tool_call_id": call["id"], "content": result})
+            if queries_run:
+                with st.expander(f"🔎 {len(queries_run)} local quer{'y' if len(queries_run) == 1 else 'ies'} run"):
+                    for arguments, result in queries_run:
+                        st.code(f"{arguments}\n→ {result}", language="json")
+
+        bot_response = reply.content
+        st.session_state.messages.append({"role": "assistant", "content": bot_response})
 
-            # --- Call OpenAI API ---
-            response = client.chat.completions.create(
-                model=st.session_state.get("ai_model", "gpt-4o"),
-                messages=messages_to_send
-            )
-
-            bot_response = response.choices[0].message.content
-
-            st.session_state.messages.append({"role": "assistant", "content": bot_response})
-            with st.chat_message("assistant"):
-                st.markdown(bot_response)
-
-        except Exception as e:
-            st.error(f"An error occurred while communicating with the AI: {e}")
+    except Exception as e:
+        st.error(f"An error occurred while communicating with the AI: {e}")
 
 # call once near the end of each page:
 add_footer()
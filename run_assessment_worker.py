@@ -0,0 +1,168 @@
+"""
+Background worker for assessment jobs queued by the Streamlit app.
+
+    python run_assessment_worker.py                    # run queued jobs until stopped
+    python run_assessment_worker.py --once             # run what is queued, then exit
+    python run_assessment_worker.py --max-parallel 4   # up to 4 merchants at once
+
+Each job runs in its own process, so a crash or a cancelled job never takes the worker
+(or another job) down, and agents' per-run state stays separate. Progress and results go
+to the job folder and queue database, where the app reads them. The app starts a worker
+itself when none is running.
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+import traceback
+from typing import Dict
+
+from agents.job_queue import DEFAULT_JOBS_DIR, DEFAULT_MAX_PARALLEL, JobQueue, worker_command
+
+POLL_INTERVAL_S = 1.0
+PURGE_INTERVAL_S = 3600
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def run_job(queue: JobQueue, job_id: str) -> int:
+    """Runs one claimed job in this process and saves its results; returns the exit code."""
+    # Only job processes load Streamlit and the agents
+    import streamlit as st
+    from agents.agent_manifest import agent_manifest, load_agents, wanted_agents
+    from agents.api_tracker import ApiUsageTracker
+    from agents.assessment_pipeline import read_merchant_file, run_assessment, save_result
+    from agents.run_profiler import RunProfiler
+    from agents.taxonomy import load_taxonomy
+
+    job = queue.get(job_id)
+    if job is None or job.status != "running":
+        logging.error(f"Job {job_id} is not running; nothing to do.")
+        return 1
+    log_handler = logging.FileHandler(os.path.join(queue.job_dir(job_id), "job.log"))
+    log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logging.getLogger().addHandler(log_handler)
+
+    settings = dict(job.settings)
+    # Only the submitting session's key: a job sent without one runs the rule checks alone, as it
+    # would inline, rather than making paid calls on the server's key
+    settings["api_key"] = queue.pop_api_key(job_id)
+    if not settings["api_key"]:
+        settings["api_key_validated"] = False
+    try:
+        with open(queue.input_path(job), "rb") as f:
+            df = read_merchant_file(f.read(), job.file_name)
+        if df is None:
+            raise ValueError("Failed to load or process the data file. Please check the file format and content.")
+        settings["taxonomy_df"] = load_taxonomy()
+
+        # Agents log usage to the session; outside `streamlit run` it is a plain per-process dict
+        tracker = ApiUsageTracker()
+        st.session_state.api_tracker = tracker
+        specs = wanted_agents(agent_manifest(), api_key_validated=bool(settings.get("api_key_validated")),
+                              is_nexla=bool(settings.get("is_nexla")))
+        agents, errors = load_agents(specs)
+        for module, error in errors.items():
+            queue.add_event(job_id, 0, 0, f"Error loading {module}: {error}")
+
+        profiler = RunProfiler(
+            profile_mode=settings.get("profile_mode") or "off", trace_memory=bool(settings.get("trace_memory")),
+            metadata={"file": job.file_name, "vertical": settings.get("vertical"), "model": settings.get("agent_model"),
+                      "cascade": settings.get("use_model_cascade"), "job": job_id},
+        )
+        result = run_assessment(agents, df, settings, tracker,
+                                progress=lambda step, total, message: queue.add_event(job_id, step, total, message),
+                                profiler=profiler)
+        result.manifest = profiler.write_manifest({"rows": len(result.df), **tracker.run_stats()})
+        save_result(result, tracker, queue.results_dir(job_id), bool(settings.get("is_nexla")))
+        queue.finish(job_id)
+        return 0
+    except Exception as e:
+        logging.error(f"Job {job_id} failed:\n{traceback.format_exc()}")
+        queue.fail(job_id, f"{type(e).__name__}: {e}")
+        return 1
+
+
+def supervise(queue: JobQueue, max_parallel: int, once: bool, idle_exit_s: float) -> int:
+    """Claims queued jobs and runs up to `max_parallel` of them at once, each in a child process."""
+    pid = os.getpid()
+    if not queue.register_worker(pid, max_parallel):
+        print(f"❌ Another worker is already running for {queue.jobs_dir}.")
+        return 1
+    orphaned = queue.fail_orphaned()
+    if orphaned:
+        logging.warning(f"Marked {orphaned} job(s) left running by a previous worker as failed.")
+    print(f"✅ Worker {pid} running up to {max_parallel} job(s) at once from {queue.jobs_dir}")
+
+    children: Dict[str, subprocess.Popen] = {}
+    idle_since = time.monotonic()
+    last_purge = 0.0
+    try:
+        while True:
+            queue.heartbeat(pid, max_parallel)
+            if time.monotonic() - last_purge > PURGE_INTERVAL_S:
+                queue.purge_finished()
+                last_purge = time.monotonic()
+
+            for job_id, proc in list(children.items()):
+                if proc.poll() is None:
+                    continue
+                del children[job_id]
+                job = queue.get(job_id)
+                if job is not None and job.status == "running":
+                    queue.fail(job_id, f"The job process exited unexpectedly (code {proc.returncode}).")
+
+            for job in queue.running_jobs():
+                if job.cancel_requested and job.id in children:
+                    proc = children.pop(job.id)
+                    proc.terminate()
+                    proc.wait(timeout=30)
+                    queue.fail(job.id, "Cancelled.", status="cancelled")
+
+            while len(children) < max_parallel:
+                job = queue.claim_next(pid)
+                if job is None:
+                    break
+                children[job.id] = subprocess.Popen(worker_command("--jobs-dir", queue.jobs_dir, "--run-job", job.id))
+                queue.set_worker_pid(job.id, children[job.id].pid)
+                logging.info(f"Started job {job.id} ({job.file_name}) in process {children[job.id].pid}.")
+
+            if children:
+                idle_since = time.monotonic()
+            elif once:
+                return 0
+            elif idle_exit_s and time.monotonic() - idle_since > idle_exit_s:
+                logging.info(f"No jobs for {idle_exit_s:.0f}s; worker exiting.")
+                return 0
+            time.sleep(POLL_INTERVAL_S)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        for job_id, proc in children.items():
+            proc.terminate()
+            proc.wait(timeout=30)
+            queue.fail(job_id, "The worker stopped before the job finished; submit it again.")
+        queue.remove_worker(pid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run assessment jobs queued by the app in the background.")
+    parser.add_argument("--jobs-dir", default=DEFAULT_JOBS_DIR, help="Queue database and job folders")
+    parser.add_argument("--max-parallel", type=int, default=DEFAULT_MAX_PARALLEL,
+                        help="Jobs (merchants) to run at once, each in its own process")
+    parser.add_argument("--once", action="store_true", help="Run the queued jobs, then exit")
+    parser.add_argument("--idle-exit", type=float, default=0.0,
+                        help="Exit after this many seconds with nothing to do (0 = keep running)")
+    parser.add_argument("--run-job", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    queue = JobQueue(args.jobs_dir)
+    if args.run_job:
+        sys.exit(run_job(queue, args.run_job))
+    sys.exit(supervise(queue, max(1, args.max_parallel), args.once, args.idle_exit))
+
+
+if __name__ == "__main__":
+    main()
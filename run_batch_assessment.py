@@ -0,0 +1,87 @@
+import argparse
+import json
+import logging
+import os
+
+import streamlit as st
+from dotenv import load_dotenv
+
+from agents.agent_manifest import agent_manifest, load_agents, wanted_agents
+from agents.api_tracker import ApiUsageTracker
+from agents.assessment_pipeline import read_merchant_file, run_pipeline
+from agents.display_render import readable_column_order
+from agents.llm_batch_jobs import run_with_batch_api
+from agents.llm_cache import DEFAULT_CACHE_DIR, ResponseCache
+from agents.style_guide import DEFAULT_STYLE_GUIDES
+from agents.taxonomy import load_taxonomy
+
+# Load API key from .env
+load_dotenv()
+api_key = os.getenv("OPENAI_API_KEY")
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def build_pipeline(df, args):
+    """The app's agents and pipeline (agents/assessment_pipeline.py); returns a callable for batch mode."""
+    settings = {
+        "vertical": args.vertical, "is_nexla": args.nexla,
+        "style_guide": args.style_guide or DEFAULT_STYLE_GUIDES.get(args.vertical, ""),
+        "agent_model": args.model, "use_model_cascade": not args.no_cascade,
+        # The website sample is unseeded, so its prompt would differ on every batch pass
+        "website_url": None,
+        "api_key_validated": True, "api_key": api_key, "taxonomy_df": load_taxonomy(args.taxonomy),
+    }
+    agents, errors = load_agents(wanted_agents(agent_manifest(), api_key_validated=True, is_nexla=args.nexla))
+    for module, error in errors.items():
+        logging.error(f"Error loading {module}: {error}")
+    # Agents log usage to the session; outside `streamlit run` it is a plain per-process dict
+    st.session_state.api_tracker = ApiUsageTracker()
+
+    def run():
+        return run_pipeline(agents, df.copy(), settings)
+
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the LLM agents through the OpenAI Batch API (offline/nightly mode).")
+    parser.add_argument("--input", "-i", required=True, help="Path to the merchant CSV or Excel file")
+    parser.add_argument("--output", "-o", required=True, help="Path to save the assessed CSV")
+    parser.add_argument("--report", "-r", help="Optional path to save the Master Reporting JSON")
+    parser.add_argument("--vertical", default="CnG")
+    parser.add_argument("--style-guide", default="", help="Defaults to the vertical's built-in style guide")
+    parser.add_argument("--nexla", action="store_true", help="Merchant is Nexla-enabled")
+    parser.add_argument("--model", default="gpt-5-chat-latest")
+    parser.add_argument("--no-cascade", action="store_true", help="Send every request to --model (no cheap-model-first cascade)")
+    parser.add_argument("--taxonomy", default="taxonomy.json", help="taxonomy.json or a CSV of taxonomy rows")
+    parser.add_argument("--workdir", default="batch_jobs", help="Where batch JSONL files are written")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Response cache shared across runs")
+    parser.add_argument("--max-rounds", type=int, default=4, help="Batch jobs to run before giving up on stragglers")
+    parser.add_argument("--poll-max-delay", type=float, default=300.0, help="Upper bound for the polling backoff (s)")
+    args = parser.parse_args()
+
+    with open(args.input, "rb") as f:
+        df = read_merchant_file(f.read(), args.input)
+    if df is None:
+        print(f"❌ ERROR: Could not read {args.input} (CSV or Excel expected).")
+        return
+    result = run_with_batch_api(
+        build_pipeline(df, args),
+        api_key,
+        workdir=args.workdir,
+        cache=ResponseCache(args.cache_dir),
+        max_rounds=args.max_rounds,
+        poll_max_delay=args.poll_max_delay,
+    )
+
+    result.df[readable_column_order(result.df.columns, args.nexla)].to_csv(args.output, index=False)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(result.full_report, f, indent=2, ensure_ascii=False, default=str)
+    print(f"✅ Done! Results written to {args.output}")
+
+if __name__ == "__main__":
+    if not api_key:
+        print("❌ ERROR: OPENAI_API_KEY not found in .env. Please add it.")
+    else:
+        main()
@@ -0,0 +1,156 @@
+"""
+Local stand-in for the OpenAI Files + Batches endpoints, for exercising batch mode offline.
+
+    python scripts/batch_stub_server.py --port 8787 --content '{}'
+    OPENAI_BASE_URL=http://127.0.0.1:8787/v1 OPENAI_API_KEY=stub python run_batch_assessment.py -i data.csv -o out.csv
+
+Every request in an uploaded batch is answered with a chat completion whose message is
+`--content` (JSON text). Batches complete `--delay` seconds after they are created.
+"""
+import argparse
+import email
+import email.policy
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_ids = itertools.count(1)
+_lock = threading.Lock()
+FILES = {}
+BATCHES = {}
+
+
+def _new_id(prefix: str) -> str:
+    return f"{prefix}-stub{next(_ids)}"
+
+
+def _file_object(file_id: str) -> dict:
+    f = FILES[file_id]
+    return {
+        "id": file_id, "object": "file", "bytes": len(f["content"]), "created_at": f["created_at"],
+        "filename": f["filename"], "purpose": f["purpose"], "status": "processed",
+    }
+
+
+def _completion(request: dict, content: str) -> dict:
+    body = request.get("body", {})
+    prompt_chars = sum(len(str(m.get("content", ""))) for m in body.get("messages", []))
+    usage = {"prompt_tokens": prompt_chars // 4 + 1, "completion_tokens": len(content) // 4 + 1}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    return {
+        "id": _new_id("chatcmpl"), "object": "chat.completion", "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0, "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content},
+        }],
+        "usage": usage,
+    }
+
+
+def _advance(batch: dict, delay: float, content: str) -> None:
+    """Completes a batch once its delay has passed, writing the output file."""
+    if batch["status"] != "in_progress" or time.time() - batch["created_at"] < delay:
+        return
+    lines = [l for l in FILES[batch["input_file_id"]]["content"].decode("utf-8").splitlines() if l.strip()]
+    out = []
+    for line in lines:
+        request = json.loads(line)
+        out.append(json.dumps({
+            "id": _new_id("batch_req"), "custom_id": request["custom_id"],
+            "response": {"status_code": 200, "request_id": _new_id("req"), "body": _completion(request, content)},
+            "error": None,
+        }))
+    output_id = _new_id("file")
+    FILES[output_id] = {
+        "content": ("\n".join(out) + "\n").encode("utf-8"), "filename": "output.jsonl",
+        "purpose": "batch_output", "created_at": int(time.time()),
+    }
+    batch.update({
+        "status": "completed", "output_file_id": output_id, "completed_at": int(time.time()),
+        "request_counts": {"total": len(lines), "completed": len(lines), "failed": 0},
+    })
+
+
+class Handler(BaseHTTPRequestHandler):
+    delay = 2.0
+    content = "{}"
+
+    def _send(self, status: int, payload, raw: bool = False):
+        body = payload if raw else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream" if raw else "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        if self.path.rstrip("/") == "/v1/files":
+            # Parse the multipart upload with the stdlib email parser
+            header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+            message = email.message_from_bytes(header + self._body(), policy=email.policy.HTTP)
+            fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+            upload = fields["file"]
+            file_id = _new_id("file")
+            with _lock:
+                FILES[file_id] = {
+                    "content": upload.get_payload(decode=True), "filename": upload.get_filename() or "upload.jsonl",
+                    "purpose": fields["purpose"].get_content().strip() if "purpose" in fields else "batch",
+                    "created_at": int(time.time()),
+                }
+            return self._send(200, _file_object(file_id))
+
+        if self.path.rstrip("/") == "/v1/batches":
+            req = json.loads(self._body() or b"{}")
+            if req.get("input_file_id") not in FILES:
+                return self._send(400, {"error": {"message": "Unknown input_file_id"}})
+            batch_id = _new_id("batch")
+            with _lock:
+                BATCHES[batch_id] = {
+                    "id": batch_id, "object": "batch", "endpoint": req.get("endpoint"),
+                    "input_file_id": req["input_file_id"], "completion_window": req.get("completion_window", "24h"),
+                    "status": "in_progress", "created_at": int(time.time()), "metadata": req.get("metadata"),
+                    "output_file_id": None, "error_file_id": None,
+                    "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                }
+            return self._send(200, BATCHES[batch_id])
+        self._send(404, {"error": {"message": f"No route for POST {self.path}"}})
+
+    def do_GET(self):
+        match = re.fullmatch(r"/v1/batches/([\w-]+)", self.path)
+        if match and match.group(1) in BATCHES:
+            with _lock:
+                batch = BATCHES[match.group(1)]
+                _advance(batch, self.delay, self.content)
+            return self._send(200, batch)
+        match = re.fullmatch(r"/v1/files/([\w-]+)/content", self.path)
+        if match and match.group(1) in FILES:
+            return self._send(200, FILES[match.group(1)]["content"], raw=True)
+        self._send(404, {"error": {"message": f"No route for GET {self.path}"}})
+
+    def log_message(self, fmt, *args):
+        print(f"[batch-stub] {fmt % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI Batch API.")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--delay", type=float, default=2.0, help="Seconds before a batch completes")
+    parser.add_argument("--content", default="{}", help="Assistant message returned for every request")
+    args = parser.parse_args()
+
+    Handler.delay = args.delay
+    Handler.content = args.content
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    print(f"Batch stub listening on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Regression checks for the review-file sampler (IssueIndex.sample).
+
+    python scripts/check_review_sampler.py
+
+Builds synthetic assessed frames and checks that samples are made of flagged rows
+whenever there are enough of them, even when the issues sit in a few categories,
+and that picks still spread across the categories that hold issues. Exits 1 on failure.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from agents.issue_index import IssueIndex  # noqa: E402
+
+
+def catalog(rows, categories, flagged_rows):
+    """`rows` rows over `categories` L1 values with UPCIssues? ❌ on `flagged_rows`."""
+    df = pd.DataFrame({
+        "MSID": [str(i) for i in range(rows)],
+        "L1_CATEGORY": [f"Category {i % categories}" for i in range(rows)],
+        "UPCIssues?": "",
+    })
+    df.loc[flagged_rows, "UPCIssues?"] = "❌ Invalid check digit"
+    return df
+
+
+def check_concentrated_issues():
+    """1,000 flagged rows in 2 of 20 categories: a 30-row sample is all flagged rows, from both."""
+    flagged = [i for i in range(10_000) if i % 20 in (3, 7)][:1_000]
+    df = catalog(10_000, 20, flagged)
+    rows = IssueIndex.build(df).sample(30, issue_columns=["UPCIssues?"])
+    picked = df.iloc[rows]
+    flagged_picks = int((picked["UPCIssues?"] != "").sum())
+    spread = picked.loc[picked["UPCIssues?"] != "", "L1_CATEGORY"].value_counts()
+    ok = len(rows) == 30 and flagged_picks == 30 and len(spread) == 2 and spread.min() >= 10
+    return ok, f"{flagged_picks}/30 flagged, per category {spread.to_dict()}"
+
+
+def check_spread_issues():
+    """Flagged rows in 4 of 20 categories: no category gets more than its share."""
+    df = catalog(10_000, 20, list(range(0, 10_000, 5)))
+    rows = IssueIndex.build(df).sample(40, issue_columns=["UPCIssues?"])
+    picked = df.iloc[rows]
+    per_category = picked["L1_CATEGORY"].value_counts()
+    ok = int((picked["UPCIssues?"] != "").sum()) == 40 and per_category.max() <= int(np.ceil(40 / 4))
+    return ok, f"{len(per_category)} categories, at most {per_category.max()} rows each"
+
+
+def check_few_flagged():
+    """Fewer flagged rows than asked for: all of them, topped up with clean rows."""
+    df = catalog(1_000, 10, [5, 50, 500])
+    rows = IssueIndex.build(df).sample(20, issue_columns=["UPCIssues?"])
+    flagged_picks = int((df.iloc[rows]["UPCIssues?"] != "").sum())
+    return len(rows) == 20 and flagged_picks == 3, f"{flagged_picks}/3 flagged rows in a 20-row sample"
+
+
+def main():
+    failed = 0
+    for check in (check_concentrated_issues, check_spread_issues, check_few_flagged):
+        ok, detail = check()
+        print(f"{'✅' if ok else '❌'} {check.__doc__.strip()} ({detail})")
+        failed += not ok
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Import-time profile of the app's cold start, checked against a budget.
+
+    python scripts/profile_startup.py             # imports of the first page, slowest first
+    python scripts/profile_startup.py --serve     # also time app_entry.py until it prints APP_READY
+
+Imports run in a fresh interpreter with `-X importtime`, so nothing is cached from this
+process. Exits 1 when the cold start is over COLD_START_BUDGET_S or a deferred dependency
+(openai, docx, tqdm, requests, yaml) is imported at startup again.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from agents.startup import COLD_START_BUDGET_S, READY_MARKER, startup_imports  # noqa: E402
+
+# Loaded on first use only; importing one of these at startup is a regression
+DEFERRED_MODULES = ("openai", "docx", "tqdm", "requests", "yaml")
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| *(\S+)")
+
+
+def profile_imports(modules):
+    """(total seconds, [(module, self_s, cumulative_s)] for every module imported) in a fresh interpreter."""
+    code = "; ".join(f"import {m}" for m in modules)
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=APP_DIR,
+                          capture_output=True, text=True)
+    total = time.perf_counter() - started
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((m.group(3), int(m.group(1)) / 1e6, int(m.group(2)) / 1e6))
+    return total, rows
+
+
+def time_to_ready(timeout_s):
+    """Seconds until app_entry.py prints its ready marker (None on timeout)."""
+    env = {**os.environ, "STREAMLIT_SERVER_PORT": os.getenv("STREAMLIT_SERVER_PORT", "8599")}
+    started = time.monotonic()
+    proc = subprocess.Popen([sys.executable, os.path.join(APP_DIR, "app_entry.py")], cwd=APP_DIR, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        for line in proc.stdout:
+            if line.startswith(READY_MARKER):
+                return time.monotonic() - started
+            if time.monotonic() - started > timeout_s:
+                break
+        return None
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the app's cold-start imports against a budget.")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    parser.add_argument("--budget", type=float, default=COLD_START_BUDGET_S, help="Cold-start budget in seconds")
+    parser.add_argument("--serve", action="store_true", help="Also start app_entry.py and time it until ready")
+    args = parser.parse_args()
+
+    modules = startup_imports()
+    total, rows = profile_imports(modules)
+    print(f"Startup imports ({len(modules)} modules from the first page): {total:.2f}s")
+    for name, self_s, cumulative_s in sorted(rows, key=lambda r: -r[2])[:args.top]:
+        print(f"  {cumulative_s:7.3f}s  (self {self_s:6.3f}s)  {name}")
+
+    ok = True
+    loaded = {name.split('.')[0] for name, *_ in rows}
+    eager = [m for m in DEFERRED_MODULES if m in loaded]
+    if eager:
+        ok = False
+        print(f"❌ Deferred dependencies imported at startup: {', '.join(eager)}")
+    elapsed = total
+    if args.serve:
+        ready_s = time_to_ready(timeout_s=max(60.0, args.budget * 4))
+        if ready_s is None:
+            print("❌ The app never signalled ready.")
+            sys.exit(1)
+        print(f"Time to {READY_MARKER}: {ready_s:.2f}s")
+        elapsed = ready_s
+    if elapsed > args.budget:
+        ok = False
+        print(f"❌ Cold start {elapsed:.2f}s is over the {args.budget:.1f}s budget.")
+    if ok:
+        print(f"✅ Cold start {elapsed:.2f}s is within the {args.budget:.1f}s budget.")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,24 @@
 import streamlit as st
 import pandas as pd
 import os
-import importlib
-import inspect
 import logging
-from io import BytesIO
+import uuid
+from datetime import datetime
 from utils import validate_api_key
+from agents.agent_manifest import agent_manifest, load_agents, wanted_agents
 from agents.api_tracker import ApiUsageTracker
+from agents.assessment_pipeline import (RUN_SETTINGS, configure_agent, load_result, read_merchant_file,
+                                        result_frame_paths, run_assessment)
+from agents.job_queue import JobQueue, start_worker
+from agents.run_planner import estimate_run
+from agents.display_render import readable_column_order, render_frame
+from agents.issue_index import IssueIndex
+from agents.result_store import ResultStore, purge_stale_results
+from agents.row_search import RowSearchIndex
+from agents.run_profiler import PROFILE_MODES, RunProfiler, compare_steps, load_manifests
+from agents.style_guide import DEFAULT_STYLE_GUIDES
+from agents.taxonomy import DEFAULT_TAXONOMY_PATH, load_taxonomy
 import json
-import yaml
 import numpy as np
 import re
 import nest_asyncio
@@ -133,11 +143,15 @@ default_session_state = {
     "website_url": "", "uploaded_file_content": None, "uploaded_file_name": "",
     "taxonomy_df": None, "criteria_content": None, "vertical": "CnG",
     "is_nexla": False, "style_guide": "", "last_vertical": "",
-    "assessed_df": None, "summary_df": None, "full_report": None,
+    "results": None, "issue_index": None, "row_search": None, "summary_df": None, "full_report": None,
     "website_comparison_report": None, "final_summary": None,
-    "assessed_csv": None, "sample_30_csv": None, "sample_50_csv": None,
     "assessment_done": False,
-    "agent_model": "gpt-5-chat-latest"
+    "agent_model": "gpt-5-chat-latest",
+    "use_model_cascade": True,
+    "budget_usd": 0.0, "budget_tokens": 0, "budget_minutes": 0.0, "budget_status": None,
+    "run_estimate": None,
+    "profile_mode": "off", "trace_memory": False, "run_manifest": None, "previous_manifest": None,
+    "run_in_background": False, "active_job": None, "open_job_id": None, "job_owner": None
 }
 for key, val in default_session_state.items():
     if key not in st.session_state:
@@ -146,25 +160,34 @@ for key, val in default_session_state.items():
 if 'api_tracker' not in st.session_state:
     st.session_state.api_tracker = ApiUsageTracker()
 
+# Background jobs belong to the session that submitted them; the owner token rides in the URL
+# (next to the job id) so a reload or a bookmarked link still reaches them
+st.session_state.job_owner = st.query_params.get("owner") or st.session_state.job_owner or uuid.uuid4().hex
+
 # --- Caching Functions ---
 @st.cache_resource
-def discover_agents():
-    """Discovers and loads agent modules from the 'agents' directory."""
-    agents = []
-    agent_folder = 'agents'
-    if not os.path.isdir(agent_folder):
-        st.error(f"'{agent_folder}' directory not found.")
-        return []
-    for filename in os.listdir(agent_folder):
-        if filename.endswith('_agent.py') and filename != 'base_agent.py':
-            try:
-                module = importlib.import_module(f"{agent_folder}.{filename[:-3]}")
-                agents.append(module.Agent())
-            except Exception as e:
-                logging.error(f"Error loading agent from {filename}: {e}")
-                st.error(f"Error loading {filename}: {e}")
+def discover_agents(api_key_validated, is_nexla):
+    """Loads the agents a run with these settings uses; the manifest is read from source, so others are never imported."""
+    specs = wanted_agents(agent_manifest(), api_key_validated=api_key_validated, is_nexla=is_nexla)
+    agents, errors = load_agents(specs)
+    for module, error in errors.items():
+        st.error(f"Error loading {module}: {error}")
     return agents
 
+@st.cache_resource
+def get_taxonomy(path, mtime):
+    """Taxonomy frame, read once per file version and shared by every session (agents only read it)."""
+    taxonomy_df = load_taxonomy(path)
+    logging.info(f"Taxonomy Loaded")
+    return taxonomy_df
+
+@st.cache_data
+def load_criteria(path, mtime):
+    with open(path, 'r') as f:
+        criteria_content = f.read()
+    logging.info(f'Assessment Criteria Loaded')
+    return criteria_content
+
 @st.cache_data
 def load_and_standardize_dataframe(file_content, file_name):
     """
@@ -172,216 +195,169 @@ def load_and_standardize_dataframe(file_content, file_name):
     to ensure consistency for all downstream agents. This function is cached
     and contains no Streamlit UI elements.
     """
-    try:
-        dtype_spec = {'BUSINESS_ID': str, 'MSID': str, 'UPC': str}
-        
-        if file_name.lower().endswith('.csv'):
-            df = pd.read_csv(BytesIO(file_content), low_memory=False, dtype=dtype_spec)
-        elif file_name.lower().endswith(('.xls', '.xlsx')):
-            df = pd.read_excel(BytesIO(file_content), dtype=dtype_spec)
-        else:
-            logging.error("Unsupported file type provided.")
-            return None
-
-        # --- Column Standardization Logic ---
-        column_mapping = {
-            'merchant supplied id (msid)': 'MSID', 
-            'item name': 'CONSUMER_FACING_ITEM_NAME',
-            'brand': 'BRAND_NAME', 
-            'photo url': 'IMAGE_URL', 
-            'size': 'SIZE',
-            'unit of measure': 'UNIT_OF_MEASUREMENT', 
-            'uom': 'UNIT_OF_MEASUREMENT',
-            'l1 category': 'L1_CATEGORY', 'l2 category': 'L2_CATEGORY',
-            'l3 category': 'L3_CATEGORY', 'l4 category': 'L4_CATEGORY',
-            'product group': 'PRODUCT_GROUP', 
-            'variant': 'VARIANT', 
-            'details': 'DESCRIPTION',
-            'short_description': 'DESCRIPTION', 
-            'weighted item': 'IS_WEIGHTED_ITEM',
-            'average weight': 'AVERAGE_WEIGHT_PER_EACH', 
-            'snap': 'SNAP_ELIGIBLE', 
-            'plu': 'PLU'
-        }
-        canonical_map = {k: v for k, v in column_mapping.items()}
-        for target_name in column_mapping.values():
-            canonical_map[target_name.lower()] = target_name
-        
-        df.rename(columns=lambda c: canonical_map.get(c.strip().lower(), c), inplace=True)
-        logging.info(f"Standardized columns. New columns: {df.columns.tolist()}")
-        return df
-        
-    except Exception as e:
-        logging.error(f"Error reading and standardizing file: {e}")
-        return None
+    return read_merchant_file(file_content, file_name)
+
+@st.cache_resource
+def get_job_queue():
+    return JobQueue()
 
 # --- Helper Functions ---
-def configure_agent(agent, session):
-    mapping = {
-        'taxonomy_df': 'taxonomy_df', 'vertical': 'vertical',
-        'is_nexla_mx': 'is_nexla', 'style_guide': 'style_guide',
-    }
-    for agent_attr, session_key in mapping.items():
-        if hasattr(agent, agent_attr):
-            setattr(agent, agent_attr, session.get(session_key))
-    if hasattr(agent, 'model'):
-        setattr(agent, 'model', session.get('agent_model'))
-
-def run_assessment_pipeline(agents, df, session, progress_bar, progress_text):
-    reporting_agent = next((a for a in agents if a.attribute_name == "Master Reporting"), None)
-    website_agent = next((a for a in agents if a.attribute_name == "Website Comparison"), None)
-    final_summary_agent = next((a for a in agents if a.attribute_name == "Final Summary"), None)
-    concat_agent = next((a for a in agents if a.attribute_name == "Nexla Concatenation"), None)
-
-    EXCLUDE = {"Master Reporting", "Website Comparison", "Final Summary", "Nexla Concatenation"}
-    assessment_agents = [a for a in agents if getattr(a, "attribute_name", "").strip() not in EXCLUDE]
-    assessment_agents.sort(key=lambda a: 0 if getattr(a, "attribute_name", "").strip().lower().startswith("category") else 1)
-
-    total_steps = len(assessment_agents)
-    if session.is_nexla and concat_agent:
-        total_steps += 1
-    if reporting_agent and session.api_key_validated:
-        total_steps += 1
-    if website_agent and session.api_key_validated:
-        total_steps += 1
-    total_steps += 3 
-
-    step = 0
-    
-    # --- Centralized Data Cleaning Step for Calculations ---
-    step += 1
-    progress_text.info(f"Step {step}/{total_steps}: Standardizing data types for calculation...")
-    progress_bar.progress(min(1.0, step / total_steps))
-    
-    boolean_flags = ['IS_WEIGHTED_ITEM', 'IS_ALCOHOL', 'IS_CBD', 'SNAP_ELIGIBLE']
-    for flag_col in boolean_flags:
-        if flag_col in df.columns:
-            df[flag_col] = pd.to_numeric(df[flag_col], errors='coerce')
-    
-    logging.info("Data types standardized for all agents.")
-    
-    if session.is_nexla and concat_agent:
-        step += 1
-        progress_text.info(f"Step {step}/{total_steps}: Running Nexla Concatenation...")
-        progress_bar.progress(min(1.0, step / total_steps))
-        df = concat_agent.assess(df)
+FULL_DATA_PAGE_SIZES = [50, 100, 250, 500]
 
-    for agent in assessment_agents:
-        step += 1
-        progress_text.info(f"Step {step}/{total_steps}: Running {agent.attribute_name} Agent...")
-        progress_bar.progress(min(1.0, step / total_steps))
-        configure_agent(agent, session)
-        
-        agent_params = inspect.signature(agent.assess).parameters
-        if 'api_key' in agent_params:
-            df = agent.assess(df, api_key=session.api_key)
-        else:
-            df = agent.assess(df)
+def run_assessment_pipeline(agents, df, session, progress_bar, progress_text, profiler=None):
+    profiler = profiler or RunProfiler()
 
-    step += 1
-    progress_text.info(f"Step {step}/{total_steps}: Generating summaries...")
-    progress_bar.progress(min(1.0, step / total_steps))
-    
-    summary_data = [agent.get_summary(df) for agent in assessment_agents]
-    summary_df = pd.DataFrame(summary_data)
-    total_skus = len(df)
-    
-    summary_df['issue_count'] = pd.to_numeric(summary_df['issue_count'], errors='coerce').fillna(0)
-    summary_df['Issue Rate'] = summary_df.apply(
-        lambda row: f"{(row['issue_count'] / total_skus * 100):.2f}%" if total_skus > 0 else "0.00%", axis=1)
-    
-    summary_df.rename(columns={'name': 'Attribute', 'issue_count': 'Issues Found'}, inplace=True)
-    
-    display_cols = ['Attribute', 'Issues Found', 'Issue Rate']
-    for col in ['coverage_count', 'duplicate_count']:
-        if col in summary_df.columns:
-            display_cols.append(col)
-            
-    st.session_state.summary_df = summary_df[display_cols]
-
-    if reporting_agent and session.api_key_validated:
-        step += 1
-        progress_text.info(f"Step {step}/{total_steps}: Generating Attribute-by-Attribute Report...")
+    def progress(step, total_steps, message):
+        progress_text.info(f"Step {step}/{total_steps}: {message}")
         progress_bar.progress(min(1.0, step / total_steps))
-        st.session_state.full_report = reporting_agent.assess(df, vertical=session.vertical, api_key=session.api_key)
 
-    if website_agent and session.api_key_validated:
-        step += 1
-        progress_text.info(f"Step {step}/{total_steps}: Generating Website Comparison Report...")
-        progress_bar.progress(min(1.0, step / total_steps))
-        st.session_state.website_comparison_report = website_agent.assess(df, api_key=session.api_key, website_url=session.website_url)
-            
-    if final_summary_agent and session.api_key_validated:
-        st.session_state.final_summary = final_summary_agent.assess(st.session_state.full_report, api_key=session.api_key)
-            
-        step += 1
-        progress_text.info(f"Step {step}/{total_steps}: Preparing final report for display...")
-        progress_bar.progress(min(1.0, step / total_steps))
-    
-    # --- **FIX**: New, more robust final cleanup function for display ---
-    logging.info("Performing final cleanup of the assessed DataFrame for display.")
-    display_df = df.copy()
-
-    # Convert boolean columns to clean True/False strings for display
-    for flag_col in boolean_flags:
-        if flag_col in display_df.columns:
-            # Map 1.0 to 'True', 0.0 to 'False', and everything else (NaN) to an empty string
-            display_df[flag_col] = display_df[flag_col].apply(lambda x: 'True' if x == 1.0 else ('False' if x == 0.0 else ''))
-
-    # Convert all other columns to string type to prevent mixed-type errors
-    for col in display_df.columns:
-        if col not in boolean_flags:
-             # Fill NaNs before converting to string, and remove trailing '.0' from numbers
-             display_df[col] = display_df[col].fillna('').astype(str).replace(r'\.0$', '', regex=True)
-
-    # --- FIX: Use a more robust, column-specific method for case-insensitive 'nan' replacement ---
-    for col in display_df.select_dtypes(include=['object']).columns:
-        # Use str.replace with case=False, which is the correct method for Series objects
-        display_df[col] = display_df[col].str.replace('nan', '', case=False, regex=True)
-        
-    display_df = reorder_columns_for_readability(display_df, session.is_nexla)
-    st.session_state.assessed_df = display_df
-    # --- End of New Cleanup Step ---
-            
-    st.session_state.assessed_csv = display_df.to_csv(index=False).encode('utf-8')
-    st.session_state.sample_30_csv = generate_sample_csv(display_df, ["UPC", "IMAGE_URL", "CONSUMER_FACING_ITEM_NAME", "SIZE", "UNIT_OF_MEASUREMENT"], 30)
-    st.session_state.sample_50_csv = generate_sample_csv(display_df, ["MSID", "IMAGE_URL"], 50)
-    st.session_state.assessment_done = True
+    settings = {key: session.get(key) for key in RUN_SETTINGS + ["api_key", "taxonomy_df"]}
+    result = run_assessment(agents, df, settings, session.api_tracker, progress=progress, profiler=profiler)
+
+    # --- Results: kept typed (spilled to disk when large); display and exports render on demand ---
+    with profiler.step("Store results", kind="display", rows=len(result.df)):
+        results = ResultStore()
+        results.put_frame("assessed", result.df[readable_column_order(result.df.columns, session.is_nexla)])
+        if result.taxonomy_mapping_df is not None:
+            results.put_frame("taxonomy_mapping", result.taxonomy_mapping_df)
+    keep_results(results, {
+        "summary_df": result.summary_df, "full_report": result.full_report,
+        "website_comparison_report": result.website_comparison_report,
+        "final_summary": result.final_summary, "budget_status": result.budget_status,
+    }, profiler)
     progress_text.success("✅ Assessment complete!")
     st.balloons()
 
 
-def reorder_columns_for_readability(df, is_nexla):
-    item_group = ['CONSUMER_FACING_ITEM_NAME']
-    if is_nexla:
-        item_group.extend(['SUGGESTED_CONCATENATED_NAME', 'Item Name Rule Issues', 'Item Name Assessment'])
+def keep_results(results, reports, profiler=None):
+    """Puts a finished run (inline or a background job) in the session, with the indexes the views use."""
+    profiler = profiler or RunProfiler()
+    for key, value in reports.items():
+        st.session_state[key] = value
+    rows = len(results.frame("assessed"))
+    with profiler.step("Issue index", kind="display", rows=rows):
+        st.session_state.issue_index = IssueIndex.build(results.frame("assessed"))
+    with profiler.step("Chat index", kind="display", rows=rows):
+        st.session_state.row_search = RowSearchIndex.build(results.frame("assessed"), st.session_state.issue_index)
+    st.session_state.results = results
+    st.session_state.assessment_done = True
+
+
+def clear_results():
+    if st.session_state.results is not None:
+        st.session_state.results.clear()
+        st.session_state.results = None
+    st.session_state.assessment_done = False
+    st.session_state.open_job_id = None
+
+
+def open_job(job_id):
+    """Loads a finished background job's saved results into the session."""
+    folder = job_queue.results_dir(job_id)
+    report, tracker = load_result(folder)
+    frames = result_frame_paths(folder)
+    clear_results()
+    results = ResultStore()
+    for name in ("assessed", "taxonomy_mapping"):
+        if name in frames:
+            results.attach_frame(name, frames[name])
+    keep_results(results, {
+        "summary_df": pd.read_pickle(frames["summary"]), "full_report": report["full_report"],
+        "website_comparison_report": report["website_comparison_report"],
+        "final_summary": report["final_summary"], "budget_status": report["budget_status"],
+    })
+    st.session_state.api_tracker = tracker
+    manifest = report["manifest"]
+    st.session_state.run_manifest = manifest
+    earlier = [m for m in load_manifests(last_n=50) if manifest and m.get("run_id", "") < manifest["run_id"]]
+    st.session_state.previous_manifest = earlier[-1] if earlier else None
+    st.session_state.open_job_id = job_id
+    st.session_state.active_job = None
+
+
+@st.fragment(run_every=2)
+def job_progress(job_id):
+    """Polls a background job's progress events; loads its results once it is done."""
+    job = job_queue.get(job_id, st.session_state.job_owner)
+    if job is None:
+        st.error(f"❌ No job with id `{job_id}`.")
+        st.session_state.active_job = None
+        return
+    event = job_queue.last_event(job_id)
+    if job.status == "queued":
+        ahead = job_queue.queue_position(job_id)
+        st.info(f"⏳ Job `{job_id}` ({job.file_name}) is queued" + (f" behind {ahead} other job(s)." if ahead else "."))
+        if job_queue.live_worker() is None:
+            st.warning("No background worker is running. Start one with `python run_assessment_worker.py`.")
+    elif job.status == "running":
+        st.markdown(f'<h3><span class="spinning-gear">⚙️</span> Running job {job_id} ({job.file_name})...</h3>', unsafe_allow_html=True)
+        if event and event.total:
+            st.progress(min(1.0, event.step / event.total))
+            st.info(f"Step {event.step}/{event.total}: {event.message}")
+        st.caption("The run continues in the background worker; you can reload this page or close it and reopen the job later.")
+    elif job.status == "done":
+        open_job(job_id)
+        st.rerun()
+    elif job.status == "cancelled":
+        st.warning(f"Job `{job_id}` was cancelled.")
     else:
-        item_group.extend(['Item Name Rule Issues', 'Item Name Assessment'])
-    groups = [
-        ['BUSINESS_ID','VERTICAL', 'businessName', 'BIZID_MSID'], ['MSID', 'MSIDIssues?'], ['UPC', 'UPCIssues?'],
-        ['BRAND_NAME', 'BrandIssues?'], item_group, ['IMAGE_URL', 'ImageIssues?'],
-        ['SIZE', 'SizeIssues?'], ['UNIT_OF_MEASUREMENT', 'UNIT_OF_MEASUREMENTIssues?'],
-        ['L1_CATEGORY', 'L2_CATEGORY', 'L3_CATEGORY', 'L4_CATEGORY', 'Taxonomy Path', 'CategoryIssues?'],
-        ['IS_WEIGHTED_ITEM', 'WeightedItemIssues?', 'AVERAGE_WEIGHT_PER_EACH', 'AverageWeightIssues?', 'AVERAGE_WEIGHT_UOM'], ['PLU', 'PLUIssues?'],
-        ['IS_ALCOHOL', 'IS_CBD', 'RestrictedItemIssues?', 'ExclusionIssues?', 'ExclusionDecision'],
-        ['SNAP_ELIGIBLE', 'SNAPEligibilityIssues?'],
-        ['PRODUCT_GROUP', 'ProductGroupIssues?'],
-        ['VARIANT', 'VariantIssues?'],
-        ['ADDITIONAL_IMAGE_URLS','AuxPhotoIssues?', 'All_Aux_Photos_URLs'],
-        ['SHORT_DESCRIPTION', 'DESCRIPTION', 'DETAILS', 'DescriptionIssues?']
-    ]
-    reordered, seen = [], set()
-    for group in groups:
-        for col in group:
-            if col in df.columns and col not in seen:
-                reordered.append(col)
-                seen.add(col)
-    return df[reordered + [col for col in df.columns if col not in seen]]
-
-def generate_sample_csv(df, columns, n):
-    selected_cols = [col for col in columns if col in df.columns]
-    sample_df = df.sample(n=min(n, len(df)))[selected_cols]
-    return sample_df.to_csv(index=False).encode('utf-8')
+        st.error(f"❌ Job `{job_id}` failed: {job.error}")
+    if not job.finished and st.button("✖️ Cancel job", key=f"cancel_{job_id}"):
+        job_queue.cancel(job_id, st.session_state.job_owner)
+        st.rerun(scope="fragment")
+    if job.finished:
+        st.session_state.active_job = None
+
+
+@st.fragment
+def full_data_view(results, issue_index):
+    """One page of the assessed rows matching the filters; only that page is rendered and sent."""
+    assessed = results.frame("assessed")
+    issue_counts = issue_index.issue_counts()
+    f_col1, f_col2, f_col3, f_col4, f_col5 = st.columns(5)
+    issue_col = f_col1.selectbox(
+        "Attribute", [""] + [c for c in issue_counts if issue_counts[c]],
+        format_func=lambda c: f"{c} ({issue_counts[c]:,} ❌)" if c else "All rows")
+    issue_type = f_col2.selectbox(
+        "Issue type", [""] + [t for t, _ in issue_index.type_counts(issue_col)],
+        format_func=lambda t: t or "Any", disabled=not issue_col)
+    facet_filters = {}
+    for container, column, label in [(f_col3, 'L1_CATEGORY', "L1 category"), (f_col4, 'BRAND_NAME', "Brand"),
+                                     (f_col5, 'ExclusionDecision', "Exclusion decision")]:
+        options = [v for v, _ in issue_index.facet_counts(column, limit=5000)]
+        facet_filters[column] = container.selectbox(label, [""] + options, format_func=lambda v: v or "All",
+                                                    disabled=not options)
+
+    rows = issue_index.query(issue_col, issue_type, facet_filters)
+    filter_key = "|".join([issue_col, issue_type] + list(facet_filters.values()))
+    p_col1, p_col2, p_col3 = st.columns([1, 1, 2])
+    page_size = p_col1.selectbox("Rows per page", FULL_DATA_PAGE_SIZES, index=1)
+    pages = max(1, -(-len(rows) // page_size))
+    page = p_col2.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, value=1,
+                               key=f"full_data_page_{filter_key}_{page_size}")
+    p_col3.caption(f"{len(rows):,} of {len(assessed):,} rows match.")
+    page_rows = rows[(page - 1) * page_size: page * page_size]
+    st.dataframe(render_frame(assessed, rows=page_rows))
+    if len(rows) and len(rows) < len(assessed):
+        st.download_button("⬇️ Matching rows (.csv)",
+                           lambda: results.export_csv("assessed", rows=rows, export_name=f"filtered_{abs(hash(filter_key))}"),
+                           "assessment_filtered.csv", "text/csv", on_click="ignore")
+
+
+# Review samples: the columns reviewers check, and the issue columns the rows are picked from
+SAMPLE_ISSUE_COLUMNS = {
+    "UPC": "UPCIssues?", "MSID": "MSIDIssues?", "IMAGE_URL": "ImageIssues?",
+    "CONSUMER_FACING_ITEM_NAME": "Item Name Rule Issues", "SIZE": "SizeIssues?",
+    "UNIT_OF_MEASUREMENT": "UNIT_OF_MEASUREMENTIssues?",
+}
+
+def generate_sample_csv(results, issue_index, columns, n, export_name, seed=42):
+    """n rows stratified over the columns' issues (seeded, so a run always yields the same file)."""
+    df = results.frame("assessed")
+    issue_cols = [SAMPLE_ISSUE_COLUMNS[col] for col in columns if col in SAMPLE_ISSUE_COLUMNS]
+    selected_cols = [col for col in columns + issue_cols + ['L1_CATEGORY'] if col in df.columns]
+    rows = issue_index.sample(n, issue_columns=issue_cols, seed=seed)
+    return results.export_csv("assessed", selected_cols, rows=rows, export_name=export_name)
 
 # --- Call CSS function ---
 load_css()
@@ -403,6 +379,26 @@ with st.sidebar:
     st.session_state.agent_model = st.selectbox("Select AI Model for Agents",
         ["gpt-5-chat-latest", "gpt-4o"],
         index=["gpt-5-chat-latest", "gpt-4o"].index(st.session_state.agent_model))
+    st.session_state.use_model_cascade = st.toggle(
+        "Cheap-model-first cascade", value=st.session_state.use_model_cascade,
+        help="Item Name and Exclusion try gpt-5-mini first and escalate only unsure or malformed answers to the selected model.")
+
+    with st.expander("💰 Run budget (0 = no limit)"):
+        st.session_state.budget_usd = st.number_input(
+            "Max spend (USD)", min_value=0.0, step=1.0, value=float(st.session_state.budget_usd))
+        st.session_state.budget_tokens = st.number_input(
+            "Max tokens", min_value=0, step=100_000, value=int(st.session_state.budget_tokens))
+        st.session_state.budget_minutes = st.number_input(
+            "Max run time (minutes)", min_value=0.0, step=5.0, value=float(st.session_state.budget_minutes))
+        st.caption("When the budget (or an agent's share of it) runs out, agents fall back to their rule-based results, marked ℹ️ in the output.")
+
+    with st.expander("🩺 Diagnostics"):
+        st.session_state.profile_mode = st.selectbox(
+            "Per-step profiler", PROFILE_MODES, index=PROFILE_MODES.index(st.session_state.profile_mode),
+            help="Saves a cProfile (.prof) or pyinstrument (.html) file per agent next to the run manifest.")
+        st.session_state.trace_memory = st.toggle(
+            "Trace peak memory per step", value=st.session_state.trace_memory,
+            help="Uses tracemalloc; slows the run noticeably on large files.")
         
     st.session_state.website_url = st.text_input("Merchant Website URL", value=st.session_state.website_url)
     uploaded_file = st.file_uploader("1. Upload Merchant Data File", type=["csv", "xlsx"])
@@ -410,26 +406,19 @@ with st.sidebar:
         st.session_state.uploaded_file_content = uploaded_file.read()
         st.session_state.uploaded_file_name = uploaded_file.name
     
+    # Read once per file version, not on every rerun
     try:
-        if os.path.exists('taxonomy.json'):
-            with open('taxonomy.json', 'r') as f:
-                taxonomy_data = json.load(f)
-                st.session_state.taxonomy_df = pd.DataFrame(taxonomy_data['taxonomy'])
-            # st.success("Taxonomy Loaded")
-                logging.info(f"Taxonomy Loaded")
+        if os.path.exists(DEFAULT_TAXONOMY_PATH):
+            st.session_state.taxonomy_df = get_taxonomy(DEFAULT_TAXONOMY_PATH, os.path.getmtime(DEFAULT_TAXONOMY_PATH))
         else:
             st.warning("No local 'taxonomy.json' found. Taxonomy-based agents will be limited.")
     except Exception as e:
         st.error(f"Error loading local taxonomy file: {e}")
         st.session_state.taxonomy_df = None
         
-    try:
-        with open('assessment_instructions.yaml', 'r') as f:
-            st.session_state.criteria_content = f.read()
-        # st.success("Assessment Criteria Loaded")
-            logging.info(f'Assessment Criteria Loaded')
-            
-    except FileNotFoundError:
+    if os.path.exists('assessment_instructions.yaml'):
+        st.session_state.criteria_content = load_criteria('assessment_instructions.yaml', os.path.getmtime('assessment_instructions.yaml'))
+    else:
         st.warning("No local 'assessment_instructions.yaml' found. The chatbot will have limited knowledge of specific rules.")
         st.session_state.criteria_content = None
 
@@ -443,25 +432,33 @@ with st.sidebar:
                                              index=verticals.index(st.session_state.vertical))
     st.session_state.is_nexla = st.toggle("Nexla Enabled Merchant?", value=st.session_state.is_nexla)
     
-    default_guides = {
-        "CnG": "[Brand] [Dietary Tag] [Variation] [Item Name] [Container] [Size & UOM]",
-        "Alcohol": "[Brand] [Dietary Tag] [Flavor] [Variation] [Size] [Color] [Age] [Item Name] [Container] [Appellation Location] [Vintage Year] [Size & UOM]",
-        "Office": "[Brand] [Variation] [Size] [Color] [Item Name] [Product Key]",
-        "Home Improvement": "[Brand] [Material/Fabric] [Power] [Variation] [Size] [Color] [Scent] [Item Name] [with Accessories]",
-        "Beauty": "[Brand] [Item Name] [Product Type] [Variation] [Size] [Scent] [Color][Size & UOM]",
-        "Sports": "[Brand] [Age (specific to infant clothing)] [Gender] [Collection/Sub Brand] [Quantity if more than 1, e.g., '2 Pack' or '2 Piece'] [Style] [Color] [Fabric] [Item Name]",
-        "Electronics": "[Brand] [Variant 1] [Variant 2] [Size] [Color] [Item Name] [with Additional Detail] ['(Open Box)']",
-        "Pets": "[Brand] [Item Name] [Variation] [Dietary Tag] [Flavor] [Size] [Color] [Pet/Animal Type] [Container]",
-        "Party": "[Brand/exclude if parent brand] [Variation] [Size] [Color] [Item Name]",
-        "Halloween": "[Brand] [Item Name] [Size] [Quantity]",
-        "Home": "[Brand] [Material/Fabric] [Variation] [Size] [Color] [Scent] [Room] [Item Name]",
-        "Produce": "[Brand] [Variety] [Item Name] [Container] [Size & UOM]",
-        "Outdoor": "[Brand] [Gender/Age] [Variation] [Color] [Size] [Sport/Activity] [Item Name] [Clothing Size]"
-    }
     if st.session_state.style_guide == "" or st.session_state.last_vertical != st.session_state.vertical:
-        st.session_state.style_guide = default_guides.get(st.session_state.vertical, "")
+        st.session_state.style_guide = DEFAULT_STYLE_GUIDES.get(st.session_state.vertical, "")
     st.session_state.last_vertical = st.session_state.vertical
     st.session_state.style_guide = st.text_area("Style Guide", value=st.session_state.style_guide, height=150)
+
+    if st.button("🧮 Estimate cost & time", disabled=(st.session_state.uploaded_file_content is None)):
+        estimate_df = load_and_standardize_dataframe(st.session_state.uploaded_file_content, st.session_state.uploaded_file_name)
+        if estimate_df is not None:
+            with st.spinner("Building sample prompts..."):
+                planned_agents = discover_agents(st.session_state.api_key_validated, st.session_state.is_nexla)
+                for agent in planned_agents:
+                    configure_agent(agent, st.session_state)
+                st.session_state.run_estimate = estimate_run(
+                    estimate_df, planned_agents, vertical=st.session_state.vertical
+                )
+    if st.session_state.run_estimate:
+        estimate = st.session_state.run_estimate
+        col_cost, col_time = st.columns(2)
+        col_cost.metric("Est. cost", f"${estimate['cost_usd']:.2f}", help=f"~${estimate['batch_cost_usd']:.2f} in offline batch mode")
+        col_time.metric("Est. time", f"{estimate['duration_s'] / 60:.1f} min")
+        with st.expander("Estimate by agent"):
+            st.dataframe(pd.DataFrame(estimate["agents"]), width='stretch', hide_index=True)
+            st.caption(f"From {estimate['sample_rows']:,} sample rows and {estimate['history_runs']} past runs.")
+    st.session_state.run_in_background = st.toggle(
+        "Run in background worker", value=st.session_state.run_in_background,
+        help="Queues the run for a local worker process: it keeps going through reruns and page reloads, "
+             "several merchants can be queued, and results can be reopened by job id.")
     run_button = st.button("🚀 Run Assessment", type="primary",
                            disabled=(st.session_state.uploaded_file_content is None))
     
@@ -470,7 +467,19 @@ with st.sidebar:
 # --- Main UI ---
 st.title("✨🚀 Merchant Data Assessment Tool")
 
-if not st.session_state.assessment_done and not run_button:
+job_queue = get_job_queue()
+# A job id in the URL survives reloads: reopen its results, or keep following it while it runs
+requested_job = st.query_params.get("job")
+if requested_job and not run_button and requested_job not in (st.session_state.open_job_id, st.session_state.active_job):
+    job = job_queue.get(requested_job, st.session_state.job_owner)
+    if job is None:
+        st.warning(f"No background job of yours with id `{requested_job}`.")
+    elif job.status == "done":
+        open_job(requested_job)
+    else:
+        st.session_state.active_job = requested_job
+
+if not st.session_state.assessment_done and not run_button and not st.session_state.active_job:
     st.info("👋 Welcome! Upload your data and configure the settings in the sidebar to begin.")
     # st.markdown("ℹ️ Note: The assessment rules and taxonomy are now embedded in the app.")
 
@@ -478,20 +487,44 @@ status_placeholder = st.empty()
 
 if run_button:
     st.session_state.api_tracker = ApiUsageTracker()
-    if st.session_state.uploaded_file_content:
+    clear_results()
+    purge_stale_results()
+    job_queue.purge_finished()
+    st.query_params.pop("job", None)
+    if st.session_state.uploaded_file_content and st.session_state.run_in_background:
+        settings = {key: st.session_state[key] for key in RUN_SETTINGS}
+        job_id = job_queue.submit(st.session_state.uploaded_file_content, st.session_state.uploaded_file_name,
+                                  settings, owner=st.session_state.job_owner, api_key=st.session_state.api_key)
+        if not start_worker(job_queue.jobs_dir):
+            st.error("❌ The background worker did not start; the job stays queued until one runs "
+                     "(`python run_assessment_worker.py`).")
+        st.session_state.active_job = job_id
+        st.query_params["job"] = job_id
+        st.query_params["owner"] = st.session_state.job_owner
+        st.toast(f"Queued job {job_id}.", icon="✅")
+    elif st.session_state.uploaded_file_content:
         status_placeholder.markdown('<h3><span class="spinning-gear">⚙️</span> Running Assessment...</h3>', unsafe_allow_html=True)
         try:
-            df = load_and_standardize_dataframe(st.session_state.uploaded_file_content, st.session_state.uploaded_file_name)
+            profiler = RunProfiler(
+                profile_mode=st.session_state.profile_mode, trace_memory=st.session_state.trace_memory,
+                metadata={"file": st.session_state.uploaded_file_name, "vertical": st.session_state.vertical,
+                          "model": st.session_state.agent_model, "cascade": st.session_state.use_model_cascade},
+            )
+            with profiler.step("Ingestion", kind="ingest"):
+                df = load_and_standardize_dataframe(st.session_state.uploaded_file_content, st.session_state.uploaded_file_name)
             
             if df is not None:
                 st.toast("DataFrame loaded and columns standardized.", icon="✅")
                 with st.spinner('Loading assessment agents...'):
-                    agents = discover_agents()
+                    agents = discover_agents(st.session_state.api_key_validated, st.session_state.is_nexla)
                 
                 st.divider()
                 progress_bar = st.progress(0)
                 progress_text = st.empty()
-                run_assessment_pipeline(agents, df, st.session_state, progress_bar, progress_text)
+                run_assessment_pipeline(agents, df, st.session_state, progress_bar, progress_text, profiler=profiler)
+                previous_runs = load_manifests(last_n=1)
+                st.session_state.previous_manifest = previous_runs[-1] if previous_runs else None
+                st.session_state.run_manifest = profiler.write_manifest({"rows": len(df), **st.session_state.api_tracker.run_stats()})
                 status_placeholder.empty()
             else:
                 status_placeholder.empty()
@@ -503,11 +536,39 @@ if run_button:
             logging.error("Assessment error", exc_info=True)
             st.exception(e)
 
+if st.session_state.active_job:
+    job_progress(st.session_state.active_job)
+
+# --- Background Jobs ---
+recent_jobs = job_queue.list_jobs(st.session_state.job_owner, limit=20)
+if recent_jobs:
+    with st.expander(f"📋 Your background jobs ({sum(not j.finished for j in recent_jobs)} active)"):
+        st.dataframe(pd.DataFrame([{
+            "Job": j.id, "File": j.file_name, "Status": j.status,
+            "Submitted": datetime.fromtimestamp(j.created_at).strftime("%Y-%m-%d %H:%M"),
+            "Vertical": j.settings.get("vertical"), "Error": j.error or "",
+        } for j in recent_jobs]), width='stretch', hide_index=True)
+        j_col1, j_col2 = st.columns([3, 1])
+        open_id = j_col1.text_input("Job id", placeholder="e.g. 20260101-120000-ab12cd", label_visibility="collapsed")
+        if j_col2.button("📂 Open job", disabled=not open_id.strip()):
+            st.query_params["job"] = open_id.strip()
+            st.query_params["owner"] = st.session_state.job_owner
+            st.session_state.open_job_id = st.session_state.active_job = None
+            st.rerun()
+
 # --- Results Display ---
 if st.session_state.assessment_done:
     st.page_link("pages/💬_2_Chat_with_Report.py", label="🧠", width='content')
 
     st.header("📊 Assessment Results")
+
+    budget_status = st.session_state.budget_status
+    if budget_status and budget_status["fallbacks"]:
+        st.warning(
+            f"💰 The run budget ran out (spent ${budget_status['spent_usd']:.4f}, "
+            f"{budget_status['spent_tokens']:,} tokens, {budget_status['elapsed_s']:.0f}s). Some results are rule-based only:\n"
+            + "\n".join(f"- **{f['agent']}**: {f['items']} × {f['detail']}" for f in budget_status["fallbacks"])
+        )
     
     col1, col2 = st.columns(2)
     with col1:
@@ -575,21 +636,24 @@ if st.session_state.assessment_done:
     with tab3:
         st.subheader("⬇️ Download Center")
         st.info("Download the full report or sample files for further analysis.")
+        results, issue_index = st.session_state.results, st.session_state.issue_index
+        # Files are rendered when a button is clicked, not kept in the session
         d_col1, d_col2, d_col3, d_col4 = st.columns(4)
         with d_col1:
-            st.download_button("⬇️ Full Detailed Report (.csv)", st.session_state.assessed_csv, "assessment_results.csv", "text/csv", width='stretch', type='primary')
+            st.download_button("⬇️ Full Detailed Report (.csv)", lambda: results.export_csv("assessed"), "assessment_results.csv", "text/csv", on_click="ignore", width='stretch', type='primary')
         with d_col2:
-            st.download_button("⬇️ Name Check Sample (30 SKUs)", st.session_state.sample_30_csv, "name_check_sample_30_skus.csv", "text/csv", width='stretch', type='primary')
+            st.download_button("⬇️ Name Check Sample (30 SKUs)", lambda: generate_sample_csv(results, issue_index, ["UPC", "IMAGE_URL", "CONSUMER_FACING_ITEM_NAME", "SIZE", "UNIT_OF_MEASUREMENT"], 30, "name_check_sample_30"), "name_check_sample_30_skus.csv", "text/csv", on_click="ignore", width='stretch', type='primary')
         with d_col3:
-            st.download_button("⬇️ Image Check Sample (50 SKUs)", st.session_state.sample_50_csv, "image_check_sample_50_skus.csv", "text/csv", width='stretch', type='primary')
+            st.download_button("⬇️ Image Check Sample (50 SKUs)", lambda: generate_sample_csv(results, issue_index, ["MSID", "IMAGE_URL"], 50, "image_check_sample_50"), "image_check_sample_50_skus.csv", "text/csv", on_click="ignore", width='stretch', type='primary')
         
-        if st.session_state.get("taxonomy_mapping_csv"):
+        if results.has("taxonomy_mapping"):
             with d_col4:
                 st.download_button(
                 label="⬇️ Taxonomy Mapping Assessment (.csv)",
-                data=st.session_state.taxonomy_mapping_csv,
+                data=lambda: results.export_csv("taxonomy_mapping"),
                 file_name="Taxonomy_Mapping_Assessment.csv",
                 mime="text/csv",
+                on_click="ignore",
                 width='stretch',
                 type="primary"
             )
@@ -597,7 +661,7 @@ if st.session_state.assessment_done:
     with tab4:
         st.subheader("🧾 Full Assessed Dataset")
         st.info("This table contains the original data with added assessment columns.")
-        st.dataframe(st.session_state.assessed_df)
+        full_data_view(st.session_state.results, st.session_state.issue_index)
 
     st.divider()
     st.subheader("💰 API Usage & Cost Report")
@@ -605,6 +669,34 @@ if st.session_state.assessment_done:
     usage_df = st.session_state.api_tracker.summary()
     st.dataframe(usage_df, width='stretch')
 
+    with st.expander("⚡ Prompt-cache hits by agent"):
+        st.caption("Share of prompt tokens served from the provider's prefix cache (billed at the cached-input rate).")
+        st.dataframe(st.session_state.api_tracker.cache_summary(), width='stretch')
+
+    with st.expander("🪜 Model cascade hit rates"):
+        st.caption("Items settled by each model tier; the rest escalated to the next, larger model.")
+        st.dataframe(st.session_state.api_tracker.tier_summary(), width='stretch')
+
+    with st.expander("⏱ Performance by agent"):
+        st.caption("Latency, throughput and cost per agent. Local Hits = calls answered by the response cache or shared with an identical in-flight call.")
+        st.dataframe(st.session_state.api_tracker.performance_summary(), width='stretch')
+        col_csv, col_om = st.columns(2)
+        with col_csv:
+            st.download_button("⬇️ Call log (CSV)", st.session_state.api_tracker.export_csv(),
+                               file_name="llm_calls.csv", mime="text/csv")
+        with col_om:
+            st.download_button("⬇️ Metrics (OpenMetrics)", st.session_state.api_tracker.export_openmetrics(),
+                               file_name="llm_metrics.txt", mime="application/openmetrics-text")
+
+    if st.session_state.run_manifest:
+        with st.expander("🩺 Run profile"):
+            manifest = st.session_state.run_manifest
+            st.caption(f"Run {manifest['run_id']}: wall and CPU time, throughput and memory per step. "
+                       "Δ Wall compares each step with the previous run.")
+            st.dataframe(pd.DataFrame(compare_steps(manifest, st.session_state.previous_manifest)), width='stretch', hide_index=True)
+            st.download_button("⬇️ Run manifest (JSON)", json.dumps(manifest, indent=2, default=str),
+                               file_name=f"run_manifest_{manifest['run_id']}.json", mime="application/json")
+
     st.info("Use the Chat tab to ask AI questions about this report.")
 
 
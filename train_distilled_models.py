@@ -0,0 +1,31 @@
+import argparse
+import json
+
+from agents.distilled_classifier import DEFAULT_STORE_DIR, load_verdicts, train_from_verdicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local Exclusion/Category classifiers from recorded AI verdicts.")
+    parser.add_argument("--task", choices=["exclusion", "category", "all"], default="all")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of verdicts held out for the agreement report")
+    parser.add_argument("--min-samples", type=int, default=200, help="Skip tasks with fewer recorded verdicts")
+    parser.add_argument("--store-dir", default=DEFAULT_STORE_DIR, help="Where verdicts and models are stored")
+    args = parser.parse_args()
+
+    tasks = ["exclusion", "category"] if args.task == "all" else [args.task]
+    for task in tasks:
+        n = len(load_verdicts(task, args.store_dir))
+        print(f"🔎 {task}: {n} recorded verdicts")
+        clf = train_from_verdicts(task, holdout=args.holdout, min_samples=args.min_samples, store_dir=args.store_dir)
+        if clf is None:
+            print(f"⚠️ Skipped {task}: need at least {args.min_samples} verdicts.")
+            continue
+        report = clf.report
+        print(f"✅ {task}: {len(clf.classes_)} labels, held-out agreement {report['agreement']:.1%} on {report['n_test']} verdicts")
+        for row in report["by_threshold"]:
+            agreement = "n/a" if row["agreement"] is None else f"{row['agreement']:.1%}"
+            print(f"   confidence ≥ {row['min_confidence']:.2f}: answers {row['coverage']:.1%} of items, agreement {agreement}")
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
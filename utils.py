@@ -1,5 +1,4 @@
 import streamlit as st
-from openai import OpenAI
 import logging
 
 # Configure logging
@@ -13,6 +12,7 @@ def validate_api_key(api_key: str) -> tuple[bool, str]:
     if not api_key:
         return False, "API key has not been entered."
     try:
+        from openai import OpenAI  # deferred: only needed once a key is entered
         client = OpenAI(api_key=api_key)
         client.models.list()
         logging.info("API key validation successful.")